@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 import base64
-import bz2
 import hashlib
 import io
 import json
@@ -17,7 +16,7 @@ import time
 from collections import namedtuple
 from datetime import datetime
 from functools import partial
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 import requests
 from jsonrpc import JSONRPCResponseManager, dispatcher
@@ -29,11 +28,11 @@ from cereal import log
 from cereal.services import service_list
 from common.api import Api
 from common.basedir import PERSIST
-from common.file_helpers import CallbackReader
 from common.params import Params
 from common.realtime import sec_since_boot, set_core_affinity
 from system.hardware import HARDWARE, PC, AGNOS
 from selfdrive.loggerd.config import ROOT
+from selfdrive.loggerd.streaming_upload import upload_file
 from selfdrive.loggerd.xattr_cache import getxattr, setxattr
 from selfdrive.statsd import STATS_DIR
 from system.swaglog import SWAGLOG_DIR, cloudlog
@@ -52,20 +51,153 @@ MAX_RETRY_COUNT = 30  # Try for at most 5 minutes if upload fails immediately
 MAX_AGE = 31 * 24 * 3600  # seconds
 WS_FRAME_SIZE = 4096
 
+UPLOAD_THREADS = int(os.getenv('UPLOAD_THREADS', "4"))  # most uploads running at once
+THROUGHPUT_WINDOW = 10  # seconds, the number of uploads running at once is adjusted this often
+NETWORK_CHECK_INTERVAL = 1  # seconds
+CACHE_INTERVAL = 1  # seconds, the upload queue is persisted at most this often
+
+LOG_WINDOW = int(os.getenv('LOG_WINDOW', "4"))  # forwardLogs requests waiting for a response at most
+LOG_BATCH_SIZE = 512 * 1024  # bytes of logs per forwardLogs request
+LOG_RESPONSE_TIMEOUT = 100  # seconds
+
 NetworkType = log.DeviceState.NetworkType
 
 dispatcher["echo"] = lambda s: s
 recv_queue: Any = queue.Queue()
 send_queue: Any = queue.Queue()
-upload_queue: Any = queue.Queue()
+upload_queue: Any = None
 low_priority_send_queue: Any = queue.Queue()
 log_recv_queue: Any = queue.Queue()
 cancelled_uploads: Any = set()
-UploadItem = namedtuple('UploadItem', ['path', 'url', 'headers', 'created_at', 'id', 'retry_count', 'current', 'progress', 'allow_cellular'], defaults=(0, False, 0, False))
+UploadItem = namedtuple('UploadItem', ['path', 'url', 'headers', 'created_at', 'id', 'retry_count', 'current', 'progress', 'allow_cellular',
+                                       'priority', 'deadline'], defaults=(0, False, 0, False, 0, None))
 
 cur_upload_items: Dict[int, Any] = {}
 
 
+def upload_sort_key(item):
+  # highest priority first, then earliest deadline
+  return (-item.priority, item.deadline if item.deadline is not None else float('inf'))
+
+
+class UploadQueue(queue.Queue):
+  """Queue of upload items sorted by upload_sort_key, in the order they were added otherwise.
+  Deferred items, which couldn't be uploaded on the current network, go behind all others."""
+  def _init(self, maxsize):
+    self.queue: List[Any] = []
+    self.deferred: Set[str] = set()
+
+  def _qsize(self):
+    return len(self.queue)
+
+  def _key(self, item):
+    return (item.id in self.deferred, upload_sort_key(item))
+
+  def _put(self, item):
+    # insert after items with the same key
+    key = self._key(item)
+    lo, hi = 0, len(self.queue)
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if key < self._key(self.queue[mid]):
+        hi = mid
+      else:
+        lo = mid + 1
+    self.queue.insert(lo, item)
+
+  def _get(self):
+    item = self.queue.pop(0)
+    self.deferred.discard(item.id)
+    return item
+
+  def put_deferred(self, item):
+    with self.mutex:
+      self.deferred.add(item.id)
+    self.put_nowait(item)
+
+
+upload_queue = UploadQueue()
+
+
+class UploadScheduler:
+  """Shared by the upload handlers: limits how many uploads run at once, adjusting it to the measured
+  throughput, and caches the network state. With a bandwidth limit on cellular, uploads run one at a time,
+  the limit itself is applied by the kernel."""
+  def __init__(self, max_uploads: int = UPLOAD_THREADS):
+    self.max_uploads = max_uploads
+    self.concurrency = 1
+    self.active = 0
+    self.cv = threading.Condition()
+
+    self.sm = None
+    self.last_network_check = float('-inf')
+    self.metered = False
+    self.network_type = NetworkType.none
+
+    self.upload_limit = 0  # bytes/s, 0 without limit
+    self.window_start = time.monotonic()
+    self.window_bytes = 0
+    self.last_progress = self.window_start
+    self.last_throughput = 0.
+
+  def acquire(self, timeout: float) -> bool:
+    with self.cv:
+      if not self.cv.wait_for(lambda: self.active < self.concurrency, timeout):
+        return False
+      self.active += 1
+      return True
+
+  def release(self) -> None:
+    with self.cv:
+      self.active -= 1
+      self.cv.notify()
+
+  def network(self) -> Tuple[bool, int]:
+    """Returns whether the network is metered and its type, updated at most every NETWORK_CHECK_INTERVAL"""
+    with self.cv:
+      if time.monotonic() - self.last_network_check > NETWORK_CHECK_INTERVAL:
+        if self.sm is None:
+          self.sm = messaging.SubMaster(['deviceState'])
+        self.sm.update(0)
+        self.metered = self.sm['deviceState'].networkMetered
+        self.network_type = self.sm['deviceState'].networkType.raw
+        self.last_network_check = time.monotonic()
+      return self.metered, self.network_type
+
+  def limited(self) -> bool:
+    return self.upload_limit > 0 and self.network_type not in (NetworkType.wifi, NetworkType.ethernet)
+
+  def set_upload_limit(self, upload_speed_kbps: int) -> None:
+    with self.cv:
+      self.upload_limit = max(int(upload_speed_kbps), 0) * 1000 // 8
+
+  def on_progress(self, nbytes: int) -> None:
+    """Called by uploads with the bytes sent since their last call"""
+    with self.cv:
+      now = time.monotonic()
+      if now - self.last_progress > THROUGHPUT_WINDOW:
+        # nothing was sent for a whole window, the idle time doesn't count towards the throughput
+        self.window_start, self.window_bytes = now, 0
+      self.last_progress = now
+      self.window_bytes += nbytes
+      dt = now - self.window_start
+      if dt > THROUGHPUT_WINDOW:
+        throughput = self.window_bytes / dt
+        if self.limited():
+          # more uploads only split the limited bandwidth
+          self.concurrency = 1
+        elif throughput > 1.1 * self.last_throughput and self.active >= self.concurrency:
+          self.concurrency = min(self.concurrency + 1, self.max_uploads)
+        elif throughput < 0.9 * self.last_throughput and self.active >= self.concurrency:
+          self.concurrency = max(self.concurrency - 1, 1)
+        self.cv.notify_all()
+        self.last_throughput = throughput
+        self.window_start, self.window_bytes = now, 0
+
+
+upload_scheduler = UploadScheduler()
+
+
 def strip_bz2_extension(fn):
   if fn.endswith('.bz2'):
     return fn[:-4]
@@ -78,6 +210,9 @@ class AbortTransferException(Exception):
 
 class UploadQueueCache():
   params = Params()
+  dirty = False
+  last_cache_time = float('-inf')
+  last_cached: Optional[str] = None
 
   @staticmethod
   def initialize(upload_queue):
@@ -93,10 +228,25 @@ class UploadQueueCache():
   def cache(upload_queue):
     try:
       items = [i._asdict() for i in upload_queue.queue if i.id not in cancelled_uploads]
-      UploadQueueCache.params.put("AthenadUploadQueue", json.dumps(items))
+      upload_queue_json = json.dumps(items)
+      UploadQueueCache.dirty = False
+      UploadQueueCache.last_cache_time = time.monotonic()
+      if upload_queue_json != UploadQueueCache.last_cached:
+        UploadQueueCache.params.put("AthenadUploadQueue", upload_queue_json)
+        UploadQueueCache.last_cached = upload_queue_json
     except Exception:
       cloudlog.exception("athena.UploadQueueCache.cache.exception")
 
+  @staticmethod
+  def mark_dirty():
+    UploadQueueCache.dirty = True
+
+  @staticmethod
+  def flush(upload_queue, force=False):
+    """Persists changes of the queue, at most every CACHE_INTERVAL unless forced"""
+    if UploadQueueCache.dirty and (force or time.monotonic() - UploadQueueCache.last_cache_time > CACHE_INTERVAL):
+      UploadQueueCache.cache(upload_queue)
+
 
 def handle_long_poll(ws):
   end_event = threading.Event()
@@ -104,9 +254,11 @@ def handle_long_poll(ws):
   threads = [
     threading.Thread(target=ws_recv, args=(ws, end_event), name='ws_recv'),
     threading.Thread(target=ws_send, args=(ws, end_event), name='ws_send'),
-    threading.Thread(target=upload_handler, args=(end_event,), name='upload_handler'),
     threading.Thread(target=log_handler, args=(end_event,), name='log_handler'),
     threading.Thread(target=stat_handler, args=(end_event,), name='stat_handler'),
+  ] + [
+    threading.Thread(target=upload_handler, args=(end_event,), name=f'upload_handler_{x}')
+    for x in range(upload_scheduler.max_uploads)
   ] + [
     threading.Thread(target=jsonrpc_handler, args=(end_event,), name=f'worker_{x}')
     for x in range(HANDLER_THREADS)
@@ -116,6 +268,7 @@ def handle_long_poll(ws):
     thread.start()
   try:
     while not end_event.is_set():
+      UploadQueueCache.flush(upload_queue)
       time.sleep(0.1)
   except (KeyboardInterrupt, SystemExit):
     end_event.set()
@@ -124,6 +277,7 @@ def handle_long_poll(ws):
     for thread in threads:
       cloudlog.debug(f"athena.joining {thread.name}")
       thread.join()
+    UploadQueueCache.flush(upload_queue, force=True)
 
 
 def jsonrpc_handler(end_event):
@@ -146,7 +300,9 @@ def jsonrpc_handler(end_event):
       send_queue.put_nowait(json.dumps({"error": str(e)}))
 
 
-def retry_upload(tid: int, end_event: threading.Event, increase_count: bool = True) -> None:
+def retry_upload(tid: int, increase_count: bool = True, defer: bool = False) -> bool:
+  """Puts the current item back in the queue, deferred behind the others if it can't be uploaded
+  on the current network. Returns whether it was put back, the caller backs off then."""
   if cur_upload_items[tid].retry_count < MAX_RETRY_COUNT:
     item = cur_upload_items[tid]
     new_retry_count = item.retry_count + 1 if increase_count else item.retry_count
@@ -156,25 +312,37 @@ def retry_upload(tid: int, end_event: threading.Event, increase_count: bool = Tr
       progress=0,
       current=False
     )
-    upload_queue.put_nowait(item)
-    UploadQueueCache.cache(upload_queue)
+    if defer:
+      upload_queue.put_deferred(item)
+    else:
+      upload_queue.put_nowait(item)
+    UploadQueueCache.mark_dirty()
 
     cur_upload_items[tid] = None
-
-    for _ in range(RETRY_DELAY):
-      time.sleep(1)
-      if end_event.is_set():
-        break
+    return True
+  return False
 
 
 def upload_handler(end_event: threading.Event) -> None:
-  sm = messaging.SubMaster(['deviceState'])
   tid = threading.get_ident()
+  backoff = False
 
   while not end_event.is_set():
     cur_upload_items[tid] = None
 
+    # back off after a retry without holding a slot, so other handlers keep uploading
+    if backoff:
+      backoff = False
+      end_event.wait(RETRY_DELAY)
+      continue
+
+    # wait for the scheduler to allow another upload
+    if not upload_scheduler.acquire(timeout=1):
+      continue
+
     try:
+      if end_event.is_set():
+        break
       cur_upload_items[tid] = upload_queue.get(timeout=1)._replace(current=True)
 
       if cur_upload_items[tid].id in cancelled_uploads:
@@ -187,24 +355,35 @@ def upload_handler(end_event: threading.Event) -> None:
         cloudlog.event("athena.upload_handler.expired", item=cur_upload_items[tid], error=True)
         continue
 
+      # Remove item if it's not needed anymore
+      deadline = cur_upload_items[tid].deadline
+      if deadline is not None and time.time() * 1000 > deadline:
+        cloudlog.event("athena.upload_handler.deadline_passed", item=cur_upload_items[tid], error=True)
+        continue
+
       # Check if uploading over metered connection is allowed
-      sm.update(0)
-      metered = sm['deviceState'].networkMetered
-      network_type = sm['deviceState'].networkType.raw
+      metered, network_type = upload_scheduler.network()
       if metered and (not cur_upload_items[tid].allow_cellular):
-        retry_upload(tid, end_event, False)
+        backoff = retry_upload(tid, False, defer=True)
         continue
 
       try:
+        sent = 0
+
         def cb(sz, cur):
           # Abort transfer if connection changed to metered after starting upload
-          sm.update(0)
-          metered = sm['deviceState'].networkMetered
+          metered, _ = upload_scheduler.network()
           if metered and (not cur_upload_items[tid].allow_cellular):
             raise AbortTransferException
 
           cur_upload_items[tid] = cur_upload_items[tid]._replace(progress=cur / sz if sz else 1)
 
+        def sent_cb(cur):
+          # throughput is measured on the bytes sent, less than read when compressing
+          nonlocal sent
+          upload_scheduler.on_progress(cur - sent)
+          sent = cur
+
         fn = cur_upload_items[tid].path
         try:
           sz = os.path.getsize(fn)
@@ -212,29 +391,31 @@ def upload_handler(end_event: threading.Event) -> None:
           sz = -1
 
         cloudlog.event("athena.upload_handler.upload_start", fn=fn, sz=sz, network_type=network_type, metered=metered, retry_count=cur_upload_items[tid].retry_count)
-        response = _do_upload(cur_upload_items[tid], cb)
+        response = _do_upload(cur_upload_items[tid], cb, sent_cb)
 
         if response.status_code not in (200, 201, 401, 403, 412):
           cloudlog.event("athena.upload_handler.retry", status_code=response.status_code, fn=fn, sz=sz, network_type=network_type, metered=metered)
-          retry_upload(tid, end_event)
+          backoff = retry_upload(tid)
         else:
           cloudlog.event("athena.upload_handler.success", fn=fn, sz=sz, network_type=network_type, metered=metered)
 
-        UploadQueueCache.cache(upload_queue)
+        UploadQueueCache.mark_dirty()
       except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, requests.exceptions.SSLError):
         cloudlog.event("athena.upload_handler.timeout", fn=fn, sz=sz, network_type=network_type, metered=metered)
-        retry_upload(tid, end_event)
+        backoff = retry_upload(tid)
       except AbortTransferException:
         cloudlog.event("athena.upload_handler.abort", fn=fn, sz=sz, network_type=network_type, metered=metered)
-        retry_upload(tid, end_event, False)
+        backoff = retry_upload(tid, False, defer=True)
 
     except queue.Empty:
       pass
     except Exception:
       cloudlog.exception("athena.upload_handler.exception")
+    finally:
+      upload_scheduler.release()
 
 
-def _do_upload(upload_item, callback=None):
+def _do_upload(upload_item, callback=None, sent_callback=None):
   path = upload_item.path
   compress = False
 
@@ -243,23 +424,11 @@ def _do_upload(upload_item, callback=None):
     path = strip_bz2_extension(path)
     compress = True
 
-  with open(path, "rb") as f:
-    if compress:
-      cloudlog.event("athena.upload_handler.compress", fn=path, fn_orig=upload_item.path)
-      data = bz2.compress(f.read())
-      size = len(data)
-      data = io.BytesIO(data)
-    else:
-      size = os.fstat(f.fileno()).st_size
-      data = f
+  if compress:
+    cloudlog.event("athena.upload_handler.compress", fn=path, fn_orig=upload_item.path)
 
-    if callback:
-      data = CallbackReader(data, callback, size)
-
-    return requests.put(upload_item.url,
-                        data=data,
-                        headers={**upload_item.headers, 'Content-Length': str(size)},
-                        timeout=30)
+  return upload_file(upload_item.url, upload_item.headers, path, compress=compress, callback=callback, timeout=30,
+                     sent_callback=sent_callback)
 
 
 # security: user should be able to request any message from their car
@@ -353,6 +522,7 @@ def uploadFileToUrl(fn, url, headers):
 def uploadFilesToUrls(files_data):
   items = []
   failed = []
+  queued_urls = {item['url'].split('?')[0] for item in listUploadQueue()}
   for file in files_data:
     fn = file.get('fn', '')
     if len(fn) == 0 or fn[0] == '/' or '..' in fn or 'url' not in file:
@@ -364,10 +534,21 @@ def uploadFilesToUrls(files_data):
       failed.append(fn)
       continue
 
+    # sort keys of the queue, malformed ones would break its order
+    try:
+      priority = int(file.get('priority', 0))
+      deadline = file.get('deadline')
+      if deadline is not None:
+        deadline = int(deadline)
+    except (TypeError, ValueError, OverflowError):
+      failed.append(fn)
+      continue
+
     # Skip item if already in queue
     url = file['url'].split('?')[0]
-    if any(url == item['url'].split('?')[0] for item in listUploadQueue()):
+    if url in queued_urls:
       continue
+    queued_urls.add(url)
 
     item = UploadItem(
       path=path,
@@ -376,6 +557,8 @@ def uploadFilesToUrls(files_data):
       created_at=int(time.time() * 1000),
       id=None,
       allow_cellular=file.get('allow_cellular', False),
+      priority=priority,
+      deadline=deadline,
     )
     upload_id = hashlib.sha1(str(item).encode()).hexdigest()
     item = item._replace(id=upload_id)
@@ -423,6 +606,7 @@ def setBandwithLimit(upload_speed_kbps, download_speed_kbps):
 
   try:
     HARDWARE.set_bandwidth_limit(upload_speed_kbps, download_speed_kbps)
+    upload_scheduler.set_upload_limit(upload_speed_kbps)
     return {"success": 1}
   except subprocess.CalledProcessError as e:
     return {"success": 0, "error": "failed to set limit", "stdout": e.stdout, "stderr": e.stderr}
@@ -514,80 +698,125 @@ def takeSnapshot():
     raise Exception("not available while camerad is started")
 
 
-def get_logs_to_send_sorted():
-  # TODO: scan once then use inotify to detect file creation/deletion
-  curr_time = int(time.time())
-  logs = []
-  for log_entry in os.listdir(SWAGLOG_DIR):
-    log_path = os.path.join(SWAGLOG_DIR, log_entry)
-    try:
-      time_sent = int.from_bytes(getxattr(log_path, LOG_ATTR_NAME), sys.byteorder)
-    except (ValueError, TypeError):
-      time_sent = 0
+class LogIndex:
+  """Swaglog files and when they were sent. The directory is only listed again when its mtime
+  changed, and the xattr of a file is only read the first time it's seen."""
+  def __init__(self, log_dir):
+    self.log_dir = log_dir
+    self.mtime: Optional[int] = None
+    self.time_sent: Dict[str, int] = {}
+
+  def update(self) -> None:
+    st = os.stat(self.log_dir)
+    if st.st_mtime_ns == self.mtime:
+      return
+    # files created within the same timestamp tick could be missed, so recent changes are listed again
+    self.mtime = st.st_mtime_ns if time.time_ns() - st.st_mtime_ns > 1e9 else None
+
+    log_entries = set(os.listdir(self.log_dir))
+    for log_entry in set(self.time_sent) - log_entries:
+      del self.time_sent[log_entry]
+    for log_entry in log_entries - set(self.time_sent):
+      try:
+        self.time_sent[log_entry] = int.from_bytes(getxattr(os.path.join(self.log_dir, log_entry), LOG_ATTR_NAME), sys.byteorder)
+      except (ValueError, TypeError, OSError):
+        self.time_sent[log_entry] = 0
+
+  def to_send(self) -> List[str]:
+    curr_time = int(time.time())
     # assume send failed and we lost the response if sent more than one hour ago
-    if not time_sent or curr_time - time_sent > 3600:
-      logs.append(log_entry)
-  # excluding most recent (active) log file
-  return sorted(logs)[:-1]
+    logs = [log_entry for log_entry, time_sent in self.time_sent.items() if not time_sent or curr_time - time_sent > 3600]
+    # excluding most recent (active) log file
+    return sorted(logs)[:-1]
+
+  def set_sent(self, log_entry: str, value: bytes) -> None:
+    self.time_sent[log_entry] = int.from_bytes(value, sys.byteorder)
+    setxattr(os.path.join(self.log_dir, log_entry), LOG_ATTR_NAME, value)
+
+  def mark_sent(self, log_entry: str) -> None:
+    self.set_sent(log_entry, int.to_bytes(int(time.time()), 4, sys.byteorder))
+
+  def mark_done(self, log_entry: str) -> None:
+    self.set_sent(log_entry, LOG_ATTR_VALUE_MAX_UNIX_TIME)
+
+
+def send_log_batch(index: LogIndex, log_files: List[str]) -> Optional[Tuple[str, List[str]]]:
+  """Sends the newest log files in one forwardLogs request, up to LOG_BATCH_SIZE bytes.
+  Returns the request id and the files sent."""
+  batch: List[str] = []
+  logs: List[str] = []
+  size = 0
+  while len(log_files) and size < LOG_BATCH_SIZE:
+    log_entry = log_files.pop()  # newest log file
+    try:
+      index.mark_sent(log_entry)
+      with open(os.path.join(SWAGLOG_DIR, log_entry)) as f:
+        logs.append(f.read())
+      batch.append(log_entry)
+      size += len(logs[-1])
+    except OSError:
+      pass  # file could be deleted by log rotation
+
+  if not len(batch):
+    return None
+
+  # oldest first, the id is the newest file
+  jsonrpc = {
+    "method": "forwardLogs",
+    "params": {
+      "logs": "".join(reversed(logs))
+    },
+    "jsonrpc": "2.0",
+    "id": batch[0]
+  }
+  cloudlog.debug(f"athena.log_handler.forward_request {batch}")
+  low_priority_send_queue.put_nowait(json.dumps(jsonrpc))
+  return batch[0], batch
 
 
 def log_handler(end_event):
   if PC:
     return
 
-  log_files = []
-  last_scan = 0
+  index = LogIndex(SWAGLOG_DIR)
+  log_files: List[str] = []
+  in_flight: Dict[str, Tuple[float, List[str]]] = {}  # request id: (time sent, files)
+  last_scan = 0.
   while not end_event.is_set():
     try:
       curr_scan = sec_since_boot()
       if curr_scan - last_scan > 10:
-        log_files = get_logs_to_send_sorted()
+        index.update()
+        sending = {log_entry for _, batch in in_flight.values() for log_entry in batch}
+        log_files = [log_entry for log_entry in index.to_send() if log_entry not in sending]
         last_scan = curr_scan
 
-      # send one log
-      curr_log = None
-      if len(log_files) > 0:
-        log_entry = log_files.pop() # newest log file
-        cloudlog.debug(f"athena.log_handler.forward_request {log_entry}")
-        try:
-          curr_time = int(time.time())
-          log_path = os.path.join(SWAGLOG_DIR, log_entry)
-          setxattr(log_path, LOG_ATTR_NAME, int.to_bytes(curr_time, 4, sys.byteorder))
-          with open(log_path) as f:
-            jsonrpc = {
-              "method": "forwardLogs",
-              "params": {
-                "logs": f.read()
-              },
-              "jsonrpc": "2.0",
-              "id": log_entry
-            }
-            low_priority_send_queue.put_nowait(json.dumps(jsonrpc))
-            curr_log = log_entry
-        except OSError:
-          pass  # file could be deleted by log rotation
+      # keep up to LOG_WINDOW requests in flight
+      while len(log_files) and len(in_flight) < LOG_WINDOW:
+        sent = send_log_batch(index, log_files)
+        if sent is not None:
+          in_flight[sent[0]] = (sec_since_boot(), sent[1])
 
-      # wait for response up to ~100 seconds
       # always read queue at least once to process any old responses that arrive
-      for _ in range(100):
-        if end_event.is_set():
-          break
-        try:
-          log_resp = json.loads(log_recv_queue.get(timeout=1))
-          log_entry = log_resp.get("id")
-          log_success = "result" in log_resp and log_resp["result"].get("success")
-          cloudlog.debug(f"athena.log_handler.forward_response {log_entry} {log_success}")
-          if log_entry and log_success:
-            log_path = os.path.join(SWAGLOG_DIR, log_entry)
+      try:
+        log_resp = json.loads(log_recv_queue.get(timeout=1))
+        log_entry = log_resp.get("id")
+        log_success = "result" in log_resp and log_resp["result"].get("success")
+        cloudlog.debug(f"athena.log_handler.forward_response {log_entry} {log_success}")
+        _, batch = in_flight.pop(log_entry, (0., [log_entry] if log_entry else []))
+        if log_success:
+          for log_entry in batch:
             try:
-              setxattr(log_path, LOG_ATTR_NAME, LOG_ATTR_VALUE_MAX_UNIX_TIME)
+              index.mark_done(log_entry)
             except OSError:
               pass  # file could be deleted by log rotation
-          if curr_log == log_entry:
-            break
-        except queue.Empty:
-          if curr_log is None:
-            break
+      except queue.Empty:
+        pass
+
+      # give up waiting for responses after ~100 seconds, the files are sent again after an hour
+      for request_id, (time_sent, _) in list(in_flight.items()):
+        if sec_since_boot() - time_sent > LOG_RESPONSE_TIMEOUT:
+          del in_flight[request_id]
 
     except Exception:
       cloudlog.exception("athena.log_handler.exception")
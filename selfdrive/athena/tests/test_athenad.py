@@ -35,7 +35,7 @@ class TestAthenadMethods(unittest.TestCase):
 
   def setUp(self):
     MockParams.restore_defaults()
-    athenad.upload_queue = queue.Queue()
+    athenad.upload_queue = athenad.UploadQueue()
     athenad.cur_upload_items.clear()
     athenad.cancelled_uploads.clear()
 
@@ -170,6 +170,54 @@ class TestAthenadMethods(unittest.TestCase):
     not_exists_resp = dispatcher["uploadFileToUrl"]("does_not_exist.bz2", "http://localhost:1238", {})
     self.assertEqual(not_exists_resp, {'enqueued': 0, 'items': [], 'failed': ['does_not_exist.bz2']})
 
+  def test_uploadFilesToUrls_invalid_priority(self):
+    fn = os.path.join(athenad.ROOT, 'qlog.bz2')
+    Path(fn).touch()
+
+    files = [{"fn": "qlog.bz2", "url": f"http://localhost:44444/qlog{i}.bz2", **kw}
+             for i, kw in enumerate([{"priority": "high"}, {"deadline": [1]}, {"priority": "2", "deadline": 1e15}])]
+    resp = dispatcher["uploadFilesToUrls"](files)
+    self.assertEqual(resp['failed'], ['qlog.bz2', 'qlog.bz2'])
+    self.assertEqual(resp['enqueued'], 1)
+    self.assertEqual((resp['items'][0]['priority'], resp['items'][0]['deadline']), (2, 10**15))
+
+  def test_upload_scheduler(self):
+    now = 0.
+    with mock.patch('time.monotonic', side_effect=lambda: now):
+      scheduler = athenad.UploadScheduler(max_uploads=2)
+
+      # one upload at a time at first
+      self.assertTrue(scheduler.acquire(timeout=0))
+      self.assertFalse(scheduler.acquire(timeout=0))
+      scheduler.release()
+      self.assertTrue(scheduler.acquire(timeout=0))
+
+      # grows while the throughput increases with all slots in use
+      for now, nbytes in ((5., 1000), (11., 1000)):
+        scheduler.on_progress(nbytes)
+      self.assertEqual(scheduler.concurrency, 2)
+      self.assertTrue(scheduler.acquire(timeout=0))
+      self.assertFalse(scheduler.acquire(timeout=0))
+
+      # shrinks when it drops
+      for now, nbytes in ((15., 10), (22., 10)):
+        scheduler.on_progress(nbytes)
+      self.assertEqual(scheduler.concurrency, 1)
+
+      # time without uploads isn't measured as low throughput
+      scheduler.concurrency = 2
+      for now, nbytes in ((100., 10), (105., 10)):
+        scheduler.on_progress(nbytes)
+      self.assertEqual((scheduler.concurrency, scheduler.window_start), (2, 100.))
+
+      # one upload at a time with a bandwidth limit on cellular, not on wifi
+      scheduler.set_upload_limit(1000)
+      for network_type, concurrency in ((athenad.NetworkType.wifi, 2), (athenad.NetworkType.cell4G, 1)):
+        scheduler.network_type = network_type
+        for now in (now + 5, now + 11):
+          scheduler.on_progress(10000)
+        self.assertEqual(scheduler.concurrency, concurrency)
+
   @with_http_server
   def test_upload_handler(self, host):
     fn = os.path.join(athenad.ROOT, 'qlog.bz2')
@@ -191,7 +239,7 @@ class TestAthenadMethods(unittest.TestCase):
       end_event.set()
 
   @with_http_server
-  @mock.patch('requests.put')
+  @mock.patch('requests.Session.put')
   def test_upload_handler_retry(self, host, mock_put):
     for status, retry in ((500, True), (412, False)):
       mock_put.return_value.status_code = status
@@ -344,6 +392,29 @@ class TestAthenadMethods(unittest.TestCase):
     self.assertEqual(athenad.upload_queue.qsize(), 1)
     self.assertDictEqual(athenad.upload_queue.queue[-1]._asdict(), item1._asdict())
 
+  def test_upload_queue_order(self):
+    now = int(time.time() * 1000)
+    def make_item(id, **kwargs):
+      return athenad.UploadItem(path="_", url="_", headers={}, created_at=now, id=id, **kwargs)
+
+    items = [make_item('a'), make_item('b', priority=1), make_item('c'), make_item('d', priority=1, deadline=now + 1000),
+             make_item('e', deadline=now + 2000), make_item('f', deadline=now + 1000)]
+    for item in items:
+      athenad.upload_queue.put_nowait(item)
+
+    # highest priority first, then earliest deadline, then in the order added
+    self.assertEqual([i['id'] for i in dispatcher["listUploadQueue"]()], ['d', 'b', 'f', 'e', 'a', 'c'])
+    self.assertEqual([athenad.upload_queue.get_nowait().id for _ in items], ['d', 'b', 'f', 'e', 'a', 'c'])
+
+    # items that couldn't be uploaded on the current network go behind the others until taken
+    athenad.upload_queue.put_deferred(make_item('a', priority=2))
+    athenad.upload_queue.put_nowait(make_item('b'))
+    athenad.upload_queue.put_nowait(make_item('c', priority=1))
+    self.assertEqual([athenad.upload_queue.get_nowait().id for _ in range(3)], ['c', 'b', 'a'])
+    athenad.upload_queue.put_nowait(make_item('a', priority=2))
+    athenad.upload_queue.put_nowait(make_item('b'))
+    self.assertEqual(athenad.upload_queue.get_nowait().id, 'a')
+
   @mock.patch('selfdrive.athena.athenad.create_connection')
   def test_startLocalProxy(self, mock_create_connection):
     end_event = threading.Event()
@@ -410,8 +481,45 @@ class TestAthenadMethods(unittest.TestCase):
       fl.append(os.path.basename(fn))
 
     # ensure the list is all logs except most recent
-    sl = athenad.get_logs_to_send_sorted()
+    index = athenad.LogIndex(swaglog.SWAGLOG_DIR)
+    index.update()
+    sl = index.to_send()
     self.assertListEqual(sl, fl[:-1])
 
+  def test_log_batches(self):
+    for fn in os.listdir(swaglog.SWAGLOG_DIR):
+      os.unlink(os.path.join(swaglog.SWAGLOG_DIR, fn))
+    fl = list()
+    for i in range(10):
+      fn = f'swaglog.{i:010}'
+      with open(os.path.join(swaglog.SWAGLOG_DIR, fn), 'w') as f:
+        f.write(f"{i}\n" * (athenad.LOG_BATCH_SIZE // 8))
+      fl.append(fn)
+
+    index = athenad.LogIndex(swaglog.SWAGLOG_DIR)
+    index.update()
+    log_files = index.to_send()
+    self.assertListEqual(log_files, fl[:-1])
+
+    # newest files first, a batch holds files up to LOG_BATCH_SIZE
+    request_id, batch = athenad.send_log_batch(index, log_files)
+    self.assertEqual(request_id, fl[8])
+    self.assertListEqual(batch, fl[8:4:-1])
+    logs = json.loads(athenad.low_priority_send_queue.get_nowait())['params']['logs']
+    self.assertTrue(logs.startswith("5\n") and logs.endswith("8\n"))
+
+    # sent files aren't sent again, unless they weren't acknowledged within an hour
+    index.update()
+    self.assertListEqual(index.to_send(), fl[:5])
+    for fn in batch:
+      index.mark_done(fn)
+    with mock.patch('time.time', return_value=time.time() + 3601):
+      self.assertListEqual(index.to_send(), fl[:5])
+
+    # new files are picked up
+    Path(os.path.join(swaglog.SWAGLOG_DIR, 'swaglog.0000000010')).touch()
+    index.update()
+    self.assertListEqual(index.to_send(), fl[:5] + fl[9:])
+
 if __name__ == '__main__':
   unittest.main()
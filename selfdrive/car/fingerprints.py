@@ -1,3 +1,6 @@
+from collections import defaultdict
+from typing import Dict, Tuple
+
 from selfdrive.car.interfaces import get_interface_attr
 
 
@@ -13,6 +16,35 @@ def is_valid_for_fingerprint(msg, car_fingerprint):
   return (adr in car_fingerprint and car_fingerprint[adr] == len(msg.dat)) or adr >= 0x800
 
 
+def _build_fingerprint_masks():
+  """(address, length) -> bitmask of the cars with a fingerprint containing that message,
+     where bit i is FINGERPRINT_CARS[i]"""
+  masks: Dict[Tuple[int, int], int] = defaultdict(int)
+  for i, car_name in enumerate(FINGERPRINT_CARS):
+    for fingerprint in _FINGERPRINTS[car_name]:
+      for address, length in {**fingerprint, **_DEBUG_ADDRESS}.items():  # add alien debug address
+        masks[(address, length)] |= 1 << i
+  return dict(masks)
+
+
+FINGERPRINT_CARS = list(_FINGERPRINTS.keys())
+CAR_BITS = {car_name: 1 << i for i, car_name in enumerate(FINGERPRINT_CARS)}
+ALL_CARS_MASK = (1 << len(FINGERPRINT_CARS)) - 1
+_FINGERPRINT_MASKS = _build_fingerprint_masks()
+
+
+def compatible_cars_mask(address, length):
+  """Bitmask of the cars that could have sent a message with this address and length"""
+  # ignore addresses that are more than 11 bits
+  if address >= 0x800:
+    return ALL_CARS_MASK
+  return _FINGERPRINT_MASKS.get((address, length), 0)
+
+
+def cars_from_mask(mask):
+  return [car_name for car_name in FINGERPRINT_CARS if mask & CAR_BITS[car_name]]
+
+
 def eliminate_incompatible_cars(msg, candidate_cars):
   """Removes cars that could not have sent msg.
 
@@ -23,19 +55,8 @@ def eliminate_incompatible_cars(msg, candidate_cars):
      Returns:
       A list containing the subset of candidate_cars that could have sent msg.
   """
-  compatible_cars = []
-
-  for car_name in candidate_cars:
-    car_fingerprints = _FINGERPRINTS[car_name]
-
-    for fingerprint in car_fingerprints:
-      fingerprint.update(_DEBUG_ADDRESS)  # add alien debug address
-
-      if is_valid_for_fingerprint(msg, fingerprint):
-        compatible_cars.append(car_name)
-        break
-
-  return compatible_cars
+  mask = compatible_cars_mask(msg.address, len(msg.dat))
+  return [car_name for car_name in candidate_cars if mask & CAR_BITS[car_name]]
 
 
 def all_known_cars():
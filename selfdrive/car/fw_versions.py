@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 import traceback
-from collections import defaultdict
-from typing import Any, Optional, Set, Tuple
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, Optional, Set, Tuple
 from tqdm import tqdm
 
 import panda.python.uds as uds
@@ -15,6 +16,12 @@ from system.swaglog import cloudlog
 Ecu = car.CarParams.Ecu
 ESSENTIAL_ECUS = [Ecu.engine, Ecu.eps, Ecu.abs, Ecu.fwdRadar, Ecu.fwdCamera, Ecu.vsa]
 
+# These ECUs are known to be shared between models (EPS only between hybrid/ICE version)
+# Getting this exactly right isn't crucial, but excluding camera and radar makes it almost
+# impossible to get 3 matching versions, even if two models with shared parts are released at the same
+# time and only one is in our database.
+FUZZY_EXCLUDE_ECUS = [Ecu.fwdCamera, Ecu.fwdRadar, Ecu.eps, Ecu.debug]
+
 FW_QUERY_CONFIGS = get_interface_attr('FW_QUERY_CONFIG', ignore_none=True)
 VERSIONS = get_interface_attr('FW_VERSIONS', ignore_none=True)
 
@@ -27,6 +34,69 @@ def chunks(l, n=128):
     yield l[i:i + n]
 
 
+# ECU entry of a car in the FW database
+EcuEntry = Tuple[str, Any]  # (candidate, ecu type)
+Addr = Tuple[int, Optional[int]]  # (addr, sub_addr)
+
+
+@dataclass(frozen=True)
+class FwIndex:
+  """Lookup tables over the FW database, built once, so matching only visits the ECUs that responded"""
+  # (addr, sub_addr, version) -> cars with that version, ignoring FUZZY_EXCLUDE_ECUS
+  fuzzy: Dict[Tuple[int, Optional[int], bytes], FrozenSet[str]]
+  # addr -> version -> ECU entries listing that version
+  versions: Dict[Addr, Dict[bytes, FrozenSet[EcuEntry]]]
+  # addr -> ECU entries at that address, except debug ECUs which don't need to match
+  entries: Dict[Addr, FrozenSet[EcuEntry]]
+  # addr -> essential ECU entries, which must respond for a car to match
+  essential: Dict[Addr, FrozenSet[EcuEntry]]
+  essential_count: Dict[str, int]
+  no_essential: FrozenSet[str]
+
+
+def build_fw_index(fw_versions) -> FwIndex:
+  fuzzy = defaultdict(set)
+  versions: Dict[Addr, Dict[bytes, Set[EcuEntry]]] = defaultdict(lambda: defaultdict(set))
+  entries = defaultdict(set)
+  essential = defaultdict(set)
+  essential_count: Dict[str, int] = Counter()
+
+  for candidate, fws in fw_versions.items():
+    config = FW_QUERY_CONFIGS[MODEL_TO_BRAND[candidate]]
+    for ecu, expected_versions in fws.items():
+      ecu_type, addr = ecu[0], ecu[1:]
+
+      if ecu_type not in FUZZY_EXCLUDE_ECUS:
+        for version in expected_versions:
+          fuzzy[(*addr, version)].add(candidate)
+
+      # Virtual debug ecu doesn't need to match the database
+      if ecu_type == Ecu.debug:
+        continue
+
+      entry = (candidate, ecu_type)
+      entries[addr].add(entry)
+      for version in expected_versions:
+        versions[addr][version].add(entry)
+
+      # Some models can sometimes miss an ecu, or show on two different addresses
+      if ecu_type in ESSENTIAL_ECUS and candidate not in config.non_essential_ecus.get(ecu_type, []):
+        essential[addr].add(entry)
+        essential_count[candidate] += 1
+
+  return FwIndex(
+    fuzzy={k: frozenset(v) for k, v in fuzzy.items()},
+    versions={addr: {v: frozenset(e) for v, e in vers.items()} for addr, vers in versions.items()},
+    entries={k: frozenset(v) for k, v in entries.items()},
+    essential={k: frozenset(v) for k, v in essential.items()},
+    essential_count=dict(essential_count),
+    no_essential=frozenset(c for c in fw_versions if c not in essential_count),
+  )
+
+
+FW_INDEX = build_fw_index(FW_VERSIONS)
+
+
 def build_fw_dict(fw_versions, filter_brand=None):
   fw_versions_dict = defaultdict(set)
   for fw in fw_versions:
@@ -49,38 +119,21 @@ def match_fw_to_car_fuzzy(fw_versions_dict, log=True, exclude=None):
   """Do a fuzzy FW match. This function will return a match, and the number of firmware version
   that were matched uniquely to that specific car. If multiple ECUs uniquely match to different cars
   the match is rejected."""
-
-  # These ECUs are known to be shared between models (EPS only between hybrid/ICE version)
-  # Getting this exactly right isn't crucial, but excluding camera and radar makes it almost
-  # impossible to get 3 matching versions, even if two models with shared parts are released at the same
-  # time and only one is in our database.
-  exclude_types = [Ecu.fwdCamera, Ecu.fwdRadar, Ecu.eps, Ecu.debug]
-
-  # Build lookup table from (addr, sub_addr, fw) to list of candidate cars
-  all_fw_versions = defaultdict(list)
-  for candidate, fw_by_addr in FW_VERSIONS.items():
-    if candidate == exclude:
-      continue
-
-    for addr, fws in fw_by_addr.items():
-      if addr[0] in exclude_types:
-        continue
-      for f in fws:
-        all_fw_versions[(addr[1], addr[2], f)].append(candidate)
-
   match_count = 0
   candidate = None
   for addr, versions in fw_versions_dict.items():
     for version in versions:
       # All cars that have this FW response on the specified address
-      candidates = all_fw_versions[(addr[0], addr[1], version)]
+      candidates = FW_INDEX.fuzzy.get((addr[0], addr[1], version), frozenset())
+      if exclude is not None:
+        candidates = candidates - {exclude}
 
       if len(candidates) == 1:
         match_count += 1
         if candidate is None:
-          candidate = candidates[0]
+          candidate, = candidates
         # We uniquely matched two different cars. No fuzzy match possible
-        elif candidate != candidates[0]:
+        elif candidate not in candidates:
           return set()
 
   if match_count >= 2:
@@ -96,34 +149,31 @@ def match_fw_to_car_exact(fw_versions_dict):
   FW versions for a list of "essential" ECUs. If an ECU is not considered
   essential the FW version can be missing to get a fingerprint, but if it's present it
   needs to match the database."""
-  invalid = []
-  candidates = FW_VERSIONS
+  invalid = set()
+  essential_found: Dict[str, int] = Counter()
 
-  for candidate, fws in candidates.items():
-    for ecu, expected_versions in fws.items():
-      config = FW_QUERY_CONFIGS[MODEL_TO_BRAND[candidate]]
-      ecu_type = ecu[0]
-      addr = ecu[1:]
+  for addr, found_versions in fw_versions_dict.items():
+    if not len(found_versions):
+      continue
 
-      found_versions = fw_versions_dict.get(addr, set())
-      if not len(found_versions):
-        # Some models can sometimes miss an ecu, or show on two different addresses
-        if candidate in config.non_essential_ecus.get(ecu_type, []):
-          continue
+    # ECUs at this address that list none of the versions found
+    matched = frozenset().union(*(FW_INDEX.versions.get(addr, {}).get(v, ()) for v in found_versions))
+    invalid |= {candidate for candidate, _ in FW_INDEX.entries.get(addr, frozenset()) - matched}
 
-        # Ignore non essential ecus
-        if ecu_type not in ESSENTIAL_ECUS:
-          continue
+    for candidate, _ in FW_INDEX.essential.get(addr, ()):
+      essential_found[candidate] += 1
 
-      # Virtual debug ecu doesn't need to match the database
-      if ecu_type == Ecu.debug:
-        continue
+  # all essential ECUs of a car need to be present
+  complete = FW_INDEX.no_essential | {c for c, n in essential_found.items() if n == FW_INDEX.essential_count[c]}
+  return set(complete - invalid)
 
-      if not any([found_version in expected_versions for found_version in found_versions]):
-        invalid.append(candidate)
-        break
 
-  return set(candidates.keys()) - set(invalid)
+def build_fw_dicts(fw_versions):
+  """build_fw_dict for every brand, in one pass"""
+  fw_by_brand = defaultdict(list)
+  for fw in fw_versions:
+    fw_by_brand[fw.brand].append(fw)
+  return {brand: build_fw_dict(fws) for brand, fws in fw_by_brand.items()}
 
 
 def match_fw_to_car(fw_versions, allow_exact=True, allow_fuzzy=True):
@@ -134,12 +184,12 @@ def match_fw_to_car(fw_versions, allow_exact=True, allow_fuzzy=True):
   if allow_fuzzy:
     exact_matches.append((False, match_fw_to_car_fuzzy))
 
+  fw_versions_dicts = build_fw_dicts(fw_versions)
   for exact_match, match_func in exact_matches:
     # For each brand, attempt to fingerprint using all FW returned from its queries
     matches = set()
     for brand in VERSIONS.keys():
-      fw_versions_dict = build_fw_dict(fw_versions, filter_brand=brand)
-      matches |= match_func(fw_versions_dict)
+      matches |= match_func(fw_versions_dicts.get(brand, {}))
 
     if len(matches):
       return exact_match, matches
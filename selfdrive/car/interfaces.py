@@ -26,28 +26,55 @@ TORQUE_OVERRIDE_PATH = os.path.join(BASEDIR, 'selfdrive/car/torque_data/override
 TORQUE_SUBSTITUTE_PATH = os.path.join(BASEDIR, 'selfdrive/car/torque_data/substitute.yaml')
 
 
+TORQUE_PATHS = (TORQUE_SUBSTITUTE_PATH, TORQUE_PARAMS_PATH, TORQUE_OVERRIDE_PATH)
+
+# compiled torque params and the mtimes of the files they were compiled from
+_torque_params_db: Dict[str, Any] = {}
+_torque_params_mtimes: Optional[Tuple[int, ...]] = None
+
+
+def _load_yaml(path):
+  with open(path) as f:
+    return yaml.load(f, Loader=yaml.CSafeLoader)
+
+
+def compile_torque_params(sub, params, override):
+  """Resolves substitutes and applies the legend for every known candidate.
+  Candidates with an invalid config map to the exception get_torque_params raises for them."""
+  db: Dict[str, Any] = {}
+  for candidate in set(sub) | set(params) | set(override):
+    resolved = sub.get(candidate, candidate)
+
+    # Ensure no overlap
+    if sum([resolved in x for x in [sub, params, override]]) > 1:
+      db[candidate] = RuntimeError(f'{resolved} is defined twice in torque config')
+    elif resolved in override:
+      db[candidate] = {key: override[resolved][i] for i, key in enumerate(params['legend'])}
+    elif resolved in params:
+      db[candidate] = {key: params[resolved][i] for i, key in enumerate(params['legend'])}
+    else:
+      db[candidate] = NotImplementedError(f"Did not find torque params for {resolved}")
+  return db
+
+
+def get_torque_params_db():
+  """Torque params of all candidates, parsed once and recompiled when one of the files changes"""
+  global _torque_params_db, _torque_params_mtimes
+  mtimes = tuple(os.stat(path).st_mtime_ns for path in TORQUE_PATHS)
+  if mtimes != _torque_params_mtimes:
+    _torque_params_db = compile_torque_params(*(_load_yaml(path) for path in TORQUE_PATHS))
+    _torque_params_mtimes = mtimes
+  return _torque_params_db
+
+
 def get_torque_params(candidate):
-  with open(TORQUE_SUBSTITUTE_PATH) as f:
-    sub = yaml.load(f, Loader=yaml.CSafeLoader)
-  if candidate in sub:
-    candidate = sub[candidate]
-
-  with open(TORQUE_PARAMS_PATH) as f:
-    params = yaml.load(f, Loader=yaml.CSafeLoader)
-  with open(TORQUE_OVERRIDE_PATH) as f:
-    override = yaml.load(f, Loader=yaml.CSafeLoader)
-
-  # Ensure no overlap
-  if sum([candidate in x for x in [sub, params, override]]) > 1:
-    raise RuntimeError(f'{candidate} is defined twice in torque config')
-
-  if candidate in override:
-    out = override[candidate]
-  elif candidate in params:
-    out = params[candidate]
-  else:
+  out = get_torque_params_db().get(candidate)
+  if out is None:
     raise NotImplementedError(f"Did not find torque params for {candidate}")
-  return {key: out[i] for i, key in enumerate(params['legend'])}
+  if isinstance(out, Exception):
+    # a new instance, so tracebacks don't pile up on the cached one
+    raise type(out)(*out.args)
+  return dict(out)
 
 
 # generic car and radar interfaces
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+import os
+import bz2
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from tqdm import tqdm
+
+from common.file_helpers import atomic_write_in_dir, mkdirs_exists_ok
+from common.realtime import DT_CTRL
+from selfdrive.car.tests.routes import CarTestRoute
+from selfdrive.test.openpilotci import get_url
+from tools.lib.logreader import LogReader
+from tools.lib.route import Route
+from tools.lib.url_file import CACHE_DIR
+
+# subdirectory of the download cache, so CI caches fixtures along with downloads
+FIXTURE_DIR = os.path.join(CACHE_DIR, "car_fixtures")
+FIXTURE_SERVICES = ['can', 'sendcan', 'carParams']
+
+TEST_SEGMENTS = (2, 1, 0)
+MIN_CAN_MSGS = int(50 / DT_CTRL)
+
+
+def fixture_path(test_route: CarTestRoute) -> str:
+  segment = "default" if test_route.segment is None else test_route.segment
+  return os.path.join(FIXTURE_DIR, f"{test_route.route.replace('|', '_')}--{segment}.bz2")
+
+
+def get_fixture(test_route: CarTestRoute, ci: bool = True) -> Optional[str]:
+  """Returns the path of a log with only the can, sendcan and carParams messages of the first
+  test segment with enough CAN. It is extracted once, then loaded from disk."""
+  path = fixture_path(test_route)
+  if os.path.isfile(path):
+    return path
+
+  test_segs = TEST_SEGMENTS if test_route.segment is None else (test_route.segment,)
+  for seg in test_segs:
+    try:
+      log_path = get_url(test_route.route, seg) if ci else Route(test_route.route).log_paths()[seg]
+      # only these services are decoded
+      msgs = list(LogReader(log_path, services=FIXTURE_SERVICES))
+    except Exception:
+      continue
+
+    if sum(msg.which() == 'can' for msg in msgs) > MIN_CAN_MSGS:
+      mkdirs_exists_ok(FIXTURE_DIR)
+      with atomic_write_in_dir(path, mode="wb", overwrite=True) as f:
+        f.write(bz2.compress(b"".join(msg.as_builder().to_bytes() for msg in msgs)))
+      return path
+  return None
+
+
+def prefetch(test_routes, jobs=None):
+  """Downloads and extracts fixtures for many routes concurrently. Returns the routes that failed."""
+  test_routes = [r for r in test_routes if not os.path.isfile(fixture_path(r))]
+  with ProcessPoolExecutor(max_workers=jobs) as pool:
+    paths = list(tqdm(pool.map(get_fixture, test_routes), total=len(test_routes), desc="Fetching car test routes"))
+  return [r for r, p in zip(test_routes, paths) if p is None]
+
+
+if __name__ == "__main__":
+  from selfdrive.car.tests.test_models import test_cases
+
+  parser = argparse.ArgumentParser(description="Prefetch the routes of the car model tests, sharded like test_models.py with NUM_JOBS/JOB_ID")
+  parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes, defaults to the number of CPUs")
+  args = parser.parse_args()
+
+  failed = prefetch({r for _, r in test_cases if r is not None}, args.jobs)
+  for r in failed:
+    print(f"Route: {repr(r.route)} not found or no CAN msgs found")
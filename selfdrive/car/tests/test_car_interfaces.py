@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 import math
+import re
+import yaml
 import unittest
 import importlib
 from parameterized import parameterized
@@ -9,6 +11,31 @@ from selfdrive.car import gen_empty_fingerprint
 from selfdrive.car.fingerprints import all_known_cars
 from selfdrive.car.car_helpers import interfaces
 from selfdrive.car.fingerprints import _FINGERPRINTS as FINGERPRINTS
+from selfdrive.car.interfaces import TORQUE_PATHS, get_torque_params, get_torque_params_db
+
+
+def load_yaml(path):
+  with open(path) as f:
+    return yaml.load(f, Loader=yaml.CSafeLoader)
+
+
+def get_torque_params_uncached(candidate):
+  """Reference for the compiled database: parses the files on every call, as get_torque_params did before"""
+  sub, params, override = (load_yaml(path) for path in TORQUE_PATHS)
+  if candidate in sub:
+    candidate = sub[candidate]
+
+  if sum([candidate in x for x in [sub, params, override]]) > 1:
+    raise RuntimeError(f'{candidate} is defined twice in torque config')
+
+  if candidate in override:
+    out = override[candidate]
+  elif candidate in params:
+    out = params[candidate]
+  else:
+    raise NotImplementedError(f"Did not find torque params for {candidate}")
+  return {key: out[i] for i, key in enumerate(params['legend'])}
+
 
 class TestCarInterfaces(unittest.TestCase):
 
@@ -69,5 +96,16 @@ class TestCarInterfaces(unittest.TestCase):
        hasattr(radar_interface, '_update') and hasattr(radar_interface, 'trigger_msg'):
       radar_interface._update([radar_interface.trigger_msg])
 
+  def test_torque_params_db(self):
+    # the compiled database gives the same params and errors as parsing the files per call
+    for candidate in list(get_torque_params_db()) + ["NOT A CAR"]:
+      try:
+        expected = get_torque_params_uncached(candidate)
+      except (RuntimeError, NotImplementedError) as e:
+        with self.assertRaisesRegex(type(e), re.escape(e.args[0])):
+          get_torque_params(candidate)
+      else:
+        self.assertEqual(get_torque_params(candidate), expected)
+
 if __name__ == "__main__":
   unittest.main()
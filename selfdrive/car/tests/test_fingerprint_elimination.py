@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+import random
+import unittest
+
+import cereal.messaging as messaging
+from selfdrive.car.fingerprints import _DEBUG_ADDRESS, _FINGERPRINTS, all_legacy_fingerprint_cars, eliminate_incompatible_cars, \
+                                       is_valid_for_fingerprint
+
+
+def can_msg(address, length):
+  msg = messaging.new_message('can', 1).can[0]
+  msg.address = address
+  msg.dat = b"\x00" * length
+  return msg
+
+
+def eliminate_reference(msg, candidate_cars):
+  return [c for c in candidate_cars if any(is_valid_for_fingerprint(msg, {**f, **_DEBUG_ADDRESS}) for f in _FINGERPRINTS[c])]
+
+
+class TestFingerprintElimination(unittest.TestCase):
+  def test_matches_reference(self):
+    random.seed(0)
+    all_cars = all_legacy_fingerprint_cars()
+    msgs = [can_msg(address, length) for f in _FINGERPRINTS[random.choice(all_cars)] for address, length in f.items()]
+    msgs += [can_msg(random.randrange(0x900), random.randrange(9)) for _ in range(200)]
+    msgs.append(can_msg(*next(iter(_DEBUG_ADDRESS.items()))))
+
+    candidates = all_cars
+    for msg in msgs:
+      expected = eliminate_reference(msg, all_cars)
+      self.assertEqual(eliminate_incompatible_cars(msg, all_cars), expected)
+
+      # elimination keeps the order of candidates
+      candidates = eliminate_incompatible_cars(msg, candidates)
+      self.assertEqual(candidates, [c for c in all_cars if c in set(candidates)])
+
+  def test_own_fingerprint(self):
+    for car_name, fingerprints in _FINGERPRINTS.items():
+      for f in fingerprints:
+        candidates = all_legacy_fingerprint_cars()
+        for address, length in f.items():
+          candidates = eliminate_incompatible_cars(can_msg(address, length), candidates)
+        self.assertIn(car_name, candidates)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -6,7 +6,8 @@ from parameterized import parameterized
 from cereal import car
 from selfdrive.car.car_helpers import get_interface_attr, interfaces
 from selfdrive.car.fingerprints import FW_VERSIONS
-from selfdrive.car.fw_versions import FW_QUERY_CONFIGS, match_fw_to_car
+from selfdrive.car.fw_versions import ESSENTIAL_ECUS, FUZZY_EXCLUDE_ECUS, FW_QUERY_CONFIGS, MODEL_TO_BRAND, \
+                                      match_fw_to_car, match_fw_to_car_exact, match_fw_to_car_fuzzy
 
 CarFw = car.CarParams.CarFw
 Ecu = car.CarParams.Ecu
@@ -15,6 +16,40 @@ ECU_NAME = {v: k for k, v in Ecu.schema.enumerants.items()}
 VERSIONS = get_interface_attr("FW_VERSIONS", ignore_none=True)
 
 
+def match_exact_reference(fw_versions_dict):
+  # checks every car in the database
+  matches = set()
+  for candidate, fws in FW_VERSIONS.items():
+    config = FW_QUERY_CONFIGS[MODEL_TO_BRAND[candidate]]
+    for (ecu_type, *addr), expected_versions in fws.items():
+      found_versions = fw_versions_dict.get(tuple(addr), set())
+      if not len(found_versions):
+        if candidate in config.non_essential_ecus.get(ecu_type, []) or ecu_type not in ESSENTIAL_ECUS:
+          continue
+      if ecu_type == Ecu.debug:
+        continue
+      if not any(v in expected_versions for v in found_versions):
+        break
+    else:
+      matches.add(candidate)
+  return matches
+
+
+def match_fuzzy_reference(fw_versions_dict, exclude=None):
+  match_count, match = 0, None
+  for addr, versions in fw_versions_dict.items():
+    for version in versions:
+      candidates = {c for c, fws in FW_VERSIONS.items() if c != exclude and
+                    any(ecu[1:] == addr and ecu[0] not in FUZZY_EXCLUDE_ECUS and version in v for ecu, v in fws.items())}
+      if len(candidates) == 1:
+        match_count += 1
+        if match is None:
+          match = candidates.pop()
+        elif match not in candidates:
+          return set()
+  return {match} if match_count >= 2 else set()
+
+
 class TestFwFingerprint(unittest.TestCase):
   def assertFingerprints(self, candidates, expected):
     candidates = list(candidates)
@@ -36,6 +71,22 @@ class TestFwFingerprint(unittest.TestCase):
       _, matches = match_fw_to_car(CP.carFw)
       self.assertFingerprints(matches, car_model)
 
+  def test_index_matches_database(self):
+    # partial and mixed responses, unlike test_fw_fingerprint
+    random.seed(0)
+    cars = sorted(FW_VERSIONS)
+    for _ in range(300):
+      fw_versions_dict = {}
+      for car_model in random.sample(cars, random.randint(1, 2)):
+        for (_, addr, sub_addr), versions in FW_VERSIONS[car_model].items():
+          if len(versions) and random.random() < 0.8:
+            fw_versions_dict.setdefault((addr, sub_addr), set()).add(random.choice(versions))
+      exclude = random.choice(cars)
+
+      self.assertEqual(match_fw_to_car_exact(fw_versions_dict), match_exact_reference(fw_versions_dict))
+      self.assertEqual(match_fw_to_car_fuzzy(fw_versions_dict, log=False, exclude=exclude),
+                       match_fuzzy_reference(fw_versions_dict, exclude))
+
   def test_no_duplicate_fw_versions(self):
     for car_model, ecus in FW_VERSIONS.items():
       with self.subTest(car_model=car_model):
@@ -8,23 +8,22 @@ from typing import List, Optional, Tuple
 from parameterized import parameterized_class
 
 from cereal import log, car
-from common.realtime import DT_CTRL
 from selfdrive.boardd.boardd import can_capnp_to_can_list, can_list_to_can_capnp
 from selfdrive.car.fingerprints import all_known_cars
 from selfdrive.car.car_helpers import interfaces
 from selfdrive.car.gm.values import CAR as GM
 from selfdrive.car.honda.values import CAR as HONDA, HONDA_BOSCH
 from selfdrive.car.hyundai.values import CAR as HYUNDAI
+from selfdrive.car.tests.car_fixtures import get_fixture
 from selfdrive.car.tests.routes import non_tested_cars, routes, CarTestRoute
-from selfdrive.test.openpilotci import get_url
 from tools.lib.logreader import LogReader
-from tools.lib.route import Route
 
 from panda.tests.safety import libpandasafety_py
 from panda.tests.safety.common import package_can_msg
 
 PandaType = log.PandaState.PandaType
 
+# fetch all routes first with car_fixtures.py -j, then run classes in parallel with pytest -n auto --dist loadscope
 NUM_JOBS = int(os.environ.get("NUM_JOBS", "1"))
 JOB_ID = int(os.environ.get("JOB_ID", "0"))
 
@@ -67,40 +66,27 @@ class TestCarModelBase(unittest.TestCase):
         raise unittest.SkipTest
       raise Exception(f"missing test route for {cls.car_model}")
 
+    # can, sendcan and carParams of the test segment, see car_fixtures.py to prefetch them
+    fixture = get_fixture(cls.test_route, cls.ci)
+    if fixture is None:
+      raise Exception(f"Route: {repr(cls.test_route.route)} not found or no CAN msgs found. Is it uploaded?")
+
     experimental_long = False
-    test_segs = (2, 1, 0)
-    if cls.test_route.segment is not None:
-      test_segs = (cls.test_route.segment,)
-
-    for seg in test_segs:
-      try:
-        if cls.ci:
-          lr = LogReader(get_url(cls.test_route.route, seg))
-        else:
-          lr = LogReader(Route(cls.test_route.route).log_paths()[seg])
-      except Exception:
-        continue
-
-      car_fw = []
-      can_msgs = []
-      fingerprint = defaultdict(dict)
-      for msg in lr:
-        if msg.which() == "can":
-          for m in msg.can:
-            if m.src < 64:
-              fingerprint[m.src][m.address] = len(m.dat)
-          can_msgs.append(msg)
-        elif msg.which() == "carParams":
-          car_fw = msg.carParams.carFw
-          if msg.carParams.openpilotLongitudinalControl:
-            experimental_long = True
-          if cls.car_model is None and not cls.ci:
-            cls.car_model = msg.carParams.carFingerprint
-
-      if len(can_msgs) > int(50 / DT_CTRL):
-        break
-    else:
-      raise Exception(f"Route: {repr(cls.test_route.route)} with segments: {test_segs} not found or no CAN msgs found. Is it uploaded?")
+    car_fw = []
+    can_msgs = []
+    fingerprint = defaultdict(dict)
+    for msg in LogReader(fixture):
+      if msg.which() == "can":
+        for m in msg.can:
+          if m.src < 64:
+            fingerprint[m.src][m.address] = len(m.dat)
+        can_msgs.append(msg)
+      elif msg.which() == "carParams":
+        car_fw = msg.carParams.carFw
+        if msg.carParams.openpilotLongitudinalControl:
+          experimental_long = True
+        if cls.car_model is None and not cls.ci:
+          cls.car_model = msg.carParams.carFingerprint
 
     cls.can_msgs = sorted(can_msgs, key=lambda msg: msg.logMonoTime)
 
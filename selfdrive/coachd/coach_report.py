@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import sys
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from tqdm import tqdm
+
+from cereal import messaging
+from selfdrive.coachd.coachd import CoachD
+from tools.lib.logreader import LogReader
+from tools.lib.route import Route, SegmentName
+
+
+@dataclass
+class FieldStats:
+  updates: int = 0
+  time: float = 0.  # s covered by updates
+  level_time: Dict[int, float] = field(default_factory=lambda: defaultdict(float))  # s spent at each warning level
+  level_count: Dict[int, int] = field(default_factory=lambda: defaultdict(int))  # times each warning level was reached
+  max_duration: float = 0.  # s
+
+  def merge(self, other: 'FieldStats') -> None:
+    self.updates += other.updates
+    self.time += other.time
+    for level, t in other.level_time.items():
+      self.level_time[level] += t
+    for level, c in other.level_count.items():
+      self.level_count[level] += c
+    self.max_duration = max(self.max_duration, other.max_duration)
+
+
+@dataclass
+class RouteReport:
+  route: str
+  dongle_id: str
+  segments: int = 0
+  failed_segments: List[int] = field(default_factory=list)
+  duration: float = 0.  # s
+  fields: Dict[str, FieldStats] = field(default_factory=lambda: defaultdict(FieldStats))
+
+  def merge(self, other: 'RouteReport') -> None:
+    self.segments += other.segments
+    self.failed_segments += other.failed_segments
+    self.duration += other.duration
+    for name, stats in other.fields.items():
+      self.fields[name].merge(stats)
+
+
+def _get(status: Any, key: str, default: Any = None) -> Any:
+  if isinstance(status, dict):
+    return status.get(key, default)
+  return getattr(status, key, default)
+
+
+class CoachReplay:
+  """Feeds logged messages to CoachD like coachd_thread does and collects statistics
+  about the published statuses. Modules are never deferred, so reports don't depend on machine load."""
+
+  def __init__(self, CD: Optional[CoachD] = None):
+    self.CD = CD if CD is not None else CoachD(realtime=False)
+    # without addr no sockets are opened, like process_replay's FakeSubMaster, step() fills in the messages
+    self.sm = messaging.SubMaster(self.CD.services, addr=None)
+    self.fields: Dict[str, FieldStats] = defaultdict(FieldStats)
+    self.last_update: Dict[str, Tuple[int, int]] = {}  # field: (mono time, warning level)
+    self.start_time: Optional[int] = None
+    self.end_time: Optional[int] = None
+
+  def step(self, msg) -> bool:
+    """Processes one message, returns True if a drivingCoachState would have been published"""
+    which = msg.which()
+    if which not in self.sm.data:
+      return False
+
+    for s in self.sm.updated:
+      self.sm.updated[s] = False
+    self.sm.updated[which] = True
+    self.sm.data[which] = getattr(msg, which)
+    self.sm.logMonoTime[which] = msg.logMonoTime
+
+    if self.start_time is None:
+      self.start_time = msg.logMonoTime
+    self.end_time = msg.logMonoTime
+
+    if not self.CD.is_update_due(self.sm):
+      return False
+    self.CD.update(self.sm)
+    self.record(msg.logMonoTime)
+    return True
+
+  def record(self, mono_time: int) -> None:
+    for name, status in self.CD.status.items():
+      stats = self.fields[name]
+      level = int(_get(status, "warningLevel", 0))
+
+      prev = self.last_update.get(name)
+      if prev is not None:
+        prev_time, prev_level = prev
+        dt = (mono_time - prev_time) * 1e-9
+        stats.time += dt
+        stats.level_time[prev_level] += dt
+        if level > prev_level:
+          for lvl in range(prev_level + 1, level + 1):
+            stats.level_count[lvl] += 1
+      elif level > 0:
+        for lvl in range(1, level + 1):
+          stats.level_count[lvl] += 1
+
+      stats.updates += 1
+      stats.max_duration = max(stats.max_duration, int(_get(status, "duration", 0)) * 1e-9)
+      self.last_update[name] = (mono_time, level)
+
+  def run(self, events: Iterable) -> float:
+    """Processes a log, returns its duration in s"""
+    self.start_time = self.end_time = None
+    for msg in events:
+      self.step(msg)
+    if self.start_time is None or self.end_time is None:
+      return 0.
+    return (self.end_time - self.start_time) * 1e-9
+
+
+def process_route(route_name: str, log_paths: List[Tuple[int, Optional[str]]]) -> RouteReport:
+  """Replays the segments of a route in order, keeping module state across segments"""
+  report = RouteReport(route=route_name, dongle_id=SegmentName(route_name, allow_route_name=True).dongle_id)
+  replay = CoachReplay()
+  for segment_num, log_path in log_paths:
+    if log_path is None:
+      report.failed_segments.append(segment_num)
+      continue
+    try:
+      lr = LogReader(log_path, services=replay.CD.services, sort_by_time=True)
+      report.duration += replay.run(lr)
+      report.segments += 1
+    except Exception as e:  # pylint: disable=broad-except
+      print(f"Error processing {route_name}--{segment_num}: {e}", file=sys.stderr)
+      report.failed_segments.append(segment_num)
+
+  report.fields = replay.fields
+  return report
+
+
+def get_work(names: List[str], qlog: bool) -> Dict[str, List[Tuple[int, Optional[str]]]]:
+  """Expands route and segment names to the log paths of each route"""
+  work: Dict[str, List[Tuple[int, Optional[str]]]] = defaultdict(list)
+  routes: Dict[str, Route] = {}
+  for name in names:
+    sn = SegmentName(name, allow_route_name=True)
+    route_name = sn.route_name.canonical_name
+    if route_name not in routes:
+      routes[route_name] = Route(route_name)
+    paths = routes[route_name].qlog_paths() if qlog else routes[route_name].log_paths()
+
+    segments = range(len(paths)) if sn.segment_num < 0 else [sn.segment_num]
+    work[route_name] += [(i, paths[i] if i < len(paths) else None) for i in segments]
+
+  return {r: sorted(set(segments), key=lambda s: s[0]) for r, segments in work.items()}
+
+
+def aggregate_drivers(reports: List[RouteReport]) -> Dict[str, RouteReport]:
+  drivers: Dict[str, RouteReport] = {}
+  for report in reports:
+    if report.dongle_id not in drivers:
+      drivers[report.dongle_id] = RouteReport(route="", dongle_id=report.dongle_id)
+    drivers[report.dongle_id].merge(report)
+  return drivers
+
+
+def summarize(report: RouteReport) -> Dict[str, Any]:
+  # built by hand, asdict fails on defaultdict fields before python 3.12
+  hours = report.duration / 3600.
+  fields = {}
+  for name, stats in report.fields.items():
+    fields[name] = {
+      "updates": stats.updates,
+      "time": stats.time,
+      "level_time": dict(stats.level_time),
+      "level_count": dict(stats.level_count),
+      "max_duration": stats.max_duration,
+      # warning levels per hour of driving, the usual comparison between drivers
+      "level_count_per_hour": {lvl: c / hours for lvl, c in stats.level_count.items()} if hours > 0 else {},
+    }
+  return {
+    "route": report.route,
+    "dongle_id": report.dongle_id,
+    "segments": report.segments,
+    "failed_segments": list(report.failed_segments),
+    "duration": report.duration,
+    "fields": fields,
+  }
+
+
+def generate_report(names: List[str], qlog: bool = False, jobs: Optional[int] = None) -> Dict[str, Any]:
+  work = get_work(names, qlog)
+  reports = []
+  with ProcessPoolExecutor(max_workers=jobs) as pool:
+    futures = [pool.submit(process_route, route_name, paths) for route_name, paths in work.items()]
+    for f in tqdm(as_completed(futures), total=len(futures), desc="Processing routes"):
+      reports.append(f.result())
+
+  reports.sort(key=lambda r: r.route)
+  return {
+    "routes": {r.route: summarize(r) for r in reports},
+    "drivers": {d: summarize(r) for d, r in sorted(aggregate_drivers(reports).items())},
+  }
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Run coachd over routes and report how often drivers get warnings",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--qlog", action="store_true", help="Use qlogs instead of rlogs")
+  parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes, defaults to the number of CPUs")
+  parser.add_argument("-f", "--file", help="File with one route or segment name per line")
+  parser.add_argument("-o", "--output", default="coach_report.json", help="Output JSON file")
+  parser.add_argument("names", nargs="*", help="Route or segment names")
+  args = parser.parse_args()
+
+  names = list(args.names)
+  if args.file is not None:
+    with open(args.file) as f:
+      names += [l.strip() for l in f if l.strip()]
+  if not len(names):
+    parser.error("no routes or segments given")
+
+  report = generate_report(names, qlog=args.qlog, jobs=args.jobs)
+  with open(args.output, "w") as f:
+    json.dump(report, f, indent=2)
+  print(f"Wrote report of {len(report['routes'])} routes, {len(report['drivers'])} drivers to {args.output}")
@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
-from typing import Dict, List, Optional, Type
+from dataclasses import asdict
+from typing import Any, Callable, Dict, List, Optional, Type
 
 from cereal import log, messaging
+from common.realtime import sec_since_boot
+from system.swaglog import cloudlog
 from selfdrive.coachd.modules.base import CoachModule
 from selfdrive.coachd.modules.tailgating_detection import TailgatingDetection
+from selfdrive.coachd.scheduler import ModuleScheduler
 
 
 # key must match name of corresponding field in DrivingCoachState schema
@@ -15,65 +19,107 @@ COACH_MODULES: Dict[str, Type[CoachModule]] = {
 # services that need to be validated to make a DrivingCoachState message valid
 VALIDATED_SERVICES = ['carState', 'radarState']
 
+# interval in s between logging module timing stats
+STATS_INTERVAL = 60.
+
 
 class CoachD(object):
 
   def __init__(
       self,
       modules: Optional[Dict[str, Type[CoachModule]]] = None,
-      validated_services: Optional[List[str]] = None
+      validated_services: Optional[List[str]] = None,
+      realtime: bool = True
   ):
     # initialize modules
     if modules is None:
       modules = COACH_MODULES
     self.modules = {field: module() for field, module in modules.items()}
+    self.scheduler = ModuleScheduler(self.modules, realtime=realtime)
+
+    # last status of each module, kept while a module is not due
+    self.status: Dict[str, Any] = {}
 
     # set services that need validation
     if validated_services is None:
       validated_services = VALIDATED_SERVICES
     self.validated_services = validated_services
 
+  @property
+  def services(self) -> List[str]:
+    return sorted(set(self.scheduler.services) | set(self.validated_services))
+
+  @property
+  def stats(self) -> Dict[str, Dict[str, Any]]:
+    return {field: asdict(stats) for field, stats in self.scheduler.stats.items()}
+
   def is_module_active(self, module: str) -> bool:
     return module in self.modules
 
+  def is_update_due(self, sm: messaging.SubMaster) -> bool:
+    return len(self.scheduler.due(sm)) > 0
+
   def update(self, sm: messaging.SubMaster) -> log.Event:
     dat = messaging.new_message('drivingCoachState')
 
     # validate services
     dat.valid = sm.all_checks(service_list=self.validated_services)
 
+    # update due modules
+    self.status.update(self.scheduler.update(sm))
+
     # fill drivingCoachState fields
     drivingCoachState = dat.drivingCoachState
-    for field, module in self.modules.items():
-      setattr(drivingCoachState, field, module.update(sm))
+    for field, status in self.status.items():
+      setattr(drivingCoachState, field, status)
 
     return dat
 
 
-def coachd_thread(
+def make_step(
     sm: Optional[messaging.SubMaster] = None,
     pm: Optional[messaging.PubMaster] = None
-):
+) -> Callable[[], None]:
+  """Sets up CoachD and returns a function running one iteration of the coachd loop."""
+  CD = CoachD()
+
   # *** setup messaging ***
   if sm is None:
-    sm = messaging.SubMaster(['carState', 'radarState'])
+    sm = messaging.SubMaster(CD.services)
   if pm is None:
     pm = messaging.PubMaster(['drivingCoachState'])
 
-  CD = CoachD()
+  last_stats_t = sec_since_boot()
 
-  while True:
+  def step() -> None:
+    nonlocal last_stats_t
     sm.update()
 
-    # not necessary to publish new message if radarState not updated
-    # (if this check needs to be renoved, move it to 'update' method of TailgatingDetection)
-    if not sm.updated['radarState']:
-      continue
+    # not necessary to publish new message if no module is due
+    if not CD.is_update_due(sm):
+      return
 
     # *** publish drivingCoachState ***
     dat = CD.update(sm)
     pm.send('drivingCoachState', dat)
 
+    # *** log module timing ***
+    t = sec_since_boot()
+    if t - last_stats_t > STATS_INTERVAL:
+      cloudlog.event("coachd_module_stats", stats=CD.stats)
+      last_stats_t = t
+
+  return step
+
+
+def coachd_thread(
+    sm: Optional[messaging.SubMaster] = None,
+    pm: Optional[messaging.PubMaster] = None
+):
+  step = make_step(sm, pm)
+  while True:
+    step()
+
 
 def main(
     sm: Optional[messaging.SubMaster] = None,
@@ -1,13 +1,38 @@
 from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
 
 import capnp
+import numpy as np
 
 from cereal import messaging
 
 
 class CoachModule(ABC):
 
+  # services read by the module
+  services: List[str] = []
+  # services that trigger an update, defaults to all services
+  # (modules without services are updated on every coachd update)
+  update_on: Optional[List[str]] = None
+  # max update frequency in Hz, None to update on every triggering service update
+  rate: Optional[float] = None
+  # time allowed for a single update in seconds
+  time_budget: float = 0.005
+  # modules with a lower value are updated first
+  priority: int = 0
+  # critical modules are updated on every trigger, even past their or the cycle's time budget
+  critical: bool = False
+
+  @property
+  def triggers(self) -> List[str]:
+    return self.services if self.update_on is None else self.update_on
+
   @abstractmethod
   def update(
       self, sm: messaging.SubMaster) -> capnp.lib.capnp._DynamicStructBuilder:
     pass
+
+  def batch_update(self, **inputs: np.ndarray) -> Dict[str, np.ndarray]:
+    """Computes the output of consecutive updates in one pass from arrays of inputs,
+    one element per update. Must match calling update for each element."""
+    raise NotImplementedError(f"{type(self).__name__} does not support batch updates")
@@ -1,3 +1,7 @@
+from typing import Dict
+
+import numpy as np
+
 from cereal import log, messaging
 from selfdrive.coachd.modules.base import CoachModule
 
@@ -14,6 +18,7 @@ TIME_TILL_LEVEL_3 = 20
 LEVEL_1_THRESHOLD = int(TIME_TILL_LEVEL_1 * 1e+9)
 LEVEL_2_THRESHOLD = int(TIME_TILL_LEVEL_2 * 1e+9)
 LEVEL_3_THRESHOLD = int(TIME_TILL_LEVEL_3 * 1e+9)
+LEVEL_THRESHOLDS = np.array([LEVEL_1_THRESHOLD, LEVEL_2_THRESHOLD, LEVEL_3_THRESHOLD])
 
 
 def get_closest_lead(
@@ -31,6 +36,13 @@ def is_tailgating(thw: float, v_ego: float) -> bool:
 
 class TailgatingDetection(CoachModule):
 
+  services = ['carState', 'radarState']
+  update_on = ['radarState']
+  time_budget = 0.001
+  # warnings must not be delayed by overruns of this or other modules
+  critical = True
+  priority = -1
+
   def __init__(self):
     self.measuring = False
     self.tailgating = False
@@ -49,9 +61,6 @@ class TailgatingDetection(CoachModule):
 
   def update(
       self, sm: messaging.SubMaster) -> log.DrivingCoachState.TailgatingStatus:
-    # if not sm.updated['radarState']:
-    #   return self.create_tailgating_status()
-
     radar_state = sm['radarState']
     current_time = sm.logMonoTime['radarState']
     v_ego = sm['carState'].vEgo
@@ -76,6 +85,48 @@ class TailgatingDetection(CoachModule):
 
     return self.create_tailgating_status()
 
+  def batch_update(
+      self,
+      mono_time: np.ndarray,
+      v_ego: np.ndarray,
+      lead_one_d_rel: np.ndarray,
+      lead_one_thw: np.ndarray,
+      lead_two_d_rel: np.ndarray,
+      lead_two_thw: np.ndarray
+  ) -> Dict[str, np.ndarray]:
+    # one element per radarState update, v_ego is the last carState vEgo at that time
+    mono_time = np.asarray(mono_time, dtype=np.int64)
+    n = len(mono_time)
+    if n == 0:
+      return {
+        "isTailgating": np.zeros(0, dtype=bool),
+        "duration": np.zeros(0, dtype=np.int64),
+        "warningLevel": np.zeros(0, dtype=np.int64),
+      }
+
+    # thw of closest lead
+    thw = np.where(np.asarray(lead_one_d_rel) <= np.asarray(lead_two_d_rel), lead_one_thw, lead_two_thw)
+    tailgating = (0 < thw) & (thw < THW_THRESHOLD) & (np.asarray(v_ego) >= MINIMUM_VELOCITY)
+
+    # a measurement starts where tailgating starts, continuing one already running
+    prev = np.concatenate(([self.measuring], tailgating[:-1]))
+    start_idx = np.maximum.accumulate(np.where(tailgating & ~prev, np.arange(n), -1))
+    start_time = np.where(start_idx >= 0, mono_time[np.maximum(start_idx, 0)], self.start_time)
+    duration = np.where(tailgating, mono_time - start_time, 0)
+    warning_level = np.searchsorted(LEVEL_THRESHOLDS, duration, side='right')
+
+    # leave the module as if update was called for every element
+    self.tailgating = bool(tailgating[-1])
+    self.measuring = self.tailgating
+    self.start_time = int(start_time[-1]) if self.measuring else 0
+    self.duration = int(duration[-1])
+
+    return {
+      "isTailgating": tailgating,
+      "duration": duration,
+      "warningLevel": warning_level,
+    }
+
   def create_tailgating_status(self) -> log.DrivingCoachState.TailgatingStatus:
     return {
       "active": True,
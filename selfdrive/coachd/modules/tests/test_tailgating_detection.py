@@ -2,6 +2,8 @@
 import unittest
 from typing import Optional
 
+import numpy as np
+
 from cereal import car, log, messaging
 from selfdrive.coachd.modules.tailgating_detection import (LEVEL_1_THRESHOLD,
                                                            LEVEL_2_THRESHOLD,
@@ -259,5 +261,67 @@ class TestTailgatingDetection(unittest.TestCase):
                      msg="start time must be reset when measurement stopped")
 
 
+class TestTailgatingDetectionBatch(unittest.TestCase):
+
+  def setUp(self):
+    np.random.seed(0)
+    n, seg_len = 4000, 500
+    # piecewise constant segments of ~25 s, so tailgating lasts long enough to reach every level
+    seg = np.repeat(np.arange(n // seg_len), seg_len)
+    self.inputs = {
+      "mono_time": np.cumsum(np.random.randint(40e6, 60e6, n)).astype(np.int64),
+      "v_ego": np.random.uniform(0, 30, n // seg_len)[seg].astype(np.float32),
+      "lead_one_d_rel": np.random.uniform(1, 50, n).astype(np.float32),
+      "lead_one_thw": np.random.uniform(0.01, 2, n // seg_len)[seg].astype(np.float32),
+      "lead_two_d_rel": np.random.uniform(1, 50, n).astype(np.float32),
+      "lead_two_thw": np.random.uniform(0.01, 2, n // seg_len)[seg].astype(np.float32),
+    }
+    # first segment is tailgating on both leads
+    self.inputs["v_ego"][:seg_len] = 20.
+    self.inputs["lead_one_thw"][:seg_len] = 0.5
+    self.inputs["lead_two_thw"][:seg_len] = 0.5
+
+  def stream(self, td: TailgatingDetection, start: int, end: int):
+    sm = messaging.SubMaster(['carState', 'radarState'])
+    out = {"isTailgating": [], "duration": [], "warningLevel": []}
+    for i in range(start, end):
+      mock_send_car_state(sm, float(self.inputs["v_ego"][i]))
+      mock_send_radar_state(sm,
+                            lead_one_d_rel=float(self.inputs["lead_one_d_rel"][i]),
+                            lead_one_thw=float(self.inputs["lead_one_thw"][i]),
+                            lead_two_d_rel=float(self.inputs["lead_two_d_rel"][i]),
+                            lead_two_thw=float(self.inputs["lead_two_thw"][i]),
+                            log_mono_time=int(self.inputs["mono_time"][i]))
+      ts = td.update(sm)
+      for k in out:
+        out[k].append(ts[k])
+    return out
+
+  def test_batch_matches_streaming(self):
+    """Verify batch update returns the same statuses as streaming updates"""
+    expected = self.stream(TailgatingDetection(), 0, len(self.inputs["mono_time"]))
+    actual = TailgatingDetection().batch_update(**self.inputs)
+    self.assertEqual(set(expected["warningLevel"]), {0, 1, 2, 3}, msg="scenario must reach every warning level")
+    for k in expected:
+      np.testing.assert_array_equal(actual[k], expected[k], err_msg=k)
+
+  def test_batch_continues_streaming_state(self):
+    """Verify batch and streaming updates can be mixed"""
+    n = len(self.inputs["mono_time"])
+    expected = self.stream(TailgatingDetection(), 0, n)
+
+    td = TailgatingDetection()
+    first = td.batch_update(**{k: v[:n // 3] for k, v in self.inputs.items()})
+    second = self.stream(td, n // 3, 2 * n // 3)
+    third = td.batch_update(**{k: v[2 * n // 3:] for k, v in self.inputs.items()})
+    for k in expected:
+      np.testing.assert_array_equal(np.concatenate([first[k], second[k], third[k]]), expected[k], err_msg=k)
+
+  def test_batch_empty(self):
+    """Verify batch update of no elements returns empty arrays"""
+    out = TailgatingDetection().batch_update(**{k: v[:0] for k, v in self.inputs.items()})
+    self.assertTrue(all(len(v) == 0 for v in out.values()))
+
+
 if __name__ == "__main__":
   unittest.main()
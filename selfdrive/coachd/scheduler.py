@@ -0,0 +1,93 @@
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from cereal import messaging
+from common.realtime import sec_since_boot
+from selfdrive.coachd.modules.base import CoachModule
+
+# time in s all modules may take in one coachd update, lower priority modules are deferred past it
+CYCLE_BUDGET = 0.02
+# max number of updates a module that overran its budget is deferred
+MAX_BACKOFF = 20
+
+
+@dataclass
+class ModuleStats:
+  updates: int = 0
+  overruns: int = 0
+  skipped: int = 0
+  last_time: float = 0.  # s
+  max_time: float = 0.  # s
+
+
+class ModuleScheduler:
+  """Updates coach modules when their services update, at most at their rate,
+  and keeps modules that overrun their time budget from delaying the others.
+
+  A non-critical module past its backoff or the cycle budget is deferred to the next update,
+  with the latest values of its services. Critical modules are never deferred.
+  Without realtime, e.g. replaying logs offline, no module is deferred so results don't depend on machine load."""
+
+  def __init__(self, modules: Dict[str, CoachModule], cycle_budget: float = CYCLE_BUDGET, realtime: bool = True):
+    self.modules = modules
+    self.cycle_budget = cycle_budget
+    self.realtime = realtime
+    # stable sort keeps insertion order among equal priorities
+    self.order = sorted(modules, key=lambda field: modules[field].priority)
+    self.stats = {field: ModuleStats() for field in modules}
+    self.last_update: Dict[str, Optional[int]] = {field: None for field in modules}
+    self.backoff = {field: 0 for field in modules}
+    self.deferred = {field: False for field in modules}
+
+  @property
+  def services(self) -> List[str]:
+    return sorted({s for module in self.modules.values() for s in module.services})
+
+  def is_due(self, field: str, sm: messaging.SubMaster) -> bool:
+    module = self.modules[field]
+    triggers = module.triggers
+    if not triggers:
+      return True
+    if not any(sm.updated[s] for s in triggers):
+      return False
+
+    # rate is checked against log time so replays behave as on device
+    if module.rate is not None and self.last_update[field] is not None:
+      mono_time = max(sm.logMonoTime[s] for s in triggers)
+      if mono_time - self.last_update[field] < 1e9 / module.rate:
+        return False
+    return True
+
+  def due(self, sm: messaging.SubMaster) -> List[str]:
+    return [field for field in self.order if self.deferred[field] or self.is_due(field, sm)]
+
+  def update(self, sm: messaging.SubMaster) -> Dict[str, Any]:
+    """Updates all due modules, returns the results of the modules that were updated"""
+    results = {}
+    cycle_start = sec_since_boot()
+    for field in self.due(sm):
+      stats = self.stats[field]
+      module = self.modules[field]
+      if self.realtime and not module.critical and (self.backoff[field] > 0 or sec_since_boot() - cycle_start > self.cycle_budget):
+        self.backoff[field] = max(self.backoff[field] - 1, 0)
+        self.deferred[field] = True
+        stats.skipped += 1
+        continue
+
+      self.deferred[field] = False
+      t = sec_since_boot()
+      results[field] = module.update(sm)
+      dt = sec_since_boot() - t
+
+      triggers = module.triggers
+      self.last_update[field] = max(sm.logMonoTime[s] for s in triggers) if triggers else None
+      stats.updates += 1
+      stats.last_time = dt
+      stats.max_time = max(stats.max_time, dt)
+      if dt > module.time_budget:
+        # defer enough updates to bring the module back within its budget on average
+        stats.overruns += 1
+        if self.realtime and not module.critical:
+          self.backoff[field] = min(int(dt / module.time_budget), MAX_BACKOFF)
+
+    return results
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+import unittest
+
+from cereal import messaging
+from selfdrive.coachd.coach_report import CoachReplay, RouteReport, aggregate_drivers, summarize
+
+DT = int(0.05 * 1e9)  # radarState interval in ns
+
+
+def make_events(tailgating_time: float, total_time: float):
+  events = []
+  for i in range(int(total_time * 1e9 / DT)):
+    t = i * DT
+    cs = messaging.new_message('carState')
+    cs.logMonoTime = t
+    cs.carState.vEgo = 20.
+    events.append(cs)
+
+    rs = messaging.new_message('radarState')
+    rs.logMonoTime = t + 1
+    thw = 0.5 if t < tailgating_time * 1e9 else 2.
+    rs.radarState.leadOne.dRel = 10.
+    rs.radarState.leadOne.thw = thw
+    rs.radarState.leadTwo.dRel = 20.
+    rs.radarState.leadTwo.thw = thw
+    events.append(rs)
+  return [e.as_reader() for e in events]
+
+
+class TestCoachReport(unittest.TestCase):
+
+  def test_replay_counts_warning_levels(self):
+    """Verify replay counts reached warning levels and time spent at each level"""
+    replay = CoachReplay()
+    duration = replay.run(make_events(tailgating_time=12, total_time=30))
+    self.assertAlmostEqual(duration, 30 - 0.05, places=2)
+
+    stats = replay.fields["tailgatingStatus"]
+    self.assertEqual(stats.updates, 600)
+    self.assertEqual(dict(stats.level_count), {1: 1, 2: 1})
+    self.assertAlmostEqual(stats.level_time[1], 5, places=1)
+    self.assertAlmostEqual(stats.level_time[2], 2, places=1)
+    self.assertAlmostEqual(stats.max_duration, 12, places=1)
+
+  def test_state_kept_across_segments(self):
+    """Verify tailgating duration continues over segment boundaries"""
+    events = make_events(tailgating_time=25, total_time=30)
+    replay = CoachReplay()
+    replay.run(events[:len(events) // 2])
+    replay.run(events[len(events) // 2:])
+    self.assertEqual(replay.fields["tailgatingStatus"].level_count[3], 1)
+
+  def test_aggregate_drivers(self):
+    """Verify route reports are merged per driver"""
+    reports = []
+    for route in ("a2a0ccea32023010|2023-07-27--13-01-19", "a2a0ccea32023010|2023-07-28--13-01-19"):
+      report = RouteReport(route=route, dongle_id="a2a0ccea32023010", segments=1)
+      replay = CoachReplay()
+      report.duration = replay.run(make_events(tailgating_time=6, total_time=10))
+      report.fields = replay.fields
+      reports.append(report)
+
+    drivers = aggregate_drivers(reports)
+    driver = drivers["a2a0ccea32023010"]
+    self.assertEqual(driver.segments, 2)
+    self.assertEqual(driver.fields["tailgatingStatus"].level_count[1], 2)
+    summary = summarize(driver)
+    self.assertGreater(summary["fields"]["tailgatingStatus"]["level_count_per_hour"][1], 0)
+    self.assertEqual(summary["fields"]["tailgatingStatus"]["level_count"], {1: 2})
+    self.assertEqual(summary["segments"], 2)
+
+  def test_replay_not_deferred(self):
+    """Verify offline replay updates every module on every trigger"""
+    replay = CoachReplay()
+    replay.CD.scheduler.cycle_budget = 0.
+    for module in replay.CD.modules.values():
+      module.time_budget = 0.
+      module.critical = False
+    replay.run(make_events(tailgating_time=0, total_time=5))
+    self.assertEqual(replay.fields["tailgatingStatus"].updates, 100)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+import time
+import unittest
+from typing import Dict
+
+from cereal import messaging
+from selfdrive.coachd.coachd import CoachD
+from selfdrive.coachd.modules.base import CoachModule
+from selfdrive.coachd.scheduler import MAX_BACKOFF, ModuleScheduler
+
+
+class CountingModule(CoachModule):
+
+  services = ['carState', 'radarState']
+  update_on = ['radarState']
+
+  def __init__(self):
+    self.count = 0
+
+  def update(self, sm: messaging.SubMaster) -> Dict[str, int]:
+    self.count += 1
+    return {"warningLevel": self.count}
+
+
+class RateLimitedModule(CountingModule):
+
+  rate = 1.  # Hz
+
+
+class SlowModule(CountingModule):
+
+  time_budget = 0.001
+  priority = 1
+
+  def update(self, sm: messaging.SubMaster) -> Dict[str, int]:
+    time.sleep(0.0025)
+    return super().update(sm)
+
+
+class CriticalSlowModule(SlowModule):
+
+  critical = True
+
+
+def send(sm: messaging.SubMaster, service: str, log_mono_time: int) -> None:
+  for s in sm.updated:
+    sm.updated[s] = False
+  sm.updated[service] = True
+  sm.logMonoTime[service] = log_mono_time
+
+
+class TestModuleScheduler(unittest.TestCase):
+
+  def setUp(self):
+    self.SM = messaging.SubMaster(['carState', 'radarState'])
+
+  def test_module_only_updated_on_trigger_services(self):
+    """Verify module is updated only when one of its triggering services updates"""
+    module = CountingModule()
+    scheduler = ModuleScheduler({"m": module})
+
+    send(self.SM, 'carState', 0)
+    self.assertEqual(scheduler.update(self.SM), {})
+    send(self.SM, 'radarState', 0)
+    self.assertEqual(scheduler.update(self.SM), {"m": {"warningLevel": 1}})
+
+  def test_module_without_services_always_updated(self):
+    """Verify module without services is updated on every update"""
+    module = CountingModule()
+    module.services = []
+    module.update_on = None
+    scheduler = ModuleScheduler({"m": module})
+    for _ in range(3):
+      scheduler.update(self.SM)
+    self.assertEqual(module.count, 3)
+
+  def test_rate_limited_by_log_time(self):
+    """Verify module is not updated faster than its rate"""
+    module = RateLimitedModule()
+    scheduler = ModuleScheduler({"m": module})
+    for i in range(40):  # 2 s at 20 Hz
+      send(self.SM, 'radarState', int(i * 0.05 * 1e9))
+      scheduler.update(self.SM)
+    self.assertEqual(module.count, 2)
+
+  def test_overrun_accounting_and_backoff(self):
+    """Verify overrunning module is counted, backed off and does not block other modules"""
+    fast, slow = CountingModule(), SlowModule()
+    scheduler = ModuleScheduler({"slow": slow, "fast": fast})
+    self.assertEqual(scheduler.order, ["fast", "slow"])
+
+    for i in range(10):
+      send(self.SM, 'radarState', i)
+      scheduler.update(self.SM)
+
+    self.assertEqual(fast.count, 10)
+    self.assertLess(slow.count, 10)
+    stats = scheduler.stats["slow"]
+    self.assertEqual(stats.updates, slow.count)
+    self.assertEqual(stats.overruns, slow.count)
+    self.assertEqual(stats.updates + stats.skipped, 10)
+    self.assertGreater(stats.max_time, slow.time_budget)
+    self.assertEqual(scheduler.stats["fast"].skipped, 0)
+
+  def test_deferred_update(self):
+    """Verify deferred module is updated on the next update, without a new trigger"""
+    slow = SlowModule()
+    scheduler = ModuleScheduler({"slow": slow})
+
+    send(self.SM, 'radarState', 0)
+    scheduler.update(self.SM)
+    send(self.SM, 'radarState', 1)
+    scheduler.update(self.SM)
+    self.assertEqual((slow.count, scheduler.stats["slow"].skipped), (1, 1))
+
+    send(self.SM, 'carState', 2)
+    for _ in range(MAX_BACKOFF):
+      scheduler.update(self.SM)
+    self.assertEqual(slow.count, 2)
+
+  def test_critical_module_never_deferred(self):
+    """Verify critical module is updated on every trigger despite overruns"""
+    critical = CriticalSlowModule()
+    scheduler = ModuleScheduler({"critical": critical}, cycle_budget=0.)
+
+    for i in range(10):
+      send(self.SM, 'radarState', i)
+      scheduler.update(self.SM)
+
+    self.assertEqual(critical.count, 10)
+    self.assertEqual(scheduler.stats["critical"].overruns, 10)
+    self.assertEqual(scheduler.stats["critical"].skipped, 0)
+
+
+class TestCoachDScheduling(unittest.TestCase):
+
+  def test_status_kept_while_module_not_due(self):
+    """Verify last status of a module is published while it is not due"""
+    sm = messaging.SubMaster(['carState', 'radarState'])
+    CD = CoachD(modules={"tailgatingStatus": CountingModule}, validated_services=[])
+
+    send(sm, 'radarState', 0)
+    self.assertTrue(CD.is_update_due(sm))
+    CD.update(sm)
+
+    send(sm, 'carState', 1)
+    self.assertFalse(CD.is_update_due(sm))
+    dat = CD.update(sm)
+    self.assertEqual(dat.drivingCoachState.tailgatingStatus.warningLevel, 1)
+    self.assertEqual(CD.stats["tailgatingStatus"]["updates"], 1)
+
+  def test_services_include_module_services(self):
+    """Verify coachd subscribes to the services of its modules"""
+    CD = CoachD(modules={"tailgatingStatus": CountingModule}, validated_services=["liveCalibration"])
+    self.assertEqual(CD.services, ["carState", "liveCalibration", "radarState"])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,7 +1,6 @@
 import copy
 import os
 import json
-from collections import defaultdict
 from dataclasses import dataclass
 from typing import List, Dict, Optional
 
@@ -36,11 +35,17 @@ class AlertEntry:
 
 class AlertManager:
   def __init__(self):
-    self.alerts: Dict[str, AlertEntry] = defaultdict(AlertEntry)
+    # only active alerts are kept, an alert added again after it ended starts over anyway
+    self.alerts: Dict[str, AlertEntry] = {}
+    # order in which alert types were first added, breaks ties between alerts that started together
+    self.alert_order: Dict[str, int] = {}
 
   def add_many(self, frame: int, alerts: List[Alert]) -> None:
     for alert in alerts:
-      entry = self.alerts[alert.alert_type]
+      entry = self.alerts.get(alert.alert_type)
+      if entry is None:
+        entry = self.alerts[alert.alert_type] = AlertEntry()
+        self.alert_order.setdefault(alert.alert_type, len(self.alert_order))
       entry.alert = alert
       if not entry.active(frame):
         entry.start_frame = frame
@@ -49,16 +54,18 @@ class AlertManager:
 
   def process_alerts(self, frame: int, clear_event_types: set) -> Optional[Alert]:
     current_alert = AlertEntry()
-    for v in self.alerts.values():
-      if not v.alert:
-        continue
-
+    current_key = None
+    for alert_type, v in list(self.alerts.items()):
       if v.alert.event_type in clear_event_types:
         v.end_frame = -1
 
-      # sort by priority first and then by start_frame
-      greater = current_alert.alert is None or (v.alert.priority, v.start_frame) > (current_alert.alert.priority, current_alert.start_frame)
-      if v.active(frame) and greater:
-        current_alert = v
+      if not v.active(frame):
+        del self.alerts[alert_type]
+        continue
+
+      # sort by priority first, then by start_frame and then by the order alerts were first added
+      key = (v.alert.priority, v.start_frame, -self.alert_order[alert_type])
+      if current_key is None or key > current_key:
+        current_alert, current_key = v, key
 
     return current_alert.alert
@@ -1,7 +1,7 @@
 import math
 import os
 from enum import IntEnum
-from typing import Dict, Union, Callable, List, Optional
+from typing import Dict, Union, Callable, List, Optional, Set
 
 from cereal import log, car
 import cereal.messaging as messaging
@@ -40,6 +40,18 @@ class ET:
   PERMANENT = 'permanent'
 
 
+# bit of each event type in event type masks
+ET_BITS = {et: 1 << i for i, et in enumerate((ET.ENABLE, ET.PRE_ENABLE, ET.OVERRIDE, ET.NO_ENTRY, ET.WARNING, ET.USER_DISABLE,
+                                              ET.SOFT_DISABLE, ET.IMMEDIATE_DISABLE, ET.PERMANENT))}
+
+
+def event_type_mask(event_types) -> int:
+  mask = 0
+  for et in event_types:
+    mask |= ET_BITS[et]
+  return mask
+
+
 # get event name from enum
 EVENT_NAME = {v: k for k, v in EventName.schema.enumerants.items()}
 
@@ -48,7 +60,9 @@ class Events:
   def __init__(self):
     self.events: List[int] = []
     self.static_events: List[int] = []
-    self.events_prev = dict.fromkeys(EVENTS.keys(), 0)
+    # number of consecutive clears each event was present for, indexed by event
+    self.events_prev = [0] * (max(EVENTS.keys()) + 1)
+    self.counted_events: Set[int] = set()
 
   @property
   def names(self) -> List[int]:
@@ -63,21 +77,31 @@ class Events:
     self.events.append(event_name)
 
   def clear(self) -> None:
-    self.events_prev = {k: (v + 1 if k in self.events else 0) for k, v in self.events_prev.items()}
+    # only the counters of current and previous events change
+    counted_events = {e for e in self.events if e in EVENTS}
+    for e in self.counted_events - counted_events:
+      self.events_prev[e] = 0
+    for e in counted_events:
+      self.events_prev[e] += 1
+    self.counted_events = counted_events
     self.events = self.static_events.copy()
 
   def any(self, event_type: str) -> bool:
-    return any(event_type in EVENTS.get(e, {}) for e in self.events)
+    bit = ET_BITS[event_type]
+    return any(EVENT_TYPE_MASKS.get(e, 0) & bit for e in self.events)
 
   def create_alerts(self, event_types: List[str], callback_args=None):
     if callback_args is None:
       callback_args = []
 
     ret = []
+    types_mask = event_type_mask(event_types)
     for e in self.events:
-      types = EVENTS[e].keys()
+      mask = EVENT_TYPE_MASKS[e]
+      if not mask & types_mask:
+        continue
       for et in event_types:
-        if et in types:
+        if mask & ET_BITS[et]:
           alert = EVENTS[e][et]
           if not isinstance(alert, Alert):
             alert = alert(*callback_args)
@@ -967,3 +991,6 @@ EVENTS: Dict[int, Dict[str, Union[Alert, AlertCallbackType]]] = {
   },
 
 }
+
+# event types of each event as a bitmask of ET_BITS
+EVENT_TYPE_MASKS: Dict[int, int] = {e: event_type_mask(types) for e, types in EVENTS.items()}
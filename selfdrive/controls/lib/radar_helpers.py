@@ -1,3 +1,5 @@
+import numpy as np
+
 from common.numpy_fast import mean
 from common.kalman.simple_kalman import KF1D
 
@@ -30,6 +32,169 @@ def calculate_ttc(d_rel: float, v_rel: float, v_ego: float) -> float:
   return d_rel / -v_rel if v_ego > 0 and -v_rel > 0 else FLOAT32_INF
 
 
+def calculate_thw_array(d_rel: np.ndarray, v_ego: float) -> np.ndarray:
+  if v_ego > 0:
+    return d_rel / v_ego
+  return np.full(d_rel.shape, FLOAT32_INF)
+
+
+def calculate_ttc_array(d_rel: np.ndarray, v_rel: np.ndarray, v_ego: float) -> np.ndarray:
+  closing = (-v_rel > 0) & (v_ego > 0)
+  return np.divide(d_rel, -v_rel, out=np.full(d_rel.shape, FLOAT32_INF), where=closing)
+
+
+class Tracks():
+  """All radar tracks as a struct of arrays, sorted by track id.
+
+  Equivalent to a Track per radar point, with the Kalman filters of all tracks updated at once."""
+  def __init__(self, kalman_params):
+    A, C, K = kalman_params.A, kalman_params.C, kalman_params.K
+    self.K0, self.K1 = K[0][0], K[1][0]
+    # same terms as KF1D
+    self.A_K_0 = A[0][0] - self.K0 * C[0]
+    self.A_K_1 = A[0][1] - self.K0 * C[1]
+    self.A_K_2 = A[1][0] - self.K1 * C[0]
+    self.A_K_3 = A[1][1] - self.K1 * C[1]
+
+    self.ids = np.zeros(0, dtype=np.int64)
+    self.dRel = np.zeros(0)
+    self.yRel = np.zeros(0)
+    self.vRel = np.zeros(0)
+    self.vLead = np.zeros(0)
+    self.measured = np.zeros(0, dtype=bool)
+    self.vLeadK = np.zeros(0)
+    self.aLeadK = np.zeros(0)
+    self.aLeadTau = np.zeros(0)
+    self.thw = np.zeros(0)
+    self.ttc = np.zeros(0)
+    self.cnt = np.zeros(0, dtype=np.int64)
+    # Kalman filter state
+    self.x_speed = np.zeros(0)
+    self.x_accel = np.zeros(0)
+
+  def __len__(self):
+    return len(self.ids)
+
+  def update(self, ids, d_rel, y_rel, v_rel, measured, v_lead, v_ego):
+    """Replaces the tracks with the given radar points, keeping the state of tracks that still exist"""
+    ids = np.asarray(ids, dtype=np.int64)
+    # the last point wins for duplicate ids, unique also sorts by id
+    n_pts = len(ids)
+    ids, rev_idx = np.unique(ids[::-1], return_index=True)
+    sel = n_pts - 1 - rev_idx
+
+    d_rel = np.asarray(d_rel, dtype=np.float64)[sel]
+    y_rel = np.asarray(y_rel, dtype=np.float64)[sel]
+    v_rel = np.asarray(v_rel, dtype=np.float64)[sel]
+    measured = np.asarray(measured, dtype=bool)[sel]
+    v_lead = np.asarray(v_lead, dtype=np.float64)[sel]
+
+    # carry over state of existing tracks, new tracks start at the measured speed
+    pos = np.searchsorted(self.ids, ids)
+    existing = pos < len(self.ids)
+    existing[existing] = self.ids[pos[existing]] == ids[existing]
+    src = pos[existing]
+
+    cnt = np.zeros(len(ids), dtype=np.int64)
+    x_speed = v_lead.copy()
+    x_accel = np.zeros(len(ids))
+    a_lead_tau = np.full(len(ids), _LEAD_ACCEL_TAU)
+    cnt[existing] = self.cnt[src]
+    x_speed[existing] = self.x_speed[src]
+    x_accel[existing] = self.x_accel[src]
+    a_lead_tau[existing] = self.aLeadTau[src]
+
+    # computed velocity and accelerations
+    upd = cnt > 0
+    new_speed = self.A_K_0 * x_speed + self.A_K_1 * x_accel + self.K0 * v_lead
+    new_accel = self.A_K_2 * x_speed + self.A_K_3 * x_accel + self.K1 * v_lead
+    x_speed = np.where(upd, new_speed, x_speed)
+    x_accel = np.where(upd, new_accel, x_accel)
+
+    self.ids = ids
+    self.dRel = d_rel
+    self.yRel = y_rel
+    self.vRel = v_rel
+    self.vLead = v_lead
+    self.measured = measured
+    self.x_speed = x_speed
+    self.x_accel = x_accel
+    self.vLeadK = x_speed.copy()
+    self.aLeadK = x_accel.copy()
+
+    # Learn if constant acceleration
+    self.aLeadTau = np.where(np.abs(self.aLeadK) < 0.5, _LEAD_ACCEL_TAU, a_lead_tau * 0.9)
+
+    # computed THW and TTC
+    self.thw = calculate_thw_array(self.dRel, v_ego)
+    self.ttc = calculate_ttc_array(self.dRel, self.vRel, v_ego)
+
+    self.cnt = cnt + 1
+
+  def get_keys_for_cluster(self):
+    # Weigh y higher since radar is inaccurate in this dimension
+    return np.column_stack([self.dRel, self.yRel*2, self.vRel])
+
+  def reset_a_lead(self, mask, aLeadK, aLeadTau):
+    self.x_speed[mask] = self.vLead[mask]
+    self.x_accel[mask] = aLeadK
+    self.aLeadK[mask] = aLeadK
+    self.aLeadTau[mask] = aLeadTau
+
+
+class Clusters():
+  """Mean track values per cluster as a struct of arrays, equivalent to a Cluster per label."""
+  def __init__(self, tracks, labels):
+    labels = np.asarray(labels, dtype=np.int64)
+    n = int(labels.max()) + 1 if len(labels) else 0
+    counts = np.bincount(labels, minlength=n)
+
+    def cluster_mean(x):
+      return np.bincount(labels, weights=x, minlength=n) / counts
+
+    self.dRel = cluster_mean(tracks.dRel)
+    self.yRel = cluster_mean(tracks.yRel)
+    self.vRel = cluster_mean(tracks.vRel)
+    self.vLead = cluster_mean(tracks.vLead)
+    self.vLeadK = cluster_mean(tracks.vLeadK)
+    self.thw = cluster_mean(tracks.thw)
+    self.ttc = cluster_mean(tracks.ttc)
+    self.measured = np.bincount(labels, weights=tracks.measured.astype(np.float64), minlength=n) > 0
+
+    # acceleration is only known for tracks seen before
+    old = tracks.cnt > 1
+    old_counts = np.bincount(labels, weights=old.astype(np.float64), minlength=n)
+    has_old = old_counts > 0
+    old_counts[~has_old] = 1
+    self.aLeadK = np.where(has_old, np.bincount(labels, weights=np.where(old, tracks.aLeadK, 0.), minlength=n) / old_counts, 0.)
+    self.aLeadTau = np.where(has_old, np.bincount(labels, weights=np.where(old, tracks.aLeadTau, 0.), minlength=n) / old_counts,
+                             _LEAD_ACCEL_TAU)
+
+  def __len__(self):
+    return len(self.dRel)
+
+  def get_RadarState(self, i, model_prob=0.0):
+    return {
+      "dRel": float(self.dRel[i]),
+      "yRel": float(self.yRel[i]),
+      "vRel": float(self.vRel[i]),
+      "vLead": float(self.vLead[i]),
+      "vLeadK": float(self.vLeadK[i]),
+      "aLeadK": float(self.aLeadK[i]),
+      "status": True,
+      "fcw": model_prob > .9,
+      "modelProb": model_prob,
+      "radar": True,
+      "aLeadTau": float(self.aLeadTau[i]),
+      "thw": float(self.thw[i]),
+      "ttc": float(self.ttc[i])
+    }
+
+  def potential_low_speed_leads(self, v_ego):
+    # stop for stuff in front of you and low speed, even without model confirmation
+    return (np.abs(self.yRel) < 1.0) & (v_ego < v_ego_stationary) & (self.dRel < 25)
+
+
 class Track():
   def __init__(self, v_lead, kalman_params):
     self.cnt = 0
@@ -2,7 +2,7 @@
 import random
 import unittest
 
-from selfdrive.controls.lib.events import Alert, EVENTS
+from selfdrive.controls.lib.events import Alert, AlertSize, AlertStatus, AudibleAlert, EVENTS, Priority, VisualAlert
 from selfdrive.controls.lib.alertmanager import AlertManager
 
 
@@ -40,6 +40,34 @@ class TestAlertManager(unittest.TestCase):
           should_show = frame <= show_duration
           self.assertEqual(shown, should_show, msg=f"{frame=} {add_duration=} {duration=}")
 
+  def test_priority(self):
+    """
+      Highest priority wins, then the latest started alert, then the alert added first. Ended alerts are dropped.
+    """
+    def make_alert(alert_type, priority):
+      alert = Alert("", "", AlertStatus.normal, AlertSize.small, priority, VisualAlert.none, AudibleAlert.none, .1)
+      alert.alert_type = alert_type
+      return alert
+
+    low_a, low_b, high = make_alert("a", Priority.LOW), make_alert("b", Priority.LOW), make_alert("c", Priority.HIGH)
+    AM = AlertManager()
+    AM.add_many(0, [low_a, low_b])
+    self.assertIs(AM.process_alerts(0, set()), low_a)
+
+    AM.add_many(1, [low_b, high])
+    self.assertIs(AM.process_alerts(1, set()), high)
+
+    # b started later than a
+    AM.add_many(200, [low_a])
+    AM.add_many(201, [low_b])
+    self.assertIs(AM.process_alerts(201, set()), low_b)
+
+    # both ended and start again together, a was added first
+    self.assertIsNone(AM.process_alerts(1000, set()))
+    self.assertEqual(len(AM.alerts), 0)
+    AM.add_many(1001, [low_b, low_a])
+    self.assertIs(AM.process_alerts(1001, set()), low_a)
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+import unittest
+
+import numpy as np
+
+from selfdrive.controls.lib.radar_helpers import Cluster, Clusters, Track, Tracks
+from selfdrive.controls.radard import KalmanParams
+
+
+def cluster_labels(ids):
+  # contiguous labels, like cluster_points_centroid
+  return np.unique(np.asarray(ids) % 4, return_inverse=True)[1]
+
+
+class TestRadarTracks(unittest.TestCase):
+  def test_tracks_match_per_object_tracks(self):
+    np.random.seed(0)
+    kalman_params = KalmanParams(0.05)
+    tracks = Tracks(kalman_params)
+    ref_tracks = {}
+
+    for frame in range(200):
+      v_ego = max(0., 10 + 5 * np.sin(frame / 20))
+      # tracks appear and disappear
+      ids = sorted(np.random.choice(40, size=np.random.randint(0, 32), replace=False).tolist())
+      pts = {i: (np.random.uniform(0, 100), np.random.uniform(-5, 5), np.random.uniform(-10, 10), bool(np.random.rand() > 0.2))
+             for i in ids}
+      v_lead = {i: pts[i][2] + v_ego for i in ids}
+
+      # reference: a Track per point
+      for i in list(ref_tracks):
+        if i not in pts:
+          del ref_tracks[i]
+      for i in pts:
+        if i not in ref_tracks:
+          ref_tracks[i] = Track(v_lead[i], kalman_params)
+        ref_tracks[i].update(*pts[i][:3], v_lead[i], pts[i][3], v_ego)
+
+      # for duplicate ids the last point wins
+      arr = [(i, *pts[i]) for i in ids]
+      if len(arr) > 2:
+        arr.insert(0, (ids[1], 0., 0., 0., False))
+      a_ids, d_rel, y_rel, v_rel, measured = (np.array(x) for x in zip(*arr)) if len(arr) else ([], [], [], [], [])
+      tracks.update(a_ids, d_rel, y_rel, v_rel, measured, np.asarray(v_rel, dtype=np.float64) + v_ego, v_ego)
+
+      idens = sorted(ref_tracks)
+      np.testing.assert_array_equal(tracks.ids, idens)
+      for attr in ('dRel', 'yRel', 'vRel', 'vLead', 'vLeadK', 'aLeadK', 'aLeadTau', 'thw', 'ttc', 'cnt', 'measured'):
+        np.testing.assert_array_equal(getattr(tracks, attr), [getattr(ref_tracks[i], attr) for i in idens], err_msg=attr)
+
+      if not len(idens):
+        continue
+
+      labels = cluster_labels(idens)
+      clusters = Clusters(tracks, labels)
+      ref_clusters = [Cluster() for _ in range(max(labels) + 1)]
+      for i, label in zip(idens, labels):
+        ref_clusters[label].add(ref_tracks[i])
+
+      for i, ref in enumerate(ref_clusters):
+        actual = clusters.get_RadarState(i, 0.95)
+        for k, v in ref.get_RadarState(0.95).items():
+          self.assertAlmostEqual(actual[k], v, places=6, msg=k)
+        self.assertEqual(clusters.potential_low_speed_leads(v_ego)[i], ref.potential_low_speed_lead(v_ego))
+
+      # reset accel of new tracks to their cluster
+      new_tracks = tracks.cnt <= 1
+      tracks.reset_a_lead(new_tracks, clusters.aLeadK[labels[new_tracks]], clusters.aLeadTau[labels[new_tracks]])
+      for i, label in zip(idens, labels):
+        if ref_tracks[i].cnt <= 1:
+          ref_tracks[i].reset_a_lead(ref_clusters[label].aLeadK, ref_clusters[label].aLeadTau)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -64,6 +64,35 @@ class TestVehicleModel(unittest.TestCase):
 
           np.testing.assert_almost_equal(x1, x2, decimal=3)
 
+  def test_vec_against_scalar(self):
+    """Verifies that the array versions match the scalar ones, including the kinematic model at low speed"""
+    us = np.concatenate([[0., 0.05, 0.1], np.linspace(0.2, 30, num=10)])
+    rolls = np.linspace(math.radians(-20), math.radians(20), num=11)
+    sas = np.linspace(math.radians(-20), math.radians(20), num=11)
+    sa, u, roll = np.meshgrid(sas, us, rolls, indexing='ij')
+
+    ss_vec = self.VM.steady_state_sol_vec(sa, u, roll)
+    curv_vec = self.VM.calc_curvature_vec(sa, u, roll)
+    steer_vec = self.VM.get_steer_from_curvature_vec(curv_vec, u, roll)
+    roll_comp_vec = self.VM.roll_compensation_vec(roll, u)
+    self.assertEqual(ss_vec.shape, (2,) + sa.shape)
+
+    for idx in np.ndindex(sa.shape):
+      args = (sa[idx], u[idx], roll[idx])
+      np.testing.assert_allclose(ss_vec[(slice(None),) + idx], self.VM.steady_state_sol(*args)[:, 0], rtol=1e-9, atol=1e-12)
+      self.assertAlmostEqual(curv_vec[idx], self.VM.calc_curvature(*args))
+      self.assertAlmostEqual(roll_comp_vec[idx], self.VM.roll_compensation(roll[idx], u[idx]))
+      self.assertAlmostEqual(steer_vec[idx], self.VM.get_steer_from_curvature(curv_vec[idx], u[idx], roll[idx]))
+
+  def test_vec_broadcast(self):
+    # scalars broadcast against arrays
+    us = np.linspace(1, 30, num=10)
+    curv = self.VM.calc_curvature_vec(0.1, us, 0.)
+    self.assertEqual(curv.shape, us.shape)
+    for u, c in zip(us, curv):
+      self.assertAlmostEqual(c, self.VM.calc_curvature(0.1, u, 0.))
+    self.assertEqual(self.VM.steady_state_sol_vec(0.1, 10., 0.).shape, (2,))
+
 
 
 if __name__ == "__main__":
@@ -12,7 +12,7 @@ x_dot = A*x + B*u
 
 A depends on longitudinal speed, u [m/s], and vehicle parameters CP
 """
-from typing import Tuple
+from typing import Tuple, Union
 
 import numpy as np
 from numpy.linalg import solve
@@ -21,6 +21,11 @@ from cereal import car
 
 ACCELERATION_DUE_TO_GRAVITY = 9.8
 
+# speed below which the kinematic model is used [m/s]
+KIN_MODEL_SPEED = 0.1
+
+FloatArray = Union[float, np.ndarray]
+
 
 class VehicleModel:
   def __init__(self, CP: car.CarParams):
@@ -60,7 +65,7 @@ class VehicleModel:
     Returns:
       2x1 matrix with steady state solution (lateral speed, rotational speed)
     """
-    if u > 0.1:
+    if u > KIN_MODEL_SPEED:
       return dyn_ss_sol(sa, u, roll, self)
     else:
       return kin_ss_sol(sa, u, self)
@@ -149,6 +154,41 @@ class VehicleModel:
     """
     return self.calc_curvature(sa, u, roll) * u
 
+  # Array versions of the methods above, they broadcast over arrays of steering angles,
+  # speeds and roll and always return arrays.
+
+  def steady_state_sol_vec(self, sa: FloatArray, u: FloatArray, roll: FloatArray) -> np.ndarray:
+    """Array version of steady_state_sol
+
+    Returns:
+      Array of shape (2, *broadcast shape) with lateral speeds and rotational speeds
+    """
+    sa, u, roll = np.broadcast_arrays(np.asarray(sa, dtype=float), np.asarray(u, dtype=float), np.asarray(roll, dtype=float))
+    dyn = u > KIN_MODEL_SPEED
+    # the dynamic solution is undefined at low speed, those samples are replaced by the kinematic one
+    dyn_sol = dyn_ss_sol_vec(sa, np.where(dyn, u, 1.), roll, self)
+    return np.where(dyn, dyn_sol, kin_ss_sol_vec(sa, u, self))
+
+  def calc_curvature_vec(self, sa: FloatArray, u: FloatArray, roll: FloatArray) -> np.ndarray:
+    """Array version of calc_curvature"""
+    u = np.asarray(u, dtype=float)
+    return self.curvature_factor(u) * np.asarray(sa, dtype=float) / self.sR + self.roll_compensation_vec(roll, u)
+
+  def get_steer_from_curvature_vec(self, curv: FloatArray, u: FloatArray, roll: FloatArray) -> np.ndarray:
+    """Array version of get_steer_from_curvature"""
+    u = np.asarray(u, dtype=float)
+    return (np.asarray(curv, dtype=float) - self.roll_compensation_vec(roll, u)) * self.sR / self.curvature_factor(u)
+
+  def roll_compensation_vec(self, roll: FloatArray, u: FloatArray) -> np.ndarray:
+    """Array version of roll_compensation"""
+    roll, u = np.broadcast_arrays(np.asarray(roll, dtype=float), np.asarray(u, dtype=float))
+    sf = calc_slip_factor(self)
+
+    if abs(sf) < 1e-6:
+      return np.zeros(roll.shape)
+    else:
+      return (ACCELERATION_DUE_TO_GRAVITY * roll) / ((1 / sf) - u**2)
+
 
 def kin_ss_sol(sa: float, u: float, VM: VehicleModel) -> np.ndarray:
   """Calculate the steady state solution at low speeds
@@ -224,6 +264,34 @@ def dyn_ss_sol(sa: float, u: float, roll: float, VM: VehicleModel) -> np.ndarray
   return -solve(A, B) @ inp  # type: ignore
 
 
+def kin_ss_sol_vec(sa: FloatArray, u: FloatArray, VM: VehicleModel) -> np.ndarray:
+  """Array version of kin_ss_sol, returns an array of shape (2, *broadcast shape)"""
+  sa, u = np.broadcast_arrays(np.asarray(sa, dtype=float), np.asarray(u, dtype=float))
+  return np.stack([VM.aR / VM.sR / VM.l * u * sa, 1. / VM.sR / VM.l * u * sa])
+
+
+def dyn_ss_sol_vec(sa: FloatArray, u: FloatArray, roll: FloatArray, VM: VehicleModel) -> np.ndarray:
+  """Array version of dyn_ss_sol, returns an array of shape (2, *broadcast shape)
+
+  The 2x2 system is solved in closed form, x = -A^{-1} B u with
+  A^{-1} = 1 / det(A) * [[A11, -A01], [-A10, A00]] and B11 = 0
+  """
+  sa, u, roll = np.broadcast_arrays(np.asarray(sa, dtype=float), np.asarray(u, dtype=float), np.asarray(roll, dtype=float))
+
+  # A and B as in create_dyn_state_matrices
+  a00 = - (VM.cF + VM.cR) / (VM.m * u)
+  a01 = - (VM.cF * VM.aF - VM.cR * VM.aR) / (VM.m * u) - u
+  a10 = - (VM.cF * VM.aF - VM.cR * VM.aR) / (VM.j * u)
+  a11 = - (VM.cF * VM.aF**2 + VM.cR * VM.aR**2) / (VM.j * u)
+  b00 = (VM.cF + VM.chi * VM.cR) / VM.m / VM.sR
+  b10 = (VM.cF * VM.aF - VM.chi * VM.cR * VM.aR) / VM.j / VM.sR
+
+  w0 = b00 * sa - ACCELERATION_DUE_TO_GRAVITY * roll
+  w1 = b10 * sa
+  det = a00 * a11 - a01 * a10
+  return -np.stack([a11 * w0 - a01 * w1, a00 * w1 - a10 * w0]) / det
+
+
 def calc_slip_factor(VM: VehicleModel) -> float:
   """The slip factor is a measure of how the curvature changes with speed
   it's positive for Oversteering vehicle, negative (usual case) otherwise.
@@ -8,9 +8,9 @@ from selfdrive.controls.lib.lateral_planner import LateralPlanner
 import cereal.messaging as messaging
 
 
-def plannerd_thread(sm=None, pm=None):
-  config_realtime_process(5, Priority.CTRL_LOW)
-
+def make_step(sm=None, pm=None):
+  """Sets up the planners and returns a function running one iteration of the
+     plannerd loop, planning whenever a new modelV2 arrived."""
   cloudlog.info("plannerd is waiting for CarParams")
   params = Params()
   CP = car.CarParams.from_bytes(params.get("CarParams", block=True))
@@ -26,7 +26,7 @@ def plannerd_thread(sm=None, pm=None):
   if pm is None:
     pm = messaging.PubMaster(['longitudinalPlan', 'lateralPlan'])
 
-  while True:
+  def step():
     sm.update()
 
     if sm.updated['modelV2']:
@@ -35,6 +35,16 @@ def plannerd_thread(sm=None, pm=None):
       longitudinal_planner.update(sm)
       longitudinal_planner.publish(sm, pm)
 
+  return step
+
+
+def plannerd_thread(sm=None, pm=None):
+  config_realtime_process(5, Priority.CTRL_LOW)
+
+  step = make_step(sm, pm)
+  while True:
+    step()
+
 
 def main(sm=None, pm=None):
   plannerd_thread(sm, pm)
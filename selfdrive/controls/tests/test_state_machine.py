@@ -6,7 +6,7 @@ from common.realtime import DT_CTRL
 from selfdrive.car.car_helpers import interfaces
 from selfdrive.controls.controlsd import Controls, SOFT_DISABLE_TIME
 from selfdrive.controls.lib.events import Events, ET, Alert, Priority, AlertSize, AlertStatus, VisualAlert, \
-                                          AudibleAlert, EVENTS
+                                          AudibleAlert, EVENTS, EVENT_TYPE_MASKS, event_type_mask
 
 State = log.ControlsState.OpenpilotState
 
@@ -24,6 +24,7 @@ def make_event(event_types):
     event[ev] = Alert("", "", AlertStatus.normal, AlertSize.small, Priority.LOW,
                       VisualAlert.none, AudibleAlert.none, 1.)
   EVENTS[0] = event
+  EVENT_TYPE_MASKS[0] = event_type_mask(event)
   return 0
 
 
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+import cereal.messaging as messaging
+from selfdrive.test.process_replay.compare_logs import compare_logs
+
+
+def make_logs(n, changed):
+  """Two logs of n carStates, every message of the second log differs in the changed fraction of them"""
+  log1, log2 = [], []
+  for i in range(n):
+    for log, offset in ((log1, 0.), (log2, 1. if i < n * changed else 0.)):
+      msg = messaging.new_message('carState')
+      msg.logMonoTime = i
+      msg.carState.vEgo = 10. + offset
+      msg.carState.aEgo = 0.1 * i
+      msg.carState.gearShifter = 'drive'
+      msg.carState.cruiseState.speed = 25.
+      msg.carState.init('buttonEvents', 1)
+      log.append(msg.as_reader())
+  return log1, log2
+
+
+def run(log1, log2, vectorized):
+  t = time.monotonic()
+  diff = compare_logs(log1, log2, vectorized=vectorized)
+  return time.monotonic() - t, len(diff)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Time compare_logs message by message and vectorised",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("-n", "--messages", type=int, default=6000, help="Number of messages per log")
+  parser.add_argument("--changed", type=float, nargs="+", default=[0., 1.], help="Fractions of messages that differ")
+  args = parser.parse_args()
+
+  for changed in args.changed:
+    log1, log2 = make_logs(args.messages, changed)
+    before, n_diff = run(log1, log2, False)
+    after, n_diff_vec = run(log1, log2, True)
+    assert n_diff == n_diff_vec
+    print(f"{changed:4.0%} changed, {n_diff:6d} diffs: message by message {before:.3f} s, vectorised {after:.3f} s, {before / after:.1f}x")
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+import argparse
+import random
+import time
+
+from selfdrive.controls.lib.alertmanager import AlertManager
+from selfdrive.controls.lib.events import ET, EVENTS, Alert, Events
+
+# the event handling controlsd does every step
+ANY_EVENT_TYPES = [ET.NO_ENTRY, ET.SOFT_DISABLE, ET.IMMEDIATE_DISABLE, ET.USER_DISABLE, ET.OVERRIDE, ET.ENABLE, ET.PRE_ENABLE]
+ALERT_EVENT_TYPES = [ET.PERMANENT, ET.WARNING, ET.NO_ENTRY]
+
+
+def run(n_events, steps, seed=0):
+  """Times the event and alert handling of steps control steps with n_events active events, in s per step"""
+  random.seed(seed)
+  # events with callbacks need a running controlsd to create their alerts
+  candidates = [e for e, alerts in EVENTS.items() if len(alerts) and all(isinstance(a, Alert) for a in alerts.values())]
+
+  events = Events()
+  AM = AlertManager()
+  active = random.sample(candidates, n_events)
+
+  t = time.monotonic()
+  for frame in range(steps):
+    # events come and go
+    if n_events and frame % 100 == 0:
+      active[random.randrange(n_events)] = random.choice(candidates)
+
+    events.clear()
+    for e in active:
+      events.add(e)
+    for et in ANY_EVENT_TYPES:
+      events.any(et)
+
+    alerts = events.create_alerts(ALERT_EVENT_TYPES)
+    AM.add_many(frame, alerts)
+    AM.process_alerts(frame, {ET.WARNING} if frame % 50 == 0 else set())
+  return (time.monotonic() - t) / steps
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Microbenchmark of the event and alert handling of a control step",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("-n", "--steps", type=int, default=10000, help="Number of control steps per run")
+  parser.add_argument("--events", type=int, nargs="+", default=[0, 1, 5, 20], help="Numbers of active events to run with")
+  args = parser.parse_args()
+
+  print(f"{len(EVENTS)} events in the catalogue")
+  for n in args.events:
+    print(f"{n:3d} active events: {run(n, args.steps) * 1e6:8.1f} us/step")
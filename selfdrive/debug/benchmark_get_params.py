@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+import argparse
+import time
+from unittest import mock
+
+from selfdrive.car import gen_empty_fingerprint
+from selfdrive.car import interfaces as car_interfaces
+from selfdrive.car.car_helpers import interfaces
+from selfdrive.car.fingerprints import all_known_cars
+from selfdrive.car.tests.test_car_interfaces import get_torque_params_uncached
+
+
+def get_params_all_cars(iterations):
+  fingerprints = gen_empty_fingerprint()
+  cars = sorted(all_known_cars())
+  t = time.monotonic()
+  for _ in range(iterations):
+    for car_name in cars:
+      interfaces[car_name][0].get_params(car_name, fingerprints, [])
+  return time.monotonic() - t, len(cars) * iterations
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Time CarInterface.get_params over all cars with and without the compiled torque params")
+  parser.add_argument("-n", "--iterations", type=int, default=5, help="Number of passes over all cars")
+  args = parser.parse_args()
+
+  # warm up imports and the compiled database
+  get_params_all_cars(1)
+
+  with mock.patch.object(car_interfaces, "get_torque_params", get_torque_params_uncached):
+    before, calls = get_params_all_cars(args.iterations)
+  after, _ = get_params_all_cars(args.iterations)
+
+  print(f"{calls} get_params calls")
+  print(f"parsed per call: {before:.3f} s total, {before / calls * 1e3:.3f} ms/call")
+  print(f"compiled:        {after:.3f} s total, {after / calls * 1e3:.3f} ms/call")
+  print(f"speedup: {before / after:.1f}x")
@@ -10,7 +10,7 @@ import gc
 import os
 import capnp
 import numpy as np
-from typing import List, NoReturn, Optional
+from typing import Callable, List, NoReturn, Optional
 
 from cereal import log
 import cereal.messaging as messaging
@@ -201,10 +201,8 @@ class Calibrator:
     pm.send('liveCalibration', self.get_msg())
 
 
-def calibrationd_thread(sm: Optional[messaging.SubMaster] = None, pm: Optional[messaging.PubMaster] = None) -> NoReturn:
-  gc.disable()
-  set_realtime_priority(1)
-
+def make_step(sm: Optional[messaging.SubMaster] = None, pm: Optional[messaging.PubMaster] = None) -> Callable[[], None]:
+  """Sets up the calibrator and returns a function running one iteration of the calibrationd loop."""
   if sm is None:
     sm = messaging.SubMaster(['cameraOdometry', 'carState', 'carParams'], poll=['cameraOdometry'])
 
@@ -213,7 +211,7 @@ def calibrationd_thread(sm: Optional[messaging.SubMaster] = None, pm: Optional[m
 
   calibrator = Calibrator(param_put=True)
 
-  while 1:
+  def step() -> None:
     timeout = 0 if sm.frame == -1 else 100
     sm.update(timeout)
 
@@ -232,6 +230,17 @@ def calibrationd_thread(sm: Optional[messaging.SubMaster] = None, pm: Optional[m
     if sm.frame % 5 == 0:
       calibrator.send_data(pm)
 
+  return step
+
+
+def calibrationd_thread(sm: Optional[messaging.SubMaster] = None, pm: Optional[messaging.PubMaster] = None) -> NoReturn:
+  gc.disable()
+  set_realtime_priority(1)
+
+  step = make_step(sm, pm)
+  while 1:
+    step()
+
 
 def main(sm: Optional[messaging.SubMaster] = None, pm: Optional[messaging.PubMaster] = None) -> NoReturn:
   calibrationd_thread(sm, pm)
@@ -104,9 +104,8 @@ class ParamsLearner:
       self.kf.filter.reset_rewind()
 
 
-def main(sm=None, pm=None):
-  config_realtime_process([0, 1, 2, 3], 5)
-
+def make_step(sm=None, pm=None):
+  """Sets up the learner and returns a function running one iteration of the paramsd loop."""
   if sm is None:
     sm = messaging.SubMaster(['liveLocationKalman', 'carState'], poll=['liveLocationKalman'])
   if pm is None:
@@ -159,7 +158,9 @@ def main(sm=None, pm=None):
   angle_offset_average = params['angleOffsetAverageDeg']
   angle_offset = angle_offset_average
 
-  while True:
+  def step():
+    nonlocal learner, angle_offset_average, angle_offset
+
     sm.update()
     if sm.all_checks():
       for which in sorted(sm.updated.keys(), key=lambda x: sm.logMonoTime[x]):
@@ -214,6 +215,16 @@ def main(sm=None, pm=None):
 
       pm.send('liveParameters', msg)
 
+  return step
+
+
+def main(sm=None, pm=None):
+  config_realtime_process([0, 1, 2, 3], 5)
+
+  step = make_step(sm, pm)
+  while True:
+    step()
+
 
 if __name__ == "__main__":
   main()
@@ -2,39 +2,156 @@
 import os
 import shutil
 import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
 from system.swaglog import cloudlog
-from selfdrive.loggerd.config import ROOT, get_available_bytes, get_available_percent
-from selfdrive.loggerd.uploader import listdir_by_creation
+from selfdrive.loggerd.config import ROOT
+from selfdrive.loggerd.uploader import DIR_SETTLE_TIME, UPLOAD_ATTR_NAME, get_directory_sort, listdir_by_creation
 
 MIN_BYTES = 5 * 1024 * 1024 * 1024
 MIN_PERCENT = 10
 
 DELETE_LAST = ['boot', 'crash']
 
+# files the uploader uploads, segments are deleted first once these are uploaded
+UPLOADED_FILES = ('qlog', 'qlog.bz2', 'qcamera.ts')
+
+
+@dataclass
+class SegmentInfo:
+  mtime: Optional[int]  # ns, None until the directory settled
+  size: int = 0
+  locked: bool = False
+  not_uploaded: List[str] = field(default_factory=list)  # names of UPLOADED_FILES not uploaded yet
+
+  @property
+  def uploaded(self) -> bool:
+    return not len(self.not_uploaded)
+
+
+def is_uploaded(path: str) -> bool:
+  # not cached, the uploader sets the attribute in another process
+  try:
+    return os.getxattr(path, UPLOAD_ATTR_NAME) is not None
+  except OSError:
+    # ENODATA when not uploaded, or removed since the scan
+    return False
+
+
+def is_locked(path: str) -> bool:
+  try:
+    return any(name.endswith(".lock") for name in os.listdir(path))
+  except NotADirectoryError:
+    return False
+
+
+def get_bytes_to_free(path: str) -> int:
+  """Bytes to delete to have MIN_BYTES and MIN_PERCENT of the disk available"""
+  try:
+    st = os.statvfs(path)
+  except OSError:
+    return 0
+  bytes_short = MIN_BYTES - st.f_bavail * st.f_frsize
+  percent_short = (MIN_PERCENT / 100 * st.f_blocks - st.f_bavail) * st.f_frsize
+  return int(max(bytes_short, percent_short, 0))
+
+
+class DeleterIndex:
+  """Size, lock and upload state of each segment. A segment is only scanned again when its mtime changed,
+  uploading doesn't change it, so files not uploaded yet are checked again on every update."""
+  def __init__(self, root: str):
+    self.root = root
+    self.segments: Dict[str, SegmentInfo] = {}
+
+  def _scan(self, name: str) -> None:
+    path = os.path.join(self.root, name)
+    try:
+      st = os.stat(path)
+      info = self.segments.get(name)
+      if info is not None and info.mtime is not None and info.mtime == st.st_mtime_ns:
+        info.not_uploaded = [f for f in info.not_uploaded if not is_uploaded(os.path.join(path, f))]
+        return
+
+      settled = time.time_ns() - st.st_mtime_ns > DIR_SETTLE_TIME * 1e9
+      info = SegmentInfo(st.st_mtime_ns if settled else None)
+      if not os.path.isdir(path):
+        info.size = st.st_size
+      else:
+        with os.scandir(path) as it:
+          for entry in it:
+            if entry.name.endswith(".lock"):
+              info.locked = True
+            try:
+              info.size += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+              pass  # uploader or loggerd could have removed it
+            if entry.name in UPLOADED_FILES and not is_uploaded(entry.path):
+              info.not_uploaded.append(entry.name)
+    except OSError:
+      self.segments.pop(name, None)
+      return
+    self.segments[name] = info
+
+  def update(self) -> None:
+    names = set(listdir_by_creation(self.root))
+    for name in set(self.segments) - names:
+      del self.segments[name]
+    for name in names:
+      self._scan(name)
+
+  def remove(self, name: str) -> None:
+    self.segments.pop(name, None)
+
+  def deletion_order(self) -> List[str]:
+    """Unlocked segments, uploaded ones first, then oldest first. Boot and crash logs last."""
+    deletable = [name for name, info in self.segments.items() if not info.locked]
+    return sorted(deletable, key=lambda name: (name in DELETE_LAST, not self.segments[name].uploaded, get_directory_sort(name)))
+
+  def plan(self, bytes_to_free: int) -> List[str]:
+    """The segments to delete to free bytes_to_free, in order"""
+    batch = []
+    freed = 0
+    for name in self.deletion_order():
+      if freed >= bytes_to_free:
+        break
+      batch.append(name)
+      freed += self.segments[name].size
+    return batch
+
+
+def delete_segments(index: DeleterIndex, batch: List[str]) -> None:
+  for name in batch:
+    delete_path = os.path.join(index.root, name)
+    try:
+      # loggerd could have started writing to it since the scan
+      if is_locked(delete_path):
+        index.remove(name)
+        continue
+
+      cloudlog.info(f"deleting {delete_path}")
+      if os.path.isfile(delete_path):
+        os.remove(delete_path)
+      else:
+        shutil.rmtree(delete_path)
+      index.remove(name)
+    except OSError:
+      cloudlog.exception(f"issue deleting {delete_path}")
+
 
 def deleter_thread(exit_event):
+  index = DeleterIndex(ROOT)
   while not exit_event.is_set():
-    out_of_bytes = get_available_bytes(default=MIN_BYTES + 1) < MIN_BYTES
-    out_of_percent = get_available_percent(default=MIN_PERCENT + 1) < MIN_PERCENT
-
-    if out_of_percent or out_of_bytes:
-      # remove the earliest directory we can
-      dirs = sorted(listdir_by_creation(ROOT), key=lambda x: x in DELETE_LAST)
-      for delete_dir in dirs:
-        delete_path = os.path.join(ROOT, delete_dir)
-
-        if any(name.endswith(".lock") for name in os.listdir(delete_path)):
-          continue
-
-        try:
-          cloudlog.info(f"deleting {delete_path}")
-          if os.path.isfile(delete_path):
-            os.remove(delete_path)
-          else:
-            shutil.rmtree(delete_path)
-          break
-        except OSError:
-          cloudlog.exception(f"issue deleting {delete_path}")
+    bytes_to_free = get_bytes_to_free(ROOT)
+
+    if bytes_to_free > 0:
+      # delete enough segments to free the space at once, then check again
+      index.update()
+      batch = index.plan(bytes_to_free)
+      if len(batch):
+        cloudlog.info(f"deleting {len(batch)} segments to free {bytes_to_free} bytes")
+      delete_segments(index, batch)
       exit_event.wait(.1)
     else:
       exit_event.wait(30)
@@ -0,0 +1,169 @@
+import base64
+import bz2
+import os
+import tempfile
+import threading
+import urllib.parse
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from common.file_helpers import CallbackReader
+
+CHUNK_SIZE = 1024 * 1024  # bytes read and compressed at a time
+BLOCK_SIZE = 4 * 1024 * 1024  # bytes sent per request of a block upload
+POOL_SIZE = 8  # connections kept open per host
+MAX_CHECKPOINTS = 100
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+# block ids sent of interrupted block uploads, by (url, path, size, mtime)
+_checkpoints: 'OrderedDict[Tuple, List[str]]' = OrderedDict()
+_checkpoints_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+  """One session per process, so connections are reused between uploads"""
+  global _session
+  with _session_lock:
+    if _session is None:
+      _session = requests.Session()
+      adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+      _session.mount("http://", adapter)
+      _session.mount("https://", adapter)
+    return _session
+
+
+def compressed_chunks(f, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+  """bz2 compresses a file a chunk at a time. The output is the same as bz2.compress(f.read())."""
+  compressor = bz2.BZ2Compressor()
+  while True:
+    chunk = f.read(chunk_size)
+    if not chunk:
+      break
+    out = compressor.compress(chunk)
+    if out:
+      yield out
+  yield compressor.flush()
+
+
+def file_chunks(f, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+  while True:
+    chunk = f.read(chunk_size)
+    if not chunk:
+      break
+    yield chunk
+
+
+def blocks(chunks: Iterator[bytes], block_size: int = BLOCK_SIZE) -> Iterator[bytes]:
+  buf = bytearray()
+  for chunk in chunks:
+    buf += chunk
+    while len(buf) >= block_size:
+      yield bytes(buf[:block_size])
+      del buf[:block_size]
+  if len(buf):
+    yield bytes(buf)
+
+
+def supports_blocks(headers: Dict[str, str]) -> bool:
+  """Block blobs can be uploaded in blocks that are committed at the end"""
+  return headers.get('x-ms-blob-type') == 'BlockBlob'
+
+
+def with_query(url: str, **params: str) -> str:
+  parts = urllib.parse.urlsplit(url)
+  query = "&".join(filter(None, [parts.query, urllib.parse.urlencode(params)]))
+  return urllib.parse.urlunsplit(parts._replace(query=query))
+
+
+def _checkpoint_key(url: str, path: str) -> Tuple:
+  st = os.stat(path)
+  return (url.split('?')[0], path, st.st_size, st.st_mtime_ns)
+
+
+def _block_upload(url: str, headers: Dict[str, str], f, compress: bool, timeout: float,
+                  sent_callback: Optional[Callable[[int], None]]) -> requests.Response:
+  """Sends the file in blocks and commits them. Blocks sent by an earlier, interrupted
+  attempt are skipped, without compression the file isn't even read up to them."""
+  session = get_session()
+  key = _checkpoint_key(url, f.name)
+  with _checkpoints_lock:
+    block_ids = _checkpoints.pop(key, [])
+
+  block_headers = {k: v for k, v in headers.items() if k.lower() not in ('x-ms-blob-type', 'content-length')}
+  try:
+    if compress:
+      skip = len(block_ids)
+      chunks = compressed_chunks(f)
+    else:
+      skip = 0
+      f.seek(len(block_ids) * BLOCK_SIZE)
+      if isinstance(f, CallbackReader):
+        f.total_read = f.tell()
+      chunks = file_chunks(f)
+
+    sent = 0
+    for block in blocks(chunks):
+      if skip > 0:
+        skip -= 1
+        continue
+
+      block_id = base64.b64encode(f"{len(block_ids):08d}".encode()).decode()
+      resp = session.put(with_query(url, comp='block', blockid=block_id), data=block,
+                         headers={**block_headers, 'Content-Length': str(len(block))}, timeout=timeout)
+      if resp.status_code not in (200, 201):
+        return resp
+      block_ids.append(block_id)
+      sent += len(block)
+      if sent_callback is not None:
+        sent_callback(sent)
+
+    block_list = "".join(f"<Latest>{block_id}</Latest>" for block_id in block_ids)
+    body = f'<?xml version="1.0" encoding="utf-8"?><BlockList>{block_list}</BlockList>'.encode()
+    resp = session.put(with_query(url, comp='blocklist'), data=body,
+                       headers={**block_headers, 'Content-Length': str(len(body))}, timeout=timeout)
+    if resp.status_code in (200, 201):
+      block_ids = []
+    return resp
+  finally:
+    # keep the progress of failed attempts
+    if len(block_ids):
+      with _checkpoints_lock:
+        _checkpoints[key] = block_ids
+        while len(_checkpoints) > MAX_CHECKPOINTS:
+          _checkpoints.popitem(last=False)
+
+
+def upload_file(url: str, headers: Dict[str, str], path: str, compress: bool = False,
+                callback: Optional[Callable[[int, int], None]] = None, timeout: float = 10,
+                sent_callback: Optional[Callable[[int], None]] = None) -> requests.Response:
+  """Uploads a file with a PUT request, optionally bz2 compressing it on the fly, with a few MB of memory.
+
+  Block blobs are sent in blocks, an upload that failed resumes after the last block sent.
+  Otherwise a compressed file is spooled next to it, not to the temporary directory, which is in RAM
+  on device, as its size must be sent first. These uploads are not resumable, a failed one compresses
+  and sends the whole file again. callback is called with the size of the file and the number of bytes
+  read so far, sent_callback with the number of bytes sent so far, which is less than read when compressing."""
+  with open(path, "rb") as f:
+    size = os.fstat(f.fileno()).st_size
+    data = CallbackReader(f, callback, size) if callback else f
+
+    if supports_blocks(headers):
+      return _block_upload(url, headers, data, compress, timeout, sent_callback)
+
+    if not compress:
+      if sent_callback is not None:
+        data = CallbackReader(data, sent_callback)
+      return get_session().put(url, data=data, headers={**headers, 'Content-Length': str(size)}, timeout=timeout)
+
+    with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path))) as spool:
+      for chunk in compressed_chunks(data):
+        spool.write(chunk)
+      compressed_size = spool.tell()
+      spool.seek(0)
+      body = CallbackReader(spool, sent_callback) if sent_callback is not None else spool
+      return get_session().put(url, data=body, headers={**headers, 'Content-Length': str(compressed_size)}, timeout=timeout)
@@ -7,6 +7,8 @@ from collections import namedtuple
 
 from common.timeout import Timeout, TimeoutException
 import selfdrive.loggerd.deleter as deleter
+from selfdrive.loggerd.uploader import UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE
+from selfdrive.loggerd.xattr_cache import setxattr
 from selfdrive.loggerd.tests.loggerd_tests_common import UploaderTestCase
 
 Stats = namedtuple("Stats", ['f_bavail', 'f_blocks', 'f_frsize'])
@@ -33,6 +35,11 @@ class TestDeleter(UploaderTestCase):
     self.end_event.set()
     self.del_thread.join()
 
+  def set_bytes_to_free(self, n):
+    block_size = 4096
+    available = (deleter.MIN_BYTES - n) // block_size
+    self.fake_stats = Stats(f_bavail=available, f_blocks=available, f_frsize=block_size)
+
   def test_delete(self):
     f_path = self.make_file_with_data(self.seg_dir, self.f_type, 1)
 
@@ -52,6 +59,8 @@ class TestDeleter(UploaderTestCase):
     self.seg_dir = self.seg_format.format(self.seg_num)
     f_path_2 = self.make_file_with_data(self.seg_dir, self.f_type)
 
+    # less than a segment, so a batch is a single segment
+    self.set_bytes_to_free(50 * 1024)
     self.start_thread()
 
     with Timeout(5, "Timeout waiting for file to be deleted"):
@@ -64,6 +73,69 @@ class TestDeleter(UploaderTestCase):
 
     self.assertTrue(os.path.exists(f_path_2), "Newer file deleted before older file")
 
+  def test_delete_uploaded_first(self):
+    f_path_1 = self.make_file_with_data(self.seg_dir, self.f_type)
+    self.make_file_with_data(self.seg_dir, "qlog.bz2")
+    time.sleep(1)
+    self.seg_num += 1
+    self.seg_dir = self.seg_format.format(self.seg_num)
+    f_path_2 = self.make_file_with_data(self.seg_dir, self.f_type)
+    qlog_path = self.make_file_with_data(self.seg_dir, "qlog.bz2")
+    setxattr(qlog_path, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
+
+    self.set_bytes_to_free(50 * 1024)
+    self.start_thread()
+
+    with Timeout(5, "Timeout waiting for file to be deleted"):
+      while os.path.exists(f_path_1) and os.path.exists(f_path_2):
+        time.sleep(0.01)
+
+    self.join_thread()
+
+    self.assertFalse(os.path.exists(f_path_2), "Uploaded segment not deleted")
+    self.assertTrue(os.path.exists(f_path_1), "Segment not uploaded deleted before uploaded segment")
+
+  def test_batch_delete(self):
+    f_paths = []
+    for _ in range(5):
+      f_paths.append(self.make_file_with_data(self.seg_dir, self.f_type))
+      self.seg_num += 1
+      self.seg_dir = self.seg_format.format(self.seg_num)
+
+    self.set_bytes_to_free(3 * 100 * 1024)
+    self.start_thread()
+
+    with Timeout(5, "Timeout waiting for files to be deleted"):
+      while os.path.exists(f_paths[2]):
+        time.sleep(0.01)
+
+    self.join_thread()
+
+    # the segments needed for the space are deleted at once, not one per pass
+    self.assertFalse(any(os.path.exists(f) for f in f_paths[:3]), "Batch not deleted")
+    self.assertTrue(all(os.path.exists(f) for f in f_paths[3:]), "More deleted than needed")
+
+  def test_index_rechecks_upload_state(self):
+    old_dir, new_dir = self.seg_dir, self.seg_format.format(self.seg_num + 1)
+    qlog_paths = [self.make_file_with_data(d, "qlog.bz2") for d in (old_dir, new_dir)]
+    for d in (old_dir, new_dir):
+      os.utime(os.path.join(self.root, d), (0, 0))
+
+    index = deleter.DeleterIndex(self.root)
+    index.update()
+    self.assertEqual(index.deletion_order(), [old_dir, new_dir])
+
+    # uploaded by another process, without changing the directory
+    os.setxattr(qlog_paths[1], UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
+    index.update()
+    self.assertEqual(index.deletion_order(), [new_dir, old_dir])
+
+    # locked after the scan
+    lock_path = qlog_paths[1] + ".lock"
+    open(lock_path, "w").close()
+    deleter.delete_segments(index, index.plan(1))
+    self.assertTrue(os.path.exists(qlog_paths[1]), "Segment locked after scan deleted")
+
   def test_no_delete_when_available_space(self):
     f_path = self.make_file_with_data(self.seg_dir, self.f_type)
 
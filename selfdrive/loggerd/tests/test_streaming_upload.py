@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+import bz2
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import selfdrive.loggerd.streaming_upload as streaming_upload
+
+
+class MockResponse():
+  def __init__(self, status_code):
+    self.status_code = status_code
+
+
+class MockSession():
+  """Stores the blocks put and fails the request with index fail_at"""
+  def __init__(self, fail_at=None):
+    self.fail_at = fail_at
+    self.requests = []
+    self.blocks = {}
+
+  def put(self, url, data, headers, timeout):
+    if not isinstance(data, bytes):
+      data = data.read()
+    self.requests.append(url)
+    if len(self.requests) - 1 == self.fail_at:
+      return MockResponse(500)
+    if "comp=block&" in url:
+      self.blocks[url.split("blockid=")[1]] = data
+    return MockResponse(201)
+
+
+class TestStreamingUpload(unittest.TestCase):
+  def setUp(self):
+    streaming_upload._checkpoints.clear()
+    self.data = os.urandom(3 * streaming_upload.BLOCK_SIZE // 2) + b"a" * streaming_upload.BLOCK_SIZE * 4
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+      f.write(self.data)
+      self.path = f.name
+
+  def tearDown(self):
+    os.unlink(self.path)
+
+  def test_compressed_chunks(self):
+    chunks = list(streaming_upload.compressed_chunks(io.BytesIO(self.data)))
+    self.assertEqual(b"".join(chunks), bz2.compress(self.data))
+    self.assertTrue(all(len(c) <= streaming_upload.BLOCK_SIZE * 2 for c in chunks))
+
+  def test_block_upload_resume(self):
+    headers = {'x-ms-blob-type': 'BlockBlob'}
+    for compress in (False, True):
+      expected = bz2.compress(self.data) if compress else self.data
+      n_blocks = len(list(streaming_upload.blocks(iter([expected]))))
+      self.assertGreater(n_blocks, 1)
+
+      # the second block fails, the retry starts from there
+      session = MockSession(fail_at=1)
+      with mock.patch.object(streaming_upload, 'get_session', return_value=session):
+        resp = streaming_upload.upload_file("http://localhost/rlog.bz2?sig=1", headers, self.path, compress=compress)
+        self.assertEqual(resp.status_code, 500)
+        self.assertEqual(len(session.requests), 2)
+
+        resp = streaming_upload.upload_file("http://localhost/rlog.bz2?sig=2", headers, self.path, compress=compress)
+        self.assertEqual(resp.status_code, 201)
+
+      # every block was sent once and the blocks were committed
+      self.assertEqual(len(session.requests), 1 + n_blocks + 1)
+      self.assertIn("comp=blocklist", session.requests[-1])
+      self.assertEqual(b"".join(session.blocks[k] for k in sorted(session.blocks)), expected)
+      self.assertEqual(len(streaming_upload._checkpoints), 0)
+
+  def test_sent_bytes(self):
+    """Verify sent bytes are counted after compression, not as read from the file"""
+    expected = len(bz2.compress(self.data))
+    for headers in ({}, {'x-ms-blob-type': 'BlockBlob'}):
+      streaming_upload._checkpoints.clear()
+      read, sent = [], []
+      with mock.patch.object(streaming_upload, 'get_session', return_value=MockSession()):
+        resp = streaming_upload.upload_file("http://localhost/rlog.bz2", headers, self.path, compress=True,
+                                            callback=lambda sz, cur: read.append(cur), sent_callback=sent.append)
+      self.assertEqual(resp.status_code, 201)
+      self.assertEqual(read[-1], len(self.data))
+      self.assertEqual(sent[-1], expected)
+
+
+if __name__ == "__main__":
+  unittest.main()
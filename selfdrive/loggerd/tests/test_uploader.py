@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import os
+import shutil
 import time
 import threading
 import unittest
@@ -153,6 +154,57 @@ class TestUploader(UploaderTestCase):
     for f_path in f_paths:
       self.assertFalse(os.path.isfile(f_path + ".lock"), "File lock not cleared on startup")
 
+  def test_index(self):
+    up = uploader.Uploader("0000000000000000", self.root)
+    self.assertIsNone(up.next_file_to_upload())
+
+    # locked segments are skipped until the lock is removed
+    f_paths = self.gen_files(lock=True, boot=False)
+    self.assertIsNone(up.next_file_to_upload())
+    for f_path in f_paths:
+      os.unlink(f_path + ".lock")
+
+    name, key, fn = up.next_file_to_upload()
+    self.assertEqual((name, key), ("qlog", f"{self.seg_dir}/qlog"))
+    self.assertEqual(up.immediate_count, 1)
+
+    # immediate folders come first
+    self.make_file_with_data("crash", "crash_log", 0.01)
+    self.assertEqual(up.next_file_to_upload()[1], "crash/crash_log")
+
+    for _ in range(2):
+      name, key, fn = up.next_file_to_upload()
+      self.assertTrue(up.upload(name, key, fn, 0, False))
+    self.assertIsNone(up.next_file_to_upload())
+    self.assertEqual(up.immediate_count, 0)
+
+    # removed and new segments are picked up
+    shutil.rmtree(os.path.join(self.root, self.seg_dir))
+    self.seg_dir = self.seg_format.format(self.seg_num + 1)
+    self.gen_files(boot=False)
+    self.assertEqual(up.next_file_to_upload()[1], f"{self.seg_dir}/qlog")
+
+    # new crash logs in a settled crash folder are picked up before the next reconcile
+    os.utime(os.path.join(self.root, "crash"), (0, 0))
+    up.next_file_to_upload()
+    self.make_file_with_data("crash", "crash_log2", 0.01)
+    self.assertEqual(up.next_file_to_upload()[1], "crash/crash_log2")
+
+  def test_index_reconciles_uploaded(self):
+    self.gen_files(boot=False)
+    os.utime(os.path.join(self.root, self.seg_dir), (0, 0))
+    up = uploader.Uploader("0000000000000000", self.root)
+    name, key, fn = up.next_file_to_upload()
+    self.assertEqual(up.immediate_count, 1)
+
+    # uploaded by athenad, without changing the directory
+    os.setxattr(fn, uploader.UPLOAD_ATTR_NAME, uploader.UPLOAD_ATTR_VALUE)
+    self.assertEqual(up.next_file_to_upload()[1], key)
+
+    up.index.last_reconcile = float('-inf')
+    self.assertIsNone(up.next_file_to_upload())
+    self.assertEqual(up.immediate_count, 0)
+
 
 if __name__ == "__main__":
   unittest.main()
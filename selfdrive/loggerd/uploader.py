@@ -1,14 +1,14 @@
 #!/usr/bin/env python3
-import bz2
-import io
+import heapq
 import json
 import os
 import random
-import requests
 import threading
 import time
 import traceback
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
 from cereal import log
 import cereal.messaging as messaging
@@ -18,6 +18,7 @@ from common.realtime import set_core_affinity
 from system.hardware import TICI
 from selfdrive.loggerd.xattr_cache import getxattr, setxattr
 from selfdrive.loggerd.config import ROOT
+from selfdrive.loggerd.streaming_upload import upload_file
 from system.swaglog import cloudlog
 
 NetworkType = log.DeviceState.NetworkType
@@ -26,6 +27,11 @@ UPLOAD_ATTR_VALUE = b'1'
 
 UPLOAD_QLOG_QCAM_MAX_SIZE = 100 * 1e6  # MB
 
+# all segment directories are checked for changes this often, otherwise only new and locked ones are
+RECONCILE_INTERVAL = 60.  # s
+# directories modified this recently are listed again, files created within the same timestamp tick could be missed
+DIR_SETTLE_TIME = 1.  # s
+
 allow_sleep = bool(os.getenv("UPLOADER_SLEEP", "1"))
 force_wifi = os.getenv("FORCEWIFI") is not None
 fake_upload = os.getenv("FAKEUPLOAD") is not None
@@ -54,84 +60,189 @@ def clear_locks(root):
       cloudlog.exception("clear_locks failed")
 
 
-class Uploader():
-  def __init__(self, dongle_id, root):
-    self.dongle_id = dongle_id
-    self.api = Api(dongle_id)
+@dataclass
+class SegmentDir:
+  generation: int
+  mtime: Optional[int] = None  # ns, None until the directory settled
+  locked: bool = False
+  pending: Dict[str, int] = field(default_factory=dict)  # name: size of the files to upload
+
+
+class UploadIndex:
+  """Files the uploader still has to upload, in priority queues: files in immediate folders first,
+  then qlogs and qcameras, each in creation order.
+
+  Directories are only listed again when their mtime changed. The root, immediate folders and locked
+  directories are checked on every update, all directories every RECONCILE_INTERVAL. Setting the upload
+  attribute doesn't change the mtime, so files uploaded by another process, like athenad, are dropped
+  on reconcile, when the attributes of the pending files are read again."""
+
+  def __init__(self, root, immediate_folders, immediate_priority):
     self.root = root
+    self.immediate_folders = immediate_folders
+    self.immediate_priority = immediate_priority
 
-    self.upload_thread = None
+    self.dirs: Dict[str, SegmentDir] = {}
+    self.root_mtime: Optional[int] = None
+    self.last_reconcile = float('-inf')
+    self.generation = 0
 
-    self.last_resp = None
-    self.last_exc = None
+    # heaps of (sort key, logname, name, generation), entries of older generations of a directory are skipped
+    self.immediate_queue: List[Tuple] = []
+    self.priority_queue: List[Tuple] = []
 
     self.immediate_size = 0
     self.immediate_count = 0
 
-    # stats for last successfully uploaded file
-    self.last_time = 0.0
-    self.last_speed = 0.0
-    self.last_filename = ""
+  def _mtime(self, st) -> Optional[int]:
+    settled = time.time_ns() - st.st_mtime_ns > DIR_SETTLE_TIME * 1e9
+    return st.st_mtime_ns if settled else None
 
-    self.immediate_folders = ["crash/", "boot/"]
-    self.immediate_priority = {"qlog": 0, "qlog.bz2": 0, "qcamera.ts": 1}
+  def _remove_dir(self, logname: str) -> None:
+    d = self.dirs.pop(logname, None)
+    if d is not None:
+      for name in list(d.pending):
+        self._remove_pending(d, name)
 
-  def get_upload_sort(self, name):
+  def _remove_pending(self, d: SegmentDir, name: str) -> None:
+    size = d.pending.pop(name)
     if name in self.immediate_priority:
-      return self.immediate_priority[name]
-    return 1000
+      self.immediate_count -= 1
+      self.immediate_size -= size
 
-  def list_upload_files(self):
-    if not os.path.isdir(self.root):
+  def _scan_dir(self, logname: str) -> None:
+    path = os.path.join(self.root, logname)
+    try:
+      st = os.stat(path)
+      d = self.dirs.get(logname)
+      if d is not None and d.mtime is not None and d.mtime == st.st_mtime_ns:
+        return
+      names = os.listdir(path)
+    except OSError:
+      self._remove_dir(logname)
       return
 
-    self.immediate_size = 0
-    self.immediate_count = 0
+    self._remove_dir(logname)
+    self.generation += 1
+    d = self.dirs[logname] = SegmentDir(self.generation, self._mtime(st))
 
-    for logname in listdir_by_creation(self.root):
-      path = os.path.join(self.root, logname)
-      try:
-        names = os.listdir(path)
-      except OSError:
-        continue
+    d.locked = any(name.endswith(".lock") for name in names)
+    if d.locked:
+      return
 
-      if any(name.endswith(".lock") for name in names):
+    immediate_folder = logname + "/" in self.immediate_folders
+    for name in names:
+      if not (immediate_folder or name in self.immediate_priority):
         continue
 
-      for name in sorted(names, key=self.get_upload_sort):
-        key = os.path.join(logname, name)
-        fn = os.path.join(path, name)
-        # skip files already uploaded
-        try:
-          is_uploaded = getxattr(fn, UPLOAD_ATTR_NAME)
-        except OSError:
-          cloudlog.event("uploader_getxattr_failed", exc=self.last_exc, key=key, fn=fn)
-          is_uploaded = True  # deleter could have deleted
-        if is_uploaded:
-          continue
+      key = os.path.join(logname, name)
+      fn = os.path.join(path, name)
+      # skip files already uploaded
+      try:
+        is_uploaded = getxattr(fn, UPLOAD_ATTR_NAME)
+      except OSError:
+        cloudlog.event("uploader_getxattr_failed", key=key, fn=fn)
+        is_uploaded = True  # deleter could have deleted
+      if is_uploaded:
+        continue
 
+      size = 0
+      if name in self.immediate_priority:
         try:
-          if name in self.immediate_priority:
-            self.immediate_count += 1
-            self.immediate_size += os.path.getsize(fn)
+          size = os.path.getsize(fn)
         except OSError:
           pass
+        self.immediate_count += 1
+        self.immediate_size += size
+      d.pending[name] = size
 
-        yield (name, key, fn)
-
-  def next_file_to_upload(self):
-    upload_files = list(self.list_upload_files())
+      if immediate_folder:
+        heapq.heappush(self.immediate_queue, ((get_directory_sort(logname), name), logname, name, d.generation))
+      else:
+        heapq.heappush(self.priority_queue, ((get_directory_sort(logname), self.immediate_priority[name], name), logname, name, d.generation))
 
-    for name, key, fn in upload_files:
-      if any(f in fn for f in self.immediate_folders):
-        return (name, key, fn)
+  def _recheck_uploaded(self, logname: str, d: SegmentDir) -> None:
+    for name in list(d.pending):
+      try:
+        is_uploaded = getxattr(os.path.join(self.root, logname, name), UPLOAD_ATTR_NAME, cached=False)
+      except OSError:
+        is_uploaded = True  # deleter could have deleted
+      if is_uploaded:
+        self._remove_pending(d, name)
 
-    for name, key, fn in upload_files:
-      if name in self.immediate_priority:
-        return (name, key, fn)
+  def update(self) -> None:
+    """Picks up new, changed and removed directories"""
+    try:
+      root_st = os.stat(self.root)
+    except OSError:
+      return
 
+    reconcile = time.monotonic() - self.last_reconcile > RECONCILE_INTERVAL
+    if reconcile:
+      self.last_reconcile = time.monotonic()
+
+    if reconcile or self.root_mtime is None or root_st.st_mtime_ns != self.root_mtime:
+      self.root_mtime = self._mtime(root_st)
+      lognames = set(listdir_by_creation(self.root))
+      for logname in set(self.dirs) - lognames:
+        self._remove_dir(logname)
+      for logname in lognames - set(self.dirs):
+        self._scan_dir(logname)
+
+    for logname, d in list(self.dirs.items()):
+      if reconcile or d.locked or d.mtime is None or logname + "/" in self.immediate_folders:
+        self._scan_dir(logname)
+
+    if reconcile:
+      for logname, d in list(self.dirs.items()):
+        self._recheck_uploaded(logname, d)
+
+  def mark_uploaded(self, key: str) -> None:
+    logname, name = os.path.split(key)
+    d = self.dirs.get(logname)
+    if d is not None and name in d.pending:
+      self._remove_pending(d, name)
+
+  def next_file(self) -> Optional[Tuple[str, str, str]]:
+    for queue in (self.immediate_queue, self.priority_queue):
+      while len(queue):
+        _, logname, name, generation = queue[0]
+        d = self.dirs.get(logname)
+        if d is not None and d.generation == generation and name in d.pending:
+          return (name, os.path.join(logname, name), os.path.join(self.root, logname, name))
+        heapq.heappop(queue)
     return None
 
+
+class Uploader():
+  def __init__(self, dongle_id, root):
+    self.dongle_id = dongle_id
+    self.api = Api(dongle_id)
+    self.root = root
+
+    self.upload_thread = None
+
+    self.last_resp = None
+    self.last_exc = None
+
+    self.immediate_size = 0
+    self.immediate_count = 0
+
+    # stats for last successfully uploaded file
+    self.last_time = 0.0
+    self.last_speed = 0.0
+    self.last_filename = ""
+
+    self.immediate_folders = ["crash/", "boot/"]
+    self.immediate_priority = {"qlog": 0, "qlog.bz2": 0, "qcamera.ts": 1}
+    self.index = UploadIndex(root, self.immediate_folders, self.immediate_priority)
+
+  def next_file_to_upload(self):
+    self.index.update()
+    self.immediate_size = self.index.immediate_size
+    self.immediate_count = self.index.immediate_count
+    return self.index.next_file()
+
   def do_upload(self, key, fn):
     try:
       url_resp = self.api.get("v1.4/" + self.dongle_id + "/upload_url/", timeout=10, path=key, access_token=self.api.get_token())
@@ -153,14 +264,8 @@ class Uploader():
 
         self.last_resp = FakeResponse()
       else:
-        with open(fn, "rb") as f:
-          if key.endswith('.bz2') and not fn.endswith('.bz2'):
-            data = bz2.compress(f.read())
-            data = io.BytesIO(data)
-          else:
-            data = f
-
-          self.last_resp = requests.put(url, data=data, headers=headers, timeout=10)
+        compress = key.endswith('.bz2') and not fn.endswith('.bz2')
+        self.last_resp = upload_file(url, headers, fn, compress=compress, timeout=10)
     except Exception as e:
       self.last_exc = (e, traceback.format_exc())
       raise
@@ -210,6 +315,7 @@ class Uploader():
         setxattr(fn, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
       except OSError:
         cloudlog.event("uploader_setxattr_failed", exc=self.last_exc, key=key, fn=fn, sz=sz)
+      self.index.mark_uploaded(os.path.relpath(fn, self.root))
 
     return success
 
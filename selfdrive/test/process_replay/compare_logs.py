@@ -4,7 +4,11 @@ import sys
 import math
 import numbers
 import dictdiffer
+import numpy as np
 from collections import Counter
+from operator import attrgetter
+from typing import Any, Dict, List, Optional, Tuple
+from dictdiffer.utils import are_different
 
 from tools.lib.logreader import LogReader
 
@@ -57,7 +61,196 @@ def get_field_tolerance(diff_field, field_tolerances):
     return field_tolerances[diff_field_str]
 
 
-def compare_logs(log1, log2, ignore_fields=None, ignore_msgs=None, tolerance=None, field_tolerances=None):
+def outside_tolerance(diff, default_tolerance, field_tolerances):
+  # Dictdiffer only supports relative tolerance, we also want to check for absolute
+  # TODO: add this to dictdiffer
+  try:
+    if diff[0] == "change":
+      field_tolerance = default_tolerance
+      if (tol := get_field_tolerance(diff[1], field_tolerances)) is not None:
+        field_tolerance = tol
+      a, b = diff[2]
+      finite = math.isfinite(a) and math.isfinite(b)
+      if finite and isinstance(a, numbers.Number) and isinstance(b, numbers.Number):
+        return abs(a - b) > max(field_tolerance, field_tolerance * max(abs(a), abs(b)))
+  except TypeError:
+    pass
+  return True
+
+
+def diff_dicts(msg1_dict, msg2_dict, ignore_fields, default_tolerance, field_tolerances):
+  dd = dictdiffer.diff(msg1_dict, msg2_dict, ignore=ignore_fields)
+  return [d for d in dd if outside_tolerance(d, default_tolerance, field_tolerances)]
+
+
+# kinds of values, from the schema
+STRUCT, LIST, ENUM, DATA, LEAF = range(5)
+CONVERT = {ENUM: str, DATA: bytes}  # like to_dict
+
+_struct_plans: Dict[Tuple, Tuple] = {}
+
+
+def _type_kind(t):
+  which = t.which()
+  if which == 'struct':
+    return (STRUCT,)
+  if which == 'list':
+    return (LIST, _type_kind(t.list.elementType))
+  if which == 'enum':
+    return (ENUM,)
+  if which == 'data':
+    return (DATA,)
+  return (LEAF,)
+
+
+def _field_kinds(schema):
+  return {name: (STRUCT,) if f.proto.which() == 'group' else _type_kind(f.proto.slot.type) for name, f in schema.fields.items()}
+
+
+def _child_dotted(dotted, name):
+  # like dictdiffer, ignored fields are matched on their dotted path, which stops at lists
+  return (f"{dotted}.{name}" if dotted else name) if dotted is not None else None
+
+
+def _struct_plan(v, dotted, ignore):
+  """How to read the leaves of a struct in to_dict order: the kinds of its fields, whether it has a union
+  and steps over its other fields. Leaves of nested structs without unions or lists are read by one
+  attrgetter, fields that change the structure of a message are walked for every message."""
+  key = (v.schema.node.id, dotted, ignore)
+  plan = _struct_plans.get(key)
+  if plan is not None:
+    return plan
+
+  steps: List[Tuple] = []
+  leaves: List[Tuple[str, Tuple, int]] = []  # dotted attribute, path relative to v, kind
+
+  def flush():
+    if len(leaves):
+      getter = attrgetter(*[attr for attr, _, _ in leaves])
+      convert = [(i, CONVERT[kind]) for i, (_, _, kind) in enumerate(leaves) if kind in CONVERT]
+      steps.append(("leaves", getter, len(leaves) == 1, convert, [path for _, path, _ in leaves]))
+      leaves.clear()
+
+  def collect(struct, attr, path, struct_dotted):
+    kinds = _field_kinds(struct.schema)
+    for name in struct.schema.non_union_fields:
+      child_dotted = _child_dotted(struct_dotted, name)
+      if child_dotted is not None and child_dotted in ignore:
+        continue
+      kind = kinds[name]
+      child = getattr(struct, name)
+      if kind[0] == STRUCT and not len(child.schema.union_fields):
+        collect(child, attr + (name,), path + (name,), child_dotted)
+      elif kind[0] in (STRUCT, LIST):
+        flush()
+        steps.append(("walk", attr + (name,), kind, child_dotted, path + (name,)))
+      else:
+        leaves.append(('.'.join(attr + (name,)), path + (name,), kind[0]))
+
+  collect(v, (), (), dotted)
+  flush()
+  plan = _struct_plans[key] = (len(v.schema.union_fields) > 0, _field_kinds(v.schema), steps)
+  return plan
+
+
+def _flatten(v, kind, dotted, ignore, values, shape, paths, node):
+  k = kind[0]
+  if k == STRUCT:
+    has_union, kinds, steps = _struct_plan(v, dotted, ignore)
+    if has_union:
+      which = str(v.which())
+      shape.append(which)
+      child_dotted = _child_dotted(dotted, which)
+      if child_dotted is None or child_dotted not in ignore:
+        _flatten(getattr(v, which), kinds[which], child_dotted, ignore, values, shape, paths,
+                 None if paths is None else node + (which,))
+
+    for step in steps:
+      if step[0] == "leaves":
+        _, getter, single, convert, step_paths = step
+        leaf_values = [getter(v)] if single else list(getter(v))
+        for i, f in convert:
+          leaf_values[i] = f(leaf_values[i])
+        values.extend(leaf_values)
+        if paths is not None:
+          paths.extend(node + p for p in step_paths)
+      else:
+        _, attr, field_kind, child_dotted, path = step
+        child = v
+        for a in attr:
+          child = getattr(child, a)
+        _flatten(child, field_kind, child_dotted, ignore, values, shape, paths, None if paths is None else node + path)
+  elif k == LIST:
+    n = len(v)
+    shape.append(n)
+    for i in range(n):
+      _flatten(v[i], kind[1], None, ignore, values, shape, paths, None if paths is None else node + (i,))
+  else:
+    values.append(CONVERT[k](v) if k in CONVERT else v)
+    if paths is not None:
+      paths.append(node)
+
+
+def flatten_message(msg, ignore, with_paths=False):
+  """Leaves of a message in the order to_dict() and dictdiffer visit them, read straight from
+  the capnp reader, as (paths, values, shape). Messages of the same shape (union members and
+  list lengths) have the same paths and only differ in leaf values."""
+  values: List[Any] = []
+  shape: List[Any] = []
+  paths: Optional[List[Tuple]] = [] if with_paths else None
+  _flatten(msg, (STRUCT,), "", frozenset(ignore), values, shape, paths, ())
+  return paths, values, tuple(shape)
+
+
+def _diff_path(path):
+  # dictdiffer's dotted notation
+  return '.'.join(path) if all(isinstance(k, str) for k in path) else list(path)
+
+
+def _float_changes(a, b, tolerance):
+  """Vectorised dictdiffer change detection followed by outside_tolerance"""
+  with np.errstate(invalid='ignore', over='ignore'):
+    nan_a, nan_b = np.isnan(a), np.isnan(b)
+    finite = np.isfinite(a) & np.isfinite(b)
+    abs_diff = np.abs(a - b)
+    max_abs = np.maximum(np.abs(a), np.abs(b))
+
+    close = finite & (abs_diff <= EPSILON * max_abs)
+    different = (a != b) & ~(nan_a & nan_b) & (nan_a | nan_b | ~close)
+    return different & (~finite | (abs_diff > np.maximum(tolerance, tolerance * max_abs)))
+
+
+def diff_columns(paths, rows1, rows2, default_tolerance, field_tolerances):
+  """Diffs messages of the same structure one field at a time. Returns (row, column, diff) tuples."""
+  diff = []
+  n = len(rows1)
+  for col, (path, col1, col2) in enumerate(zip(paths, zip(*rows1), zip(*rows2))):
+
+    diff_path = _diff_path(path)
+    tolerance = get_field_tolerance(diff_path, field_tolerances)
+    if tolerance is None:
+      tolerance = default_tolerance
+
+    if all(type(v) is float for v in col1) and all(type(v) is float for v in col2):
+      a = np.fromiter(col1, dtype=np.float64, count=n)
+      b = np.fromiter(col2, dtype=np.float64, count=n)
+      changed = np.flatnonzero(_float_changes(a, b, tolerance))
+    else:
+      # ints, bools, enums, strings and data: only the few unequal values are checked one by one
+      a = np.empty(n, dtype=object)
+      b = np.empty(n, dtype=object)
+      a[:], b[:] = col1, col2
+      changed = [i for i in np.flatnonzero(a != b).tolist()
+                 if are_different(col1[i], col2[i], EPSILON) and
+                 outside_tolerance(("change", diff_path, (col1[i], col2[i])), default_tolerance, field_tolerances)]
+
+    for i in changed:
+      # a new path for every record, like dictdiffer
+      diff.append((int(i), col, ("change", _diff_path(path), (col1[i], col2[i]))))
+  return diff
+
+
+def compare_logs(log1, log2, ignore_fields=None, ignore_msgs=None, tolerance=None, field_tolerances=None, vectorized=True):
   if ignore_fields is None:
     ignore_fields = []
   if ignore_msgs is None:
@@ -73,41 +266,58 @@ def compare_logs(log1, log2, ignore_fields=None, ignore_msgs=None, tolerance=Non
     cnt2 = Counter(m.which() for m in log2)
     raise Exception(f"logs are not same length: {len(log1)} VS {len(log2)}\n\t\t{cnt1}\n\t\t{cnt2}")
 
-  diff = []
   for msg1, msg2 in zip(log1, log2):
     if msg1.which() != msg2.which():
       print(msg1, msg2)
       raise Exception("msgs not aligned between logs")
 
-    msg1_bytes = remove_ignored_fields(msg1, ignore_fields).as_builder().to_bytes()
-    msg2_bytes = remove_ignored_fields(msg2, ignore_fields).as_builder().to_bytes()
-
-    if msg1_bytes != msg2_bytes:
-      msg1_dict = msg1.to_dict(verbose=True)
-      msg2_dict = msg2.to_dict(verbose=True)
-
-      dd = dictdiffer.diff(msg1_dict, msg2_dict, ignore=ignore_fields)
-
-      # Dictdiffer only supports relative tolerance, we also want to check for absolute
-      # TODO: add this to dictdiffer
-      def outside_tolerance(diff):
-        try:
-          if diff[0] == "change":
-            field_tolerance = default_tolerance
-            if (tol := get_field_tolerance(diff[1], field_tolerances)) is not None:
-              field_tolerance = tol
-            a, b = diff[2]
-            finite = math.isfinite(a) and math.isfinite(b)
-            if finite and isinstance(a, numbers.Number) and isinstance(b, numbers.Number):
-              return abs(a - b) > max(field_tolerance, field_tolerance * max(abs(a), abs(b)))
-        except TypeError:
-          pass
-        return True
-
-      dd = list(filter(outside_tolerance, dd))
-
-      diff.extend(dd)
-  return diff
+  if not vectorized:
+    diff = []
+    for msg1, msg2 in zip(log1, log2):
+      msg1_bytes = remove_ignored_fields(msg1, ignore_fields).as_builder().to_bytes()
+      msg2_bytes = remove_ignored_fields(msg2, ignore_fields).as_builder().to_bytes()
+
+      if msg1_bytes != msg2_bytes:
+        diff.extend(diff_dicts(msg1.to_dict(verbose=True), msg2.to_dict(verbose=True), ignore_fields, default_tolerance, field_tolerances))
+    return diff
+
+  # serialized with the ignored fields cleared, like message by message: equal messages, most of them
+  # in a passing test, are found without reading their fields through pycapnp, which is much slower
+  ignore = frozenset(ignore_fields)
+  bytes1, bytes2 = ([remove_ignored_fields(m, ignore_fields).as_builder().to_bytes() for m in log] for log in (log1, log2))
+
+  # the differing pairs are flattened straight from the readers and grouped by message type and
+  # structure, so each field is compared for all of them at once. Pairs with a different structure
+  # (list lengths, union members) go through dictdiffer
+  groups: Dict[Tuple, Tuple[List[int], List[List], List[List]]] = {}
+  diff = []
+  for idx, (msg1, msg2) in enumerate(zip(log1, log2)):
+    if bytes1[idx] == bytes2[idx]:
+      continue
+
+    _, values1, shape1 = flatten_message(msg1, ignore)
+    _, values2, shape2 = flatten_message(msg2, ignore)
+    if shape1 != shape2 or len(values1) != len(values2):
+      dd = diff_dicts(msg1.to_dict(verbose=True), msg2.to_dict(verbose=True), ignore_fields, default_tolerance, field_tolerances)
+      diff.extend((idx, col, d) for col, d in enumerate(dd))
+      continue
+
+    key = (msg1.which(), shape1)
+    if key not in groups:
+      groups[key] = ([], [], [])
+    indices, rows1, rows2 = groups[key]
+    indices.append(idx)
+    rows1.append(values1)
+    rows2.append(values2)
+
+  for indices, rows1, rows2 in groups.values():
+    paths = flatten_message(log1[indices[0]], ignore, with_paths=True)[0]
+    for row, col, d in diff_columns(paths, rows1, rows2, default_tolerance, field_tolerances):
+      diff.append((indices[row], col, d))
+
+  # same order as comparing message by message
+  diff.sort(key=lambda d: d[:2])
+  return [d for _, _, d in diff]
 
 
 if __name__ == "__main__":
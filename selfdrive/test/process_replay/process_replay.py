@@ -154,6 +154,76 @@ class FakePubMaster(messaging.PubMaster):
     return dat
 
 
+class StepSocket:
+  """Socket for processes stepped in the calling thread, receive never blocks"""
+  def __init__(self):
+    self.data = []
+
+  def receive(self, non_blocking=False):
+    return self.data.pop(0) if len(self.data) else None
+
+  def send(self, data):
+    self.data.append(data)
+
+
+class StepSubMaster(messaging.SubMaster):
+  """SubMaster only changed by update_msgs, the process's own update is a no-op"""
+  def __init__(self, services, ignore_alive=None, ignore_avg_freq=None):
+    super().__init__(services, ignore_alive=ignore_alive, ignore_avg_freq=ignore_avg_freq, addr=None)
+    self.sock = {s: DumbSocket(s) for s in services}
+
+  def update(self, timeout=-1):
+    pass
+
+
+class StepPubMaster(messaging.PubMaster):
+  """PubMaster collecting a copy of everything sent until drained"""
+  def __init__(self, services):  # pylint: disable=super-init-not-called
+    self.sock = {s: DumbSocket() for s in services}
+    self.msgs = []
+
+  def send(self, s, dat):
+    if isinstance(dat, bytes):
+      self.msgs.append(log.Event.from_bytes(dat).as_builder())
+    else:
+      # copy, the process may reuse its builder
+      self.msgs.append(dat.as_reader().as_builder())
+
+  def drain(self):
+    msgs, self.msgs = self.msgs, []
+    return msgs
+
+
+class SteppedProcess:
+  """Runs a python process in the calling thread, one iteration of its loop per step.
+
+  The process's module exposes make_step(sm, pm[, can_sock]), which sets the process up
+  and returns a function running one iteration of its main loop."""
+  def __init__(self, cfg, mod):
+    sub_sockets = [s for _, sub in cfg.pub_sub.items() for s in sub]
+    pub_sockets = [s for s in cfg.pub_sub.keys() if s != 'can']
+
+    self.sm = StepSubMaster(pub_sockets, **cfg.submaster_config)
+    self.pm = StepPubMaster(sub_sockets)
+    self.can_sock = None
+    args = (self.sm, self.pm)
+    if 'can' in cfg.pub_sub:
+      self.can_sock = StepSocket()
+      args = (self.sm, self.pm, self.can_sock)
+
+    self._step = mod.make_step(*args)
+
+  def step(self, cur_time, msgs=None, can=None):
+    """Delivers msgs to the SubMaster and can to the can socket, runs one iteration
+    and returns the messages published, as builders"""
+    if can is not None:
+      self.can_sock.send(can)
+    if msgs is not None:
+      self.sm.update_msgs(cur_time, msgs)
+    self._step()
+    return self.pm.drain()
+
+
 def fingerprint(msgs, fsm, can_sock, fingerprint):
   print("start fingerprinting")
   fsm.wait_on_getitem = True
@@ -377,9 +447,18 @@ CONFIGS = [
 ]
 
 
-def replay_process(cfg, lr, fingerprint=None):
+def supports_stepping(cfg):
+  if not cfg.fake_pubsubmaster:
+    return False
+  mod = importlib.import_module(managed_processes[cfg.proc_name].module)
+  return hasattr(mod, "make_step")
+
+
+def replay_process(cfg, lr, fingerprint=None, lockstep=True):
   with OpenpilotPrefix():
     if cfg.fake_pubsubmaster:
+      if lockstep and supports_stepping(cfg):
+        return step_replay_process(cfg, lr, fingerprint)
       return python_replay_process(cfg, lr, fingerprint)
     else:
       return cpp_replay_process(cfg, lr, fingerprint)
@@ -432,17 +511,18 @@ def setup_env(simulation=False, CP=None, cfg=None, controlsState=None):
       os.environ['FINGERPRINT'] = CP.carFingerprint
 
 
-def python_replay_process(cfg, lr, fingerprint=None):
-  sub_sockets = [s for _, sub in cfg.pub_sub.items() for s in sub]
-  pub_sockets = [s for s in cfg.pub_sub.keys() if s != 'can']
+def get_recv_socks(cfg, msg, CP, fsm):
+  if cfg.should_recv_callback is not None:
+    return cfg.should_recv_callback(msg, CP, cfg, fsm)
+
+  recv_socks = [s for s in cfg.pub_sub[msg.which()] if
+                (fsm.frame + 1) % int(service_list[msg.which()].frequency / service_list[s].frequency) == 0]
+  return recv_socks, bool(len(recv_socks))
 
-  fsm = FakeSubMaster(pub_sockets, **cfg.submaster_config)
-  fpm = FakePubMaster(sub_sockets)
-  args = (fsm, fpm)
-  if 'can' in list(cfg.pub_sub.keys()):
-    can_sock = FakeSocket()
-    args = (fsm, fpm, can_sock)
 
+def prepare_python_process(cfg, lr, fingerprint=None):
+  """Sets up the environment for a python process, returns the sorted messages,
+  the messages it subscribes to and its module"""
   all_msgs = sorted(lr, key=lambda msg: msg.logMonoTime)
   pub_msgs = [msg for msg in all_msgs if msg.which() in list(cfg.pub_sub.keys())]
 
@@ -469,6 +549,59 @@ def python_replay_process(cfg, lr, fingerprint=None):
   assert(type(managed_processes[cfg.proc_name]) is PythonProcess)
   managed_processes[cfg.proc_name].prepare()
   mod = importlib.import_module(managed_processes[cfg.proc_name].module)
+  return all_msgs, pub_msgs, mod
+
+
+def step_replay_process(cfg, lr, fingerprint=None):
+  """Replays a python process in lock-step in the calling thread. The process is stepped
+  whenever it would have woken up: for every can message and every SubMaster update."""
+  all_msgs, pub_msgs, mod = prepare_python_process(cfg, lr, fingerprint)
+
+  # processes wait for CarParams during setup, so they need to be there first
+  if cfg.init_callback is not None:
+    cfg.init_callback(all_msgs, None, None, fingerprint)
+  CP = car.CarParams.from_bytes(Params().get("CarParams", block=True))
+
+  proc = SteppedProcess(cfg, mod)
+
+  log_msgs, msg_queue = [], []
+  for msg in pub_msgs:
+    recv_socks, should_recv = get_recv_socks(cfg, msg, CP, proc.sm)
+
+    is_can = msg.which() == 'can'
+    if not is_can:
+      msg_queue.append(msg.as_builder())
+
+    if not (is_can or should_recv):
+      continue
+
+    msgs = None
+    if should_recv:
+      msgs, msg_queue = msg_queue, []
+
+    outputs = proc.step(msg.logMonoTime / 1e9, msgs, msg.as_builder().to_bytes() if is_can else None)
+
+    missing = set(recv_socks) - {m.which() for m in outputs}
+    assert not len(missing), f"{cfg.proc_name} did not publish {sorted(missing)} at {msg.logMonoTime}"
+
+    for m in outputs:
+      m.logMonoTime = msg.logMonoTime
+      log_msgs.append(m.as_reader())
+  return log_msgs
+
+
+def python_replay_process(cfg, lr, fingerprint=None):
+  sub_sockets = [s for _, sub in cfg.pub_sub.items() for s in sub]
+  pub_sockets = [s for s in cfg.pub_sub.keys() if s != 'can']
+
+  fsm = FakeSubMaster(pub_sockets, **cfg.submaster_config)
+  fpm = FakePubMaster(sub_sockets)
+  args = (fsm, fpm)
+  if 'can' in list(cfg.pub_sub.keys()):
+    can_sock = FakeSocket()
+    args = (fsm, fpm, can_sock)
+
+  all_msgs, pub_msgs, mod = prepare_python_process(cfg, lr, fingerprint)
 
   thread = threading.Thread(target=mod.main, args=args)
   thread.daemon = True
@@ -489,12 +622,7 @@ def python_replay_process(cfg, lr, fingerprint=None):
 
   log_msgs, msg_queue = [], []
   for msg in pub_msgs:
-    if cfg.should_recv_callback is not None:
-      recv_socks, should_recv = cfg.should_recv_callback(msg, CP, cfg, fsm)
-    else:
-      recv_socks = [s for s in cfg.pub_sub[msg.which()] if
-                    (fsm.frame + 1) % int(service_list[msg.which()].frequency / service_list[s].frequency) == 0]
-      should_recv = bool(len(recv_socks))
+    recv_socks, should_recv = get_recv_socks(cfg, msg, CP, fsm)
 
     if msg.which() == 'can':
       can_sock.send(msg.as_builder().to_bytes())
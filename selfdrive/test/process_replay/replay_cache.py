@@ -0,0 +1,185 @@
+import glob
+import json
+import os
+import subprocess
+import sys
+from functools import lru_cache
+from hashlib import sha256
+from typing import Dict, Optional
+
+from common.basedir import BASEDIR
+from common.file_helpers import atomic_write_in_dir, mkdirs_exists_ok
+from selfdrive.car.car_helpers import interface_names
+from selfdrive.manager.process import NativeProcess
+from selfdrive.manager.process_config import managed_processes
+from selfdrive.test.process_replay.compare_logs import save_log
+from tools.lib.cache import DEFAULT_CACHE_DIR
+from tools.lib.log_cache import cache_key
+from tools.lib.logreader import LogReader
+
+REPLAY_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, "process_replay")
+CACHE_VERSION = 1
+
+# files read by processes that are not python modules, in case they were opened before recording started
+DATA_FILE_GLOBS = ["cereal/*.capnp", "opendbc/*.dbc", "selfdrive/car/torque_data/*.yaml"]
+
+# every car port is imported, but only these files of other ports matter: they are used for fingerprinting
+FINGERPRINTING_FILES = ["values.py", "fingerprints.py"]
+
+
+@lru_cache(maxsize=None)
+def file_hash(path: str) -> Optional[str]:
+  try:
+    with open(path, "rb") as f:
+      return sha256(f.read()).hexdigest()
+  except OSError:
+    return None
+
+
+def _in_tree(fn) -> Optional[str]:
+  fn = os.path.realpath(fn)
+  if fn.startswith(BASEDIR + os.sep) and "site-packages" not in fn:
+    return os.path.relpath(fn, BASEDIR)
+  return None
+
+
+_recording = False
+_opened_files = set()
+
+
+def _audit_hook(event, args):
+  if not _recording:
+    return
+
+  # python processes are replayed in this process, so the data files and libraries they read are seen here
+  if event == "open":
+    path, mode, flags = args
+    if isinstance(mode, str) and any(c in mode for c in "wax+"):
+      return
+    if mode is None and flags & (os.O_WRONLY | os.O_RDWR):
+      return
+  elif event == "ctypes.dlopen":
+    path = args[0]
+  else:
+    return
+
+  if isinstance(path, (str, bytes)):
+    fn = _in_tree(os.fsdecode(path))
+    if fn is not None and "__pycache__" not in fn and os.path.isfile(os.path.join(BASEDIR, fn)):
+      _opened_files.add(fn)
+
+
+def record_opened_files():
+  """Starts recording the files of openpilot opened or loaded in this process, forgetting the ones
+  recorded before. Audit hooks can't be removed, the hook is installed on the first call."""
+  global _recording
+  _opened_files.clear()
+  if not _recording:
+    sys.addaudithook(_audit_hook)
+    _recording = True
+
+
+def opened_files():
+  """Files of openpilot opened or loaded in this process since record_opened_files was called"""
+  return set(_opened_files)
+
+
+def imported_files():
+  """Files of the modules imported in this process that are part of openpilot"""
+  files = set()
+  for mod in list(sys.modules.values()):
+    fn = getattr(mod, "__file__", None)
+    if fn is None:
+      continue
+    fn = _in_tree(fn)
+    if fn is not None:
+      files.add(fn)
+  return files
+
+
+def is_car_port_dependency(fn, car_name):
+  """False for files of other car ports than car_name that can't change its replay"""
+  parts = fn.split(os.sep)
+  if car_name is None or len(parts) < 4 or parts[:2] != ["selfdrive", "car"] or parts[2] not in interface_names:
+    return True
+  return parts[2] == car_name or parts[-1] in FINGERPRINTING_FILES
+
+
+def data_files():
+  return {os.path.relpath(fn, BASEDIR) for pattern in DATA_FILE_GLOBS for fn in glob.glob(os.path.join(BASEDIR, pattern))}
+
+
+def shared_libraries(binary):
+  """Libraries of openpilot a native binary links against"""
+  try:
+    out = subprocess.check_output(["ldd", os.path.join(BASEDIR, binary)], encoding="utf8", stderr=subprocess.DEVNULL)
+  except (OSError, subprocess.CalledProcessError):
+    return set()
+  libs = set()
+  for line in out.splitlines():
+    # "libfoo.so => /path/libfoo.so (0x...)"
+    parts = line.split("=>")
+    if len(parts) == 2 and len(parts[1].split()):
+      lib = _in_tree(parts[1].split()[0])
+      if lib is not None:
+        libs.add(lib)
+  return libs
+
+
+def process_files(cfg):
+  proc = managed_processes[cfg.proc_name]
+  if isinstance(proc, NativeProcess):
+    binary = os.path.join(proc.cwd, proc.cmdline[0])
+    return {binary} | shared_libraries(binary)
+  return set()
+
+
+def replay_key(cfg, log_path, fingerprint=None):
+  """Identifies the inputs of a replay: the process config and the input log.
+  The code a replay depends on is checked separately, through its manifest."""
+  cfg_id = [CACHE_VERSION, cfg.proc_name, cfg.subtest_name, sorted((k, sorted(v)) for k, v in cfg.pub_sub.items()),
+            sorted(cfg.submaster_config.items()), sorted(cfg.environ.items()),
+            getattr(cfg.init_callback, "__name__", None), getattr(cfg.should_recv_callback, "__name__", None),
+            fingerprint, cache_key(log_path)]
+  return sha256(json.dumps(cfg_id, default=str).encode()).hexdigest()[:32]
+
+
+def cache_paths(key):
+  base = os.path.join(REPLAY_CACHE_DIR, key)
+  return base + ".bz2", base + ".json"
+
+
+def load_outputs(cfg, log_path, fingerprint=None):
+  """Returns the outputs of a previous replay with the same inputs if none of the files
+  it depended on changed since, otherwise None"""
+  log_fn, manifest_fn = cache_paths(replay_key(cfg, log_path, fingerprint))
+  try:
+    with open(manifest_fn) as f:
+      manifest: Dict[str, Optional[str]] = json.load(f)
+  except (OSError, ValueError):
+    return None
+
+  if not os.path.isfile(log_fn):
+    return None
+  for fn, digest in manifest.items():
+    if file_hash(os.path.join(BASEDIR, fn)) != digest:
+      return None
+  return list(LogReader(log_fn))
+
+
+def save_outputs(cfg, log_path, log_msgs, car_name=None, fingerprint=None):
+  """Stores the outputs of a replay run in this process together with the files it depended on.
+  Imports of earlier replays in the same process are included, which only costs cache hits."""
+  mkdirs_exists_ok(REPLAY_CACHE_DIR)
+  log_fn, manifest_fn = cache_paths(replay_key(cfg, log_path, fingerprint))
+
+  deps = {fn for fn in imported_files() | opened_files() if is_car_port_dependency(fn, car_name)}
+  deps |= data_files() | process_files(cfg)
+  manifest = {fn: file_hash(os.path.join(BASEDIR, fn)) for fn in sorted(deps)}
+
+  # the manifest is written last, its presence marks a complete entry
+  tmp_fn = log_fn + f".{os.getpid()}.tmp"
+  save_log(tmp_fn, log_msgs)
+  os.replace(tmp_fn, log_fn)
+  with atomic_write_in_dir(manifest_fn, overwrite=True) as f:
+    json.dump(manifest, f)
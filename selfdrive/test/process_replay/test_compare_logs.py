@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+import math
+import random
+import unittest
+
+import cereal.messaging as messaging
+from selfdrive.test.process_replay.compare_logs import compare_logs
+
+
+def make_logs(n=200, seed=0):
+  rng = random.Random(seed)
+  log1, log2 = [], []
+  for i in range(n):
+    msgs = []
+    for _ in range(2):
+      msg = messaging.new_message('carState')
+      msg.logMonoTime = i
+      msg.carState.vEgo = 10. + i
+      msg.carState.aEgo = 0.1 * i
+      msg.carState.standstill = False
+      msg.carState.gearShifter = 'drive'
+      msg.carState.cruiseState.speed = 25.
+      msgs.append(msg)
+
+    # perturb the second log
+    cs = msgs[1].carState
+    kind = rng.randrange(8)
+    if kind == 0:
+      cs.vEgo += 1e-9  # within NUMPY_TOLERANCE
+    elif kind == 1:
+      cs.vEgo += 1.
+    elif kind == 2:
+      cs.aEgo = math.nan
+    elif kind == 3:
+      cs.standstill = True
+    elif kind == 4:
+      cs.gearShifter = 'reverse'
+    elif kind == 5:
+      # different structure
+      msgs[1].carState.init('buttonEvents', 1)
+    elif kind == 6:
+      cs.cruiseState.speed = math.inf
+    msgs[1].logMonoTime = i + 1
+
+    log1.append(msgs[0].as_reader())
+    log2.append(msgs[1].as_reader())
+
+  # a message that is not a carState
+  for log in (log1, log2):
+    log.append(messaging.new_message('liveTracks', 2).as_reader())
+  return log1, log2
+
+
+class TestCompareLogs(unittest.TestCase):
+  def test_matches_message_by_message(self):
+    log1, log2 = make_logs()
+    for kwargs in ({}, {'tolerance': 1e-7}, {'ignore_fields': ['logMonoTime', 'carState.vEgo']},
+                   {'tolerance': 1e-7, 'ignore_msgs': ['liveTracks']}):
+      expected = compare_logs(log1, log2, vectorized=False, **kwargs)
+      # repr, NaNs never compare equal
+      self.assertEqual(repr(compare_logs(log1, log2, **kwargs)), repr(expected), kwargs)
+      self.assertGreater(len(expected), 0)
+
+  def test_no_diff(self):
+    log1, _ = make_logs()
+    self.assertEqual(compare_logs(log1, log1), [])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -11,8 +11,9 @@ from selfdrive.car.car_helpers import interface_names
 from selfdrive.test.openpilotci import get_url, upload_file
 from selfdrive.test.process_replay.compare_logs import compare_logs, save_log
 from selfdrive.test.process_replay.process_replay import CONFIGS, PROC_REPLAY_DIR, FAKEDATA, check_enabled, replay_process
+from selfdrive.test.process_replay.replay_cache import load_outputs, record_opened_files, save_outputs
 from system.version import get_commit
-from tools.lib.filereader import FileReader
+from tools.lib.log_cache import cache_log
 from tools.lib.logreader import LogReader
 
 original_segments = [
@@ -63,11 +64,18 @@ REF_COMMIT_FN = os.path.join(PROC_REPLAY_DIR, "ref_commit")
 
 
 def run_test_process(data):
-  segment, cfg, args, cur_log_fn, ref_log_path, lr_dat = data
+  segment, cfg, args, cur_log_fn, ref_log_path, log_path = data
   res = None
   if not args.upload_only:
-    lr = LogReader.from_bytes(lr_dat)
-    res, log_msgs = test_process(cfg, lr, ref_log_path, cur_log_fn, args.ignore_fields, args.ignore_msgs)
+    cached_msgs = load_outputs(cfg, log_path) if args.incremental else None
+    if args.incremental and cached_msgs is None:
+      record_opened_files()
+    # memory maps the decompressed log, shared by every worker replaying this segment
+    lr = LogReader(log_path, cache=True) if cached_msgs is None else None
+    res, log_msgs = test_process(cfg, lr, ref_log_path, cur_log_fn, args.ignore_fields, args.ignore_msgs, not args.threaded, cached_msgs)
+    if args.incremental and cached_msgs is None:
+      car_name = next((m.carParams.carName for m in lr if m.which() == 'carParams'), None)
+      save_outputs(cfg, log_path, log_msgs, car_name)
     # save logs so we can upload when updating refs
     save_log(cur_log_fn, log_msgs)
 
@@ -80,12 +88,14 @@ def run_test_process(data):
 
 
 def get_log_data(segment):
+  # decompress and index each segment once, workers only get its path
   r, n = segment.rsplit("--", 1)
-  with FileReader(get_url(r, n)) as f:
-    return (segment, f.read())
+  log_path = get_url(r, n)
+  cache_log(log_path)
+  return (segment, log_path)
 
 
-def test_process(cfg, lr, ref_log_path, new_log_path, ignore_fields=None, ignore_msgs=None):
+def test_process(cfg, lr, ref_log_path, new_log_path, ignore_fields=None, ignore_msgs=None, lockstep=True, log_msgs=None):
   if ignore_fields is None:
     ignore_fields = []
   if ignore_msgs is None:
@@ -93,7 +103,8 @@ def test_process(cfg, lr, ref_log_path, new_log_path, ignore_fields=None, ignore
 
   ref_log_msgs = list(LogReader(ref_log_path))
 
-  log_msgs = replay_process(cfg, lr)
+  if log_msgs is None:
+    log_msgs = replay_process(cfg, lr, lockstep=lockstep)
 
   # check to make sure openpilot is engaged in the route
   if cfg.proc_name == "controlsd":
@@ -166,6 +177,10 @@ if __name__ == "__main__":
                       help="Updates reference logs using current commit")
   parser.add_argument("--upload-only", action="store_true",
                       help="Skips testing processes and uploads logs from previous test run")
+  parser.add_argument("--threaded", action="store_true",
+                      help="Run python processes on a thread with fake sockets instead of stepping them in lock-step")
+  parser.add_argument("--incremental", action="store_true",
+                      help="Reuse outputs of earlier runs if neither the inputs nor any file the process used changed")
   parser.add_argument("-j", "--jobs", type=int, default=1)
   args = parser.parse_args()
 
@@ -201,10 +216,10 @@ if __name__ == "__main__":
   with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
     if not args.upload_only:
       download_segments = [seg for car, seg in segments if car in tested_cars]
-      log_data: Dict[str, LogReader] = {}
+      log_data: Dict[str, str] = {}
       p1 = pool.map(get_log_data, download_segments)
-      for segment, lr in tqdm(p1, desc="Getting Logs", total=len(download_segments)):
-        log_data[segment] = lr
+      for segment, log_path in tqdm(p1, desc="Getting Logs", total=len(download_segments)):
+        log_data[segment] = log_path
 
     pool_args: Any = []
     for car_brand, segment in segments:
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+import os
+import bz2
+import mmap
+import time
+import argparse
+import urllib.parse
+from hashlib import sha256
+import numpy as np
+
+from common.file_helpers import atomic_write_in_dir, mkdirs_exists_ok
+from tools.lib.cache import DEFAULT_CACHE_DIR, cache_path_for_file_path
+from tools.lib.filereader import FileReader
+from tools.lib.log_index import INDEX_DTYPE, build_index
+
+LOG_EXT = ".log"
+INDEX_EXT = ".idx.npy"
+CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, "local")
+
+
+def cache_key(fn):
+  """Identifies the contents of a log: the URL without its query string (SAS tokens change),
+     or the path, size and mtime of a local file."""
+  if urllib.parse.urlparse(fn).scheme == '':
+    st = os.stat(fn)
+    src = f"{os.path.abspath(fn)}:{st.st_size}:{st.st_mtime_ns}"
+  else:
+    src = fn.split("?")[0]
+  return sha256(src.encode()).hexdigest()[:16]
+
+
+def cache_paths(fn):
+  base = f"{cache_path_for_file_path(fn)}.{cache_key(fn)}"
+  return base + LOG_EXT, base + INDEX_EXT
+
+
+def _read_decompressed(fn):
+  _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
+  if ext not in ('', '.bz2'):
+    raise Exception(f"unknown extension {ext}")
+
+  with FileReader(fn) as f:
+    dat = f.read()
+  if ext == ".bz2" or dat.startswith(b'BZh9'):
+    dat = bz2.decompress(dat)
+  return dat
+
+
+def populate(fn):
+  log_path, index_path = cache_paths(fn)
+  dat = _read_decompressed(fn)
+  index = build_index(dat)
+
+  # the index is written last, its presence marks a complete entry
+  with atomic_write_in_dir(log_path, mode="wb", overwrite=True) as f:
+    f.write(dat)
+  with atomic_write_in_dir(index_path, mode="wb", overwrite=True) as f:
+    np.save(f, index, allow_pickle=False)
+  return log_path, index_path
+
+
+def cache_log(fn):
+  """Downloads, decompresses and indexes a log unless it is cached already. Returns its cache paths."""
+  log_path, index_path = cache_paths(fn)
+  if not (os.path.isfile(index_path) and os.path.isfile(log_path)):
+    populate(fn)
+  return log_path, index_path
+
+
+def open_cached_log(fn):
+  """Returns the decompressed log, memory mapped, and its index.
+     The log is downloaded, decompressed and indexed on the first call only."""
+  log_path, index_path = cache_log(fn)
+
+  index = np.load(index_path, allow_pickle=False)
+  assert index.dtype == INDEX_DTYPE, f"stale index {index_path}"
+
+  with open(log_path, "rb") as f:
+    dat = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+  # mtime marks recent use for pruning
+  os.utime(index_path)
+  return dat, index
+
+
+def cache_entries():
+  """Returns (last used, size, log path, index path) for every cached log, oldest first."""
+  entries = []
+  mkdirs_exists_ok(CACHE_DIR)
+  with os.scandir(CACHE_DIR) as it:
+    for e in it:
+      if not e.name.endswith(INDEX_EXT):
+        continue
+      index_path = e.path
+      log_path = index_path[:-len(INDEX_EXT)] + LOG_EXT
+      try:
+        size = os.path.getsize(log_path) + e.stat().st_size
+        entries.append((e.stat().st_mtime, size, log_path, index_path))
+      except FileNotFoundError:
+        continue
+  return sorted(entries)
+
+
+def prune(max_size=None, max_age=None):
+  """Removes cached logs not used in max_age seconds, then the least recently used
+     ones until the cache holds at most max_size bytes. Returns the bytes freed."""
+  entries = cache_entries()
+  total = sum(size for _, size, _, _ in entries)
+  now = time.time()
+  freed = 0
+  for last_used, size, log_path, index_path in entries:
+    too_old = max_age is not None and now - last_used > max_age
+    too_big = max_size is not None and total - freed > max_size
+    if not (too_old or too_big):
+      continue
+    for path in (index_path, log_path):
+      try:
+        os.remove(path)
+      except FileNotFoundError:
+        pass
+    freed += size
+  return freed
+
+
+def parse_size(s):
+  units = {'K': 1e3, 'M': 1e6, 'G': 1e9, 'T': 1e12}
+  if s[-1].upper() in units:
+    return int(float(s[:-1]) * units[s[-1].upper()])
+  return int(s)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Inspect and prune the cache of decompressed, indexed logs")
+  subparsers = parser.add_subparsers(dest="cmd", required=True)
+  subparsers.add_parser("ls", help="List cached logs, least recently used first")
+  prune_parser = subparsers.add_parser("prune", help="Remove cached logs")
+  prune_parser.add_argument("--max-size", type=parse_size, help="Keep at most this many bytes, e.g. 20G")
+  prune_parser.add_argument("--max-age", type=float, help="Remove logs not used in this many days")
+  args = parser.parse_args()
+
+  if args.cmd == "ls":
+    entries = cache_entries()
+    for last_used, size, log_path, _ in entries:
+      print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(last_used))}  {size / 1e6:9.1f} MB  {os.path.basename(log_path)}")
+    print(f"{len(entries)} logs, {sum(e[1] for e in entries) / 1e6:.1f} MB total")
+  else:
+    max_age = args.max_age * 24 * 60 * 60 if args.max_age is not None else None
+    freed = prune(max_size=args.max_size, max_age=max_age)
+    print(f"freed {freed / 1e6:.1f} MB")
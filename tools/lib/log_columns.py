@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+import os
+import json
+import argparse
+from functools import reduce
+from hashlib import sha256
+from multiprocessing import Pool
+from typing import Dict, List
+
+import capnp
+import numpy as np
+
+from tools.lib.cache import cache_path_for_file_path
+from tools.lib.log_cache import cache_key
+from tools.lib.logreader import LogReader
+
+Columns = Dict[str, Dict[str, np.ndarray]]
+
+# columns present for every service
+EVENT_FIELDS = ('logMonoTime', 'valid')
+
+
+def _scalar(v):
+  if isinstance(v, (bool, int, float, str, bytes)):
+    return v
+  if isinstance(v, capnp.lib.capnp._DynamicEnum):
+    return str(v)
+  raise TypeError(f"{type(v).__name__} is not a scalar field")
+
+
+def _field_spec(fields):
+  return {service: sorted(set(paths)) for service, paths in sorted(fields.items())}
+
+
+def columns_from_events(events, fields) -> Columns:
+  """Converts the selected fields of events into one array per field.
+
+     fields maps a service to field paths relative to it, e.g.
+     {'controlsState': ['cumLagMs'], 'radarState': ['leadOne.dRel', 'leadOne.status']}.
+     Every service also gets logMonoTime and valid columns."""
+  fields = _field_spec(fields)
+  values: Dict[str, Dict[str, list]] = {s: {f: [] for f in EVENT_FIELDS + tuple(paths)} for s, paths in fields.items()}
+
+  for msg in events:
+    which = msg.which()
+    if which not in values:
+      continue
+
+    cols = values[which]
+    cols['logMonoTime'].append(msg.logMonoTime)
+    cols['valid'].append(msg.valid)
+
+    struct = getattr(msg, which)
+    for path in fields[which]:
+      cols[path].append(_scalar(reduce(getattr, path.split('.'), struct)))
+
+  return {s: {f: np.asarray(v) for f, v in cols.items()} for s, cols in values.items()}
+
+
+def concat_columns(columns: List[Columns]) -> Columns:
+  """Concatenates columns of consecutive segments or of many routes."""
+  if not len(columns):
+    return {}
+  return {s: {f: np.concatenate([c[s][f] for c in columns]) for f in columns[0][s]} for s in columns[0]}
+
+
+def cache_path_for_columns(log_path, fields):
+  # a local log overwritten in place gets a new key from its size and mtime
+  digest = sha256(json.dumps(_field_spec(fields)).encode()).hexdigest()[:16]
+  return f"{cache_path_for_file_path(log_path)}.{cache_key(log_path)}.{digest}.npz"
+
+
+def segment_columns(log_path, fields, cache=True) -> Columns:
+  """Columns for one log, sorted by logMonoTime and cached on disk per field selection."""
+  cache_path = cache_path_for_columns(log_path, fields)
+  if cache and os.path.isfile(cache_path):
+    with np.load(cache_path, allow_pickle=False) as dat:
+      columns: Columns = {}
+      for key in dat.files:
+        service, field = key.split('/', 1)
+        columns.setdefault(service, {})[field] = dat[key]
+      return columns
+
+  lr = LogReader(log_path, services=list(fields), sort_by_time=True)
+  columns = columns_from_events(lr, fields)
+
+  if cache:
+    tmp_path = cache_path + ".tmp.npz"
+    np.savez(tmp_path, **{f"{s}/{f}": v for s, cols in columns.items() for f, v in cols.items()})
+    os.replace(tmp_path, cache_path)
+  return columns
+
+
+def _segment_columns(args):
+  return segment_columns(*args)
+
+
+def route_columns(log_paths, fields, cache=True, processes=None) -> Columns:
+  """Columns for a list of logs, e.g. Route.log_paths(), loaded in parallel."""
+  log_paths = [p for p in log_paths if p is not None]
+  with Pool(processes) as pool:
+    columns = pool.map(_segment_columns, [(p, fields, cache) for p in log_paths])
+  return concat_columns(columns)
+
+
+if __name__ == "__main__":
+  from tools.lib.route import Route
+
+  parser = argparse.ArgumentParser(description="Export fields of a route to a columnar .npz file",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--qlog", action="store_true", help="Use qlogs instead of rlogs")
+  parser.add_argument("route", help="Route name")
+  parser.add_argument("out", help="Output .npz file")
+  parser.add_argument("fields", nargs="+", help="service.field paths, e.g. controlsState.cumLagMs")
+  args = parser.parse_args()
+
+  fields: Dict[str, List[str]] = {}
+  for f in args.fields:
+    service, _, path = f.partition('.')
+    fields.setdefault(service, [])
+    if path:
+      fields[service].append(path)
+
+  route = Route(args.route)
+  columns = route_columns(route.qlog_paths() if args.qlog else route.log_paths(), fields)
+  np.savez(args.out, **{f"{s}/{f}": v for s, cols in columns.items() for f, v in cols.items()})
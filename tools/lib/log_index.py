@@ -0,0 +1,142 @@
+import os
+import struct
+import urllib.parse
+import warnings
+import capnp
+import numpy as np
+
+from cereal import log as capnp_log
+from tools.lib.cache import cache_path_for_file_path
+
+INDEX_VERSION = 1
+INDEX_DTYPE = np.dtype([
+  ('offset', np.int64),
+  ('length', np.uint32),
+  ('logMonoTime', np.int64),
+  ('which', np.int16),
+])
+
+UNION_FIELDS = list(capnp_log.Event.schema.union_fields)
+UNION_IDS = {name: i for i, name in enumerate(UNION_FIELDS)}
+UNKNOWN_WHICH = -1
+
+
+def message_size(dat, offset):
+  """Returns the size in bytes of the capnp stream message starting at offset,
+     using only the segment table. Returns None if the message is truncated."""
+  if offset + 4 > len(dat):
+    return None
+  n_segments = struct.unpack_from('<I', dat, offset)[0] + 1
+  header = (4 * (n_segments + 1) + 7) & ~7
+  if offset + header > len(dat):
+    return None
+  size = header + 8 * sum(struct.unpack_from(f'<{n_segments}I', dat, offset + 4))
+  if offset + size > len(dat):
+    return None
+  return size
+
+
+def decode_event(dat, offset, length):
+  return capnp_log.Event.from_bytes(bytes(dat[offset:offset + length]))
+
+
+def build_index(dat):
+  """Frames every event in a decompressed log and records where it lives,
+     when it was logged and which service it belongs to."""
+  entries = []
+  offset = 0
+  while offset < len(dat):
+    length = message_size(dat, offset)
+    if length is None:
+      warnings.warn("Corrupted events detected", RuntimeWarning)
+      break
+
+    try:
+      evt = decode_event(dat, offset, length)
+      log_mono_time = evt.logMonoTime
+    except capnp.KjException:
+      warnings.warn("Corrupted events detected", RuntimeWarning)
+      break
+
+    try:
+      which = UNION_IDS.get(evt.which(), UNKNOWN_WHICH)
+    except capnp.KjException:
+      which = UNKNOWN_WHICH
+
+    entries.append((offset, length, log_mono_time, which))
+    offset += length
+
+  return np.array(entries, dtype=INDEX_DTYPE)
+
+
+def index_path_for_file_path(fn):
+  if urllib.parse.urlparse(fn).scheme == '':
+    return f"{fn}.idx{INDEX_VERSION}.npy"
+  return f"{cache_path_for_file_path(fn)}.idx{INDEX_VERSION}.npy"
+
+
+def _index_matches(index, dat):
+  if len(index) == 0:
+    return len(dat) == 0
+  last = index[-1]
+  return int(last['offset']) + int(last['length']) <= len(dat)
+
+
+def load_index(fn, dat):
+  """Loads the persisted index for fn, building and saving it if it is missing or stale."""
+  index = None
+  path = index_path_for_file_path(fn) if fn else None
+
+  if path is not None and os.path.isfile(path):
+    try:
+      index = np.load(path, allow_pickle=False)
+      if index.dtype != INDEX_DTYPE or not _index_matches(index, dat):
+        index = None
+    except (OSError, ValueError):
+      index = None
+
+  if index is None:
+    index = build_index(dat)
+    if path is not None:
+      try:
+        with open(path, 'wb') as f:
+          np.save(f, index, allow_pickle=False)
+      except OSError:
+        pass
+
+  return index
+
+
+def service_ids(services):
+  unknown = [s for s in services if s not in UNION_IDS]
+  if unknown:
+    raise ValueError(f"unknown services {unknown}")
+  return [UNION_IDS[s] for s in services]
+
+
+class LazyEvents:
+  """Sequence of events backed by a decompressed log and an index.
+     Events are only decoded when accessed."""
+  def __init__(self, dat, index):
+    self._dat = dat
+    self._index = index
+
+  def __len__(self):
+    return len(self._index)
+
+  def __getitem__(self, i):
+    if isinstance(i, slice):
+      return self.reindex(self._index[i])
+    ent = self._index[i]
+    return decode_event(self._dat, int(ent['offset']), int(ent['length']))
+
+  def __iter__(self):
+    for offset, length in zip(self._index['offset'].tolist(), self._index['length'].tolist()):
+      yield decode_event(self._dat, offset, length)
+
+  def reindex(self, index):
+    return LazyEvents(self._dat, index)
+
+  @property
+  def index(self):
+    return self._index
@@ -2,31 +2,57 @@
 import os
 import sys
 import bz2
+import bisect
 import urllib.parse
 import capnp
 import warnings
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 
 from cereal import log as capnp_log
 from tools.lib.filereader import FileReader
+from tools.lib.log_cache import open_cached_log
+from tools.lib.log_index import LazyEvents, UNKNOWN_WHICH, decode_event, load_index, message_size, service_ids
 from tools.lib.route import Route, SegmentName
+from tools.lib.url_file import URLFile
+
+STREAM_CHUNK_SIZE = 1024 * 1024
 
 # this is an iterator itself, and uses private variables from LogReader
+# with prefetch > 0 the next segments are loaded in the background, close it or use it as a context manager
 class MultiLogIterator:
-  def __init__(self, log_paths, sort_by_time=False):
+  def __init__(self, log_paths, sort_by_time=False, prefetch=0, cache=False):
     self._log_paths = log_paths
     self.sort_by_time = sort_by_time
+    self.prefetch = prefetch
+    self.cache = cache
 
     self._first_log_idx = next(i for i in range(len(log_paths)) if log_paths[i] is not None)
     self._current_log = self._first_log_idx
     self._idx = 0
     self._log_readers = [None]*len(log_paths)
+    self._pending = {}
+    self._pool = ThreadPoolExecutor(max_workers=prefetch) if prefetch > 0 else None
     self.start_time = self._log_reader(self._first_log_idx)._ts[0]
 
+  def _load(self, i):
+    return LogReader(self._log_paths[i], sort_by_time=self.sort_by_time, cache=self.cache)
+
+  def _prefetch(self, i):
+    # download and parse the next segments while this one is consumed
+    for j in range(i + 1, min(i + 1 + self.prefetch, len(self._log_paths))):
+      if self._log_readers[j] is None and self._log_paths[j] is not None and j not in self._pending:
+        self._pending[j] = self._pool.submit(self._load, j)
+
   def _log_reader(self, i):
     if self._log_readers[i] is None and self._log_paths[i] is not None:
-      log_path = self._log_paths[i]
-      self._log_readers[i] = LogReader(log_path, sort_by_time=self.sort_by_time)
+      if i in self._pending:
+        self._log_readers[i] = self._pending.pop(i).result()
+      else:
+        self._log_readers[i] = self._load(i)
+      if self._pool is not None:
+        self._prefetch(i)
 
     return self._log_readers[i]
 
@@ -63,23 +89,56 @@ class MultiLogIterator:
 
     self._current_log = minute
 
-    # HACK: O(n) seek afterward
-    self._idx = 0
-    while self.tell() < ts:
+    if not self.sort_by_time:
+      # timestamps aren't ordered, walk forward
+      self._idx = 0
+      while self.tell() < ts:
+        self._inc()
+      return True
+
+    lr = self._log_reader(minute)
+    self._idx = bisect.bisect_left(lr._ts, self.start_time + ts * 1e9)
+    if self._idx >= len(lr._ents):
+      self._idx = len(lr._ents) - 1
       self._inc()
     return True
 
+  def close(self):
+    if self._pool is not None:
+      for f in self._pending.values():
+        f.cancel()
+      self._pending = {}
+      self._pool.shutdown(wait=False)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def __del__(self):
+    if getattr(self, "_pool", None) is not None:
+      self.close()
+
   def reset(self):
-    self.__init__(self._log_paths, sort_by_time=self.sort_by_time)
+    self.close()
+    self.__init__(self._log_paths, sort_by_time=self.sort_by_time, prefetch=self.prefetch, cache=self.cache)
 
 
 class LogReader:
-  def __init__(self, fn, canonicalize=True, only_union_types=False, sort_by_time=False, dat=None):
+  def __init__(self, fn, canonicalize=True, only_union_types=False, sort_by_time=False, dat=None, services=None, indexed=False,
+               cache=False):
     self.data_version = None
     self._only_union_types = only_union_types
+    self._sort_by_time = sort_by_time
+    self._sorted = None
 
     ext = None
-    if not dat:
+    index = None
+    if cache:
+      # decompressed and indexed once, shared by every tool that opens this log
+      dat, index = open_cached_log(fn)
+    elif not dat:
       _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
       if ext not in ('', '.bz2'):
         # old rlogs weren't bz2 compressed
@@ -88,9 +147,23 @@ class LogReader:
       with FileReader(fn) as f:
         dat = f.read()
 
-    if ext == ".bz2" or dat.startswith(b'BZh9'):
+    if index is None and (ext == ".bz2" or dat.startswith(b'BZh9')):
       dat = bz2.decompress(dat)
 
+    if index is not None or indexed or services is not None:
+      # only frame the log, events are decoded on access
+      if index is None:
+        index = load_index(fn, dat)
+      if services is not None:
+        index = index[np.isin(index['which'], service_ids(services))]
+      if only_union_types:
+        index = index[index['which'] != UNKNOWN_WHICH]
+      if sort_by_time:
+        index = index[np.argsort(index['logMonoTime'], kind='stable')]
+      self._ents = LazyEvents(dat, index)
+      self._ts = index['logMonoTime']
+      return
+
     ents = capnp_log.Event.read_multiple_bytes(dat)
 
     _ents = []
@@ -104,12 +177,32 @@ class LogReader:
     self._ts = [x.logMonoTime for x in self._ents]
 
   @classmethod
-  def from_bytes(cls, dat):
-    return cls("", dat=dat)
+  def from_bytes(cls, dat, **kwargs):
+    return cls("", dat=dat, **kwargs)
+
+  def _time_sorted(self):
+    if self._sort_by_time:
+      return self._ents, self._ts
+
+    if self._sorted is None:
+      if isinstance(self._ents, LazyEvents):
+        index = self._ents.index[np.argsort(self._ts, kind='stable')]
+        self._sorted = (self._ents.reindex(index), index['logMonoTime'])
+      else:
+        ents = sorted(self._ents, key=lambda x: x.logMonoTime)
+        self._sorted = (ents, [x.logMonoTime for x in ents])
+    return self._sorted
+
+  def slice(self, start_time, end_time):
+    """Returns the events with start_time <= logMonoTime < end_time, in time order."""
+    ents, ts = self._time_sorted()
+    lo = bisect.bisect_left(ts, start_time)
+    hi = bisect.bisect_left(ts, end_time, lo=lo)
+    return ents[lo:hi]
 
   def __iter__(self):
     for ent in self._ents:
-      if self._only_union_types:
+      if self._only_union_types and not isinstance(self._ents, LazyEvents):
         try:
           ent.which()
           yield ent
@@ -118,13 +211,90 @@ class LogReader:
       else:
         yield ent
 
-def logreader_from_route_or_segment(r, sort_by_time=False):
+def _read_chunks(fn, chunk_size):
+  with FileReader(fn) as f:
+    if isinstance(f, URLFile):
+      pos, length = 0, f.get_length()
+      while pos < length:
+        dat = f.read(ll=min(chunk_size, length - pos))
+        if not dat:
+          break
+        pos += len(dat)
+        yield dat
+    else:
+      while dat := f.read(chunk_size):
+        yield dat
+
+
+def _decompress_chunks(chunks, bz2_compressed, chunk_size):
+  decompressor = None
+  for dat in chunks:
+    if decompressor is None:
+      if not (bz2_compressed or dat.startswith(b'BZh9')):
+        yield dat
+        yield from chunks
+        return
+      decompressor = bz2.BZ2Decompressor()
+
+    # cap the output per call so memory stays bounded on highly compressible logs
+    while True:
+      out = decompressor.decompress(dat, max_length=chunk_size)
+      dat = b""
+      if out:
+        yield out
+      if decompressor.eof:
+        # concatenated streams
+        dat = decompressor.unused_data
+        decompressor = bz2.BZ2Decompressor()
+        if not dat:
+          break
+      elif decompressor.needs_input:
+        break
+
+
+def stream_log(fn, services=None, chunk_size=STREAM_CHUNK_SIZE):
+  """Yields the events of a log as soon as each one is fully decompressed,
+     reading and decompressing the file chunk by chunk."""
+  _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
+  if ext not in ('', '.bz2'):
+    raise Exception(f"unknown extension {ext}")
+
+  wanted = None if services is None else set(services)
+  if wanted is not None:
+    service_ids(wanted)
+
+  buf = bytearray()
+  for dat in _decompress_chunks(_read_chunks(fn, chunk_size), ext == ".bz2", chunk_size):
+    buf += dat
+    offset = 0
+    while (length := message_size(buf, offset)) is not None:
+      try:
+        evt = decode_event(buf, offset, length)
+      except capnp.KjException:
+        warnings.warn("Corrupted events detected", RuntimeWarning)
+        return
+      offset += length
+
+      if wanted is not None:
+        try:
+          if evt.which() not in wanted:
+            continue
+        except capnp.KjException:
+          continue
+      yield evt
+    del buf[:offset]
+
+  if len(buf):
+    warnings.warn("Corrupted events detected", RuntimeWarning)
+
+
+def logreader_from_route_or_segment(r, sort_by_time=False, cache=False):
   sn = SegmentName(r, allow_route_name=True)
   route = Route(sn.route_name.canonical_name)
   if sn.segment_num < 0:
-    return MultiLogIterator(route.log_paths(), sort_by_time=sort_by_time)
+    return MultiLogIterator(route.log_paths(), sort_by_time=sort_by_time, cache=cache)
   else:
-    return LogReader(route.log_paths()[sn.segment_num], sort_by_time=sort_by_time)
+    return LogReader(route.log_paths()[sn.segment_num], sort_by_time=sort_by_time, cache=cache)
 
 
 if __name__ == "__main__":
@@ -4,6 +4,7 @@ import shutil
 import unittest
 
 os.environ["COMMA_CACHE"] = "/tmp/__test_cache__"
+from tools.lib import url_file
 from tools.lib.url_file import URLFile, CACHE_DIR
 
 
@@ -65,5 +66,40 @@ class TestFileDownload(unittest.TestCase):
     self.compare_loads(large_file_url)
 
 
+class TestCacheEviction(unittest.TestCase):
+  def setUp(self):
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+    os.makedirs(CACHE_DIR)
+    self.cache_size = url_file.CACHE_SIZE
+    url_file.CACHE_SIZE = 10 * 1000
+
+  def tearDown(self):
+    url_file.CACHE_SIZE = self.cache_size
+
+  def _add(self, name, size, mtime):
+    path = os.path.join(CACHE_DIR, name)
+    with open(path, "wb") as f:
+      f.write(b"\0" * size)
+    os.utime(path, (mtime, mtime))
+    url_file.cache_add(size)
+    return path
+
+  def test_lru_eviction(self):
+    paths = [self._add(f"chunk_{i}", 1000, 1000 + i) for i in range(10)]
+    self.assertTrue(all(os.path.exists(p) for p in paths))
+
+    # a hit makes the oldest chunk the most recently used
+    url_file.cache_touch(paths[0])
+
+    self._add("chunk_10", 1000, 2000)
+    remaining = [os.path.exists(p) for p in paths]
+    self.assertTrue(remaining[0])
+    self.assertFalse(any(remaining[1:3]))
+    self.assertTrue(all(remaining[3:]))
+
+    with open(os.path.join(CACHE_DIR, url_file.CACHE_INDEX)) as f:
+      self.assertEqual(int(f.read()), 9 * 1000)
+
+
 if __name__ == "__main__":
   unittest.main()
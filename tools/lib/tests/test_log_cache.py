@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+import bz2
+import os
+import tempfile
+import unittest
+
+from tools.lib import log_cache
+from tools.lib.logreader import LogReader
+from tools.lib.tests.test_log_index import make_log
+
+
+class TestLogCache(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.dat = make_log(500)
+    self.fn = os.path.join(self.tmpdir.name, "rlog.bz2")
+    with open(self.fn, "wb") as f:
+      f.write(bz2.compress(self.dat))
+
+  def tearDown(self):
+    for path in log_cache.cache_paths(self.fn):
+      if os.path.exists(path):
+        os.remove(path)
+    self.tmpdir.cleanup()
+
+  def test_cached_logreader(self):
+    reference = [m.as_builder().to_bytes() for m in LogReader.from_bytes(self.dat)]
+
+    # first open populates the cache, second one maps it
+    for _ in range(2):
+      lr = LogReader(self.fn, cache=True)
+      self.assertEqual([m.as_builder().to_bytes() for m in lr], reference)
+      self.assertTrue(all(os.path.isfile(p) for p in log_cache.cache_paths(self.fn)))
+
+    lr = LogReader(self.fn, cache=True, services=['carState'], sort_by_time=True)
+    self.assertEqual({m.which() for m in lr}, {'carState'})
+
+  def test_key_changes_with_file(self):
+    key = log_cache.cache_key(self.fn)
+    with open(self.fn, "ab") as f:
+      f.write(bz2.compress(self.dat))
+    self.assertNotEqual(log_cache.cache_key(self.fn), key)
+
+  def test_prune(self):
+    log_path, index_path = log_cache.populate(self.fn)
+    self.assertIn(log_path, [e[2] for e in log_cache.cache_entries()])
+
+    log_cache.prune(max_age=3600)
+    self.assertTrue(os.path.isfile(log_path))
+
+    log_cache.prune(max_size=0)
+    self.assertFalse(os.path.exists(log_path))
+    self.assertFalse(os.path.exists(index_path))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+import bz2
+import os
+import tempfile
+import unittest
+import numpy as np
+
+import cereal.messaging as messaging
+from tools.lib.log_columns import columns_from_events, concat_columns, segment_columns
+from tools.lib.logreader import LogReader
+
+FIELDS = {'controlsState': ['cumLagMs', 'state'], 'radarState': ['leadOne.dRel']}
+
+
+def make_log(n=200):
+  dat = b""
+  for i in range(n):
+    msg = messaging.new_message('controlsState' if i % 2 else 'radarState')
+    msg.logMonoTime = i * int(1e7)
+    msg.valid = i % 5 != 0
+    if i % 2:
+      msg.controlsState.cumLagMs = i / 10
+      msg.controlsState.state = 'enabled' if i % 3 else 'disabled'
+    else:
+      msg.radarState.leadOne.dRel = float(i)
+    dat += msg.to_bytes()
+  return dat
+
+
+class TestLogColumns(unittest.TestCase):
+  def setUp(self):
+    self.dat = make_log()
+    self.msgs = list(LogReader.from_bytes(self.dat))
+
+  def test_columns(self):
+    columns = columns_from_events(self.msgs, FIELDS)
+    cs = [m for m in self.msgs if m.which() == 'controlsState']
+    np.testing.assert_equal(columns['controlsState']['logMonoTime'], [m.logMonoTime for m in cs])
+    np.testing.assert_equal(columns['controlsState']['valid'], [m.valid for m in cs])
+    np.testing.assert_allclose(columns['controlsState']['cumLagMs'], [m.controlsState.cumLagMs for m in cs])
+    np.testing.assert_equal(columns['controlsState']['state'], [str(m.controlsState.state) for m in cs])
+    np.testing.assert_allclose(columns['radarState']['leadOne.dRel'], np.arange(0, 200, 2))
+
+    with self.assertRaises(TypeError):
+      columns_from_events(self.msgs, {'radarState': ['leadOne']})
+
+  def test_segment_cache(self):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      fn = os.path.join(tmpdir, "rlog.bz2")
+      with open(fn, "wb") as f:
+        f.write(bz2.compress(self.dat))
+
+      parsed = segment_columns(fn, FIELDS)
+      cached = segment_columns(fn, FIELDS)
+      for s in parsed:
+        for f in parsed[s]:
+          np.testing.assert_equal(parsed[s][f], cached[s][f])
+
+      both = concat_columns([parsed, cached])
+      self.assertEqual(len(both['radarState']['logMonoTime']), 200)
+
+      # a log overwritten in place isn't read from the cache
+      with open(fn, "wb") as f:
+        f.write(bz2.compress(make_log(100)))
+      os.utime(fn, ns=(0, 0))
+      self.assertEqual(len(segment_columns(fn, FIELDS)['radarState']['logMonoTime']), 50)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+import bz2
+import os
+import tempfile
+import unittest
+
+import cereal.messaging as messaging
+from tools.lib.log_index import build_index, index_path_for_file_path, message_size
+from tools.lib.logreader import LogReader, MultiLogIterator, stream_log
+
+SERVICES = ['carState', 'radarState', 'controlsState']
+
+
+def make_log(n=300, start_time=int(1e9), dt=int(1e7)):
+  dat = b""
+  for i in range(n):
+    msg = messaging.new_message(SERVICES[i % len(SERVICES)])
+    # slightly out of order, like a real log
+    msg.logMonoTime = start_time + i * dt + (dt // 2 if i % 7 == 0 else 0)
+    dat += msg.to_bytes()
+  return dat
+
+
+class TestLogIndex(unittest.TestCase):
+  def setUp(self):
+    self.dat = make_log()
+    self.reference = list(LogReader.from_bytes(self.dat))
+
+  def test_framing(self):
+    offset, count = 0, 0
+    while offset < len(self.dat):
+      offset += message_size(self.dat, offset)
+      count += 1
+    self.assertEqual(offset, len(self.dat))
+    self.assertEqual(count, len(self.reference))
+    self.assertIsNone(message_size(self.dat[:16], 0))
+
+  def test_index_matches_eager(self):
+    index = build_index(self.dat)
+    self.assertEqual(list(index['logMonoTime']), [m.logMonoTime for m in self.reference])
+
+    lr = LogReader.from_bytes(self.dat, indexed=True)
+    self.assertEqual(len(list(lr)), len(self.reference))
+    for a, b in zip(lr, self.reference):
+      self.assertEqual(a.as_builder().to_bytes(), b.as_builder().to_bytes())
+
+  def test_services(self):
+    lr = LogReader.from_bytes(self.dat, services=['carState', 'radarState'])
+    expected = [m.logMonoTime for m in self.reference if m.which() in ('carState', 'radarState')]
+    self.assertEqual([m.logMonoTime for m in lr], expected)
+
+    with self.assertRaises(ValueError):
+      LogReader.from_bytes(self.dat, services=['notAService'])
+
+  def test_slice(self):
+    t0, t1 = int(1.5e9), int(2.5e9)
+    expected = sorted(m.logMonoTime for m in self.reference if t0 <= m.logMonoTime < t1)
+    for kwargs in ({}, {'sort_by_time': True}, {'indexed': True}, {'indexed': True, 'sort_by_time': True}):
+      lr = LogReader.from_bytes(self.dat, **kwargs)
+      self.assertEqual([m.logMonoTime for m in lr.slice(t0, t1)], expected, kwargs)
+
+  def test_persisted_index(self):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      fn = os.path.join(tmpdir, "rlog.bz2")
+      with open(fn, "wb") as f:
+        f.write(bz2.compress(self.dat))
+
+      lr = LogReader(fn, indexed=True)
+      self.assertTrue(os.path.isfile(index_path_for_file_path(fn)))
+      first = [m.logMonoTime for m in lr]
+
+      lr = LogReader(fn, indexed=True)
+      self.assertEqual([m.logMonoTime for m in lr], first)
+
+
+class TestStreamLog(unittest.TestCase):
+  def test_stream_matches_eager(self):
+    dat = make_log(1000)
+    reference = [m.as_builder().to_bytes() for m in LogReader.from_bytes(dat)]
+    with tempfile.TemporaryDirectory() as tmpdir:
+      for name, contents in (("rlog", dat), ("rlog.bz2", bz2.compress(dat)),
+                             ("concat_rlog.bz2", bz2.compress(dat[:len(dat) // 2]) + bz2.compress(dat[len(dat) // 2:]))):
+        fn = os.path.join(tmpdir, name)
+        with open(fn, "wb") as f:
+          f.write(contents)
+
+        for chunk_size in (100, 4096, 1024 * 1024):
+          streamed = [m.as_builder().to_bytes() for m in stream_log(fn, chunk_size=chunk_size)]
+          self.assertEqual(streamed, reference, (name, chunk_size))
+
+      services = [m.which() for m in stream_log(os.path.join(tmpdir, "rlog.bz2"), services=['radarState'])]
+      self.assertEqual(services, ['radarState'] * (1000 // len(SERVICES)))
+
+
+class TestMultiLogIterator(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.log_paths = []
+    for seg in range(5):
+      if seg == 2:
+        self.log_paths.append(None)
+        continue
+      fn = os.path.join(self.tmpdir.name, f"{seg}_rlog.bz2")
+      with open(fn, "wb") as f:
+        f.write(bz2.compress(make_log(600, start_time=seg * int(60e9), dt=int(1e8))))
+      self.log_paths.append(fn)
+
+  def tearDown(self):
+    self.tmpdir.cleanup()
+
+  def test_prefetch(self):
+    expected = [m.logMonoTime for m in MultiLogIterator(self.log_paths, sort_by_time=True, prefetch=0)]
+    for prefetch in (1, 2):
+      with MultiLogIterator(self.log_paths, sort_by_time=True, prefetch=prefetch) as lr:
+        self.assertEqual([m.logMonoTime for m in lr], expected)
+
+  def test_seek(self):
+    for sort_by_time in (True, False):
+      lr = MultiLogIterator(self.log_paths, sort_by_time=sort_by_time)
+      for ts in (0, 30.05, 61.0, 200.0, 59.99):
+        self.assertTrue(lr.seek(ts))
+        self.assertGreaterEqual(lr.tell(), ts)
+        self.assertLess(lr.tell(), ts + 0.2)
+      self.assertFalse(lr.seek(150))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -2,10 +2,13 @@
 
 import os
 import time
+import fcntl
 import tempfile
 import threading
 import urllib.parse
 import pycurl
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from hashlib import sha256
 from io import BytesIO
 from tenacity import retry, wait_random_exponential, stop_after_attempt
@@ -15,6 +18,17 @@ K = 1000
 CHUNK_SIZE = 1000 * K
 
 CACHE_DIR = os.environ.get("COMMA_CACHE", "/tmp/comma_download_cache/")
+#  Max size of the download cache in bytes, least recently used chunks are evicted past it
+CACHE_SIZE = int(os.environ.get("COMMA_CACHE_SIZE", 10 * 1000 * 1000 * K))
+#  Evict down to this fraction of CACHE_SIZE so eviction doesn't run on every new chunk
+CACHE_LOW_WATER = 0.9
+CACHE_INDEX = ".index"
+CACHE_LOCK = ".lock"
+
+#  Reads larger than this are split in chunks and downloaded concurrently
+PARALLEL_READ_SIZE = 2 * CHUNK_SIZE
+DOWNLOAD_WORKERS = int(os.environ.get("COMMA_DOWNLOAD_WORKERS", "8"))
+_download_pool = None
 
 
 def hash_256(link):
@@ -22,6 +36,87 @@ def hash_256(link):
   return hsh
 
 
+def get_download_pool():
+  global _download_pool
+  if _download_pool is None:
+    _download_pool = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS)
+  return _download_pool
+
+
+@contextmanager
+def cache_lock():
+  with open(os.path.join(CACHE_DIR, CACHE_LOCK), "w") as f:
+    fcntl.flock(f, fcntl.LOCK_EX)
+    try:
+      yield
+    finally:
+      fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _read_cache_index():
+  try:
+    with open(os.path.join(CACHE_DIR, CACHE_INDEX)) as f:
+      return int(f.read())
+  except (OSError, ValueError):
+    return None
+
+
+def _write_cache_index(total):
+  with atomic_write_in_dir(os.path.join(CACHE_DIR, CACHE_INDEX), mode="w", overwrite=True) as f:
+    f.write(str(total))
+
+
+def _cache_entries():
+  entries = []
+  with os.scandir(CACHE_DIR) as it:
+    for e in it:
+      if e.name.startswith(".") or not e.is_file():
+        continue
+      try:
+        st = e.stat()
+      except FileNotFoundError:
+        continue
+      entries.append((st.st_mtime, st.st_size, e.path))
+  return entries
+
+
+def evict_cache(target_size):
+  """Removes least recently used cache files until the cache is at most target_size bytes.
+     Returns the resulting cache size."""
+  entries = sorted(_cache_entries())
+  total = sum(size for _, size, _ in entries)
+  for _, size, path in entries:
+    if total <= target_size:
+      break
+    try:
+      os.remove(path)
+    except FileNotFoundError:
+      pass
+    total -= size
+  return total
+
+
+def cache_add(size):
+  """Accounts for a new file in the cache index, evicting old files if the cache is full."""
+  with cache_lock():
+    total = _read_cache_index()
+    if total is None:
+      total = sum(size for _, size, _ in _cache_entries())
+    else:
+      total += size
+    if total > CACHE_SIZE:
+      total = evict_cache(int(CACHE_SIZE * CACHE_LOW_WATER))
+    _write_cache_index(total)
+
+
+def cache_touch(path):
+  #  mtime is the LRU timestamp
+  try:
+    os.utime(path)
+  except OSError:
+    pass
+
+
 class URLFile:
   _tlocal = threading.local()
 
@@ -77,58 +172,88 @@ class URLFile:
 
     self._length = self.get_length_online()
     if not self._force_download:
-      with atomic_write_in_dir(file_length_path, mode="w") as file_length:
+      with atomic_write_in_dir(file_length_path, mode="w", overwrite=True) as file_length:
         file_length.write(str(self._length))
+      cache_add(len(str(self._length)))
     return self._length
 
+  def _download_chunk(self, position):
+    file_name = hash_256(self._url) + "_" + str(position / CHUNK_SIZE)
+    full_path = os.path.join(CACHE_DIR, file_name)
+    data = self._read_range(position, CHUNK_SIZE)
+    with atomic_write_in_dir(full_path, mode="wb", overwrite=True) as new_cached_file:
+      new_cached_file.write(data)
+    cache_add(len(data))
+    return data
+
+  def _read_parallel(self, file_begin, file_end):
+    positions = range(file_begin, file_end, CHUNK_SIZE)
+    chunks = get_download_pool().map(lambda p: self._read_range(p, min(CHUNK_SIZE, file_end - p)), positions)
+    return b"".join(chunks)
+
   def read(self, ll=None):
     if self._force_download:
+      file_end = self._pos + ll if ll is not None else self.get_length()
+      if file_end - self._pos >= PARALLEL_READ_SIZE:
+        file_end = min(file_end, self.get_length())
+        response = self._read_parallel(self._pos, file_end)
+        self._pos += len(response)
+        return response
       return self.read_aux(ll=ll)
 
     file_begin = self._pos
-    file_end = self._pos + ll if ll is not None else self.get_length()
-    assert file_end != -1, f"Remote file is empty or doesn't exist: {self._url}"
+    length = self.get_length()
+    assert length != -1, f"Remote file is empty or doesn't exist: {self._url}"
+    file_end = min(self._pos + ll, length) if ll is not None else length
     #  We have to align with chunks we store. Position is the begginiing of the latest chunk that starts before or at our file
-    position = (file_begin // CHUNK_SIZE) * CHUNK_SIZE
-    response = b""
-    while True:
-      self._pos = position
-      chunk_number = self._pos / CHUNK_SIZE
-      file_name = hash_256(self._url) + "_" + str(chunk_number)
-      full_path = os.path.join(CACHE_DIR, str(file_name))
-      data = None
-      #  If we don't have a file, download it
-      if not os.path.exists(full_path):
-        data = self.read_aux(ll=CHUNK_SIZE)
-        with atomic_write_in_dir(full_path, mode="wb") as new_cached_file:
-          new_cached_file.write(data)
-      else:
+    positions = range((file_begin // CHUNK_SIZE) * CHUNK_SIZE, file_end, CHUNK_SIZE)
+    chunks = {}
+    missing = []
+    for position in positions:
+      full_path = os.path.join(CACHE_DIR, hash_256(self._url) + "_" + str(position / CHUNK_SIZE))
+      try:
         with open(full_path, "rb") as cached_file:
-          data = cached_file.read()
+          chunks[position] = cached_file.read()
+        cache_touch(full_path)
+      except FileNotFoundError:
+        missing.append(position)
+
+    #  If we don't have a chunk, download it. Several missing chunks are fetched concurrently
+    if len(missing) > 1:
+      chunks.update(zip(missing, get_download_pool().map(self._download_chunk, missing)))
+    elif len(missing) == 1:
+      chunks[missing[0]] = self._download_chunk(missing[0])
+
+    response = b"".join(chunks[position][max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)]
+                        for position in positions)
+    self._pos = file_end
+    return response
 
-      response += data[max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)]
-
-      position += CHUNK_SIZE
-      if position >= file_end:
-        self._pos = file_end
-        return response
+  def read_aux(self, ll=None):
+    ret = self._read_range(self._pos, ll)
+    self._pos += len(ret)
+    return ret
 
   @retry(wait=wait_random_exponential(multiplier=1, max=5), stop=stop_after_attempt(3), reraise=True)
-  def read_aux(self, ll=None):
+  def _read_range(self, pos, ll=None):
     download_range = False
     headers = ["Connection: keep-alive"]
-    if self._pos != 0 or ll is not None:
+    if pos != 0 or ll is not None:
       if ll is None:
         end = self.get_length() - 1
       else:
-        end = min(self._pos + ll, self.get_length()) - 1
-      if self._pos >= end:
+        end = min(pos + ll, self.get_length()) - 1
+      if pos > end:
         return b""
-      headers.append(f"Range: bytes={self._pos}-{end}")
+      headers.append(f"Range: bytes={pos}-{end}")
       download_range = True
 
     dats = BytesIO()
-    c = self._curl
+    #  each download thread has its own handle
+    try:
+      c = self._tlocal.curl
+    except AttributeError:
+      c = self._tlocal.curl = pycurl.Curl()
     c.setopt(pycurl.URL, self._url)
     c.setopt(pycurl.WRITEDATA, dats)
     c.setopt(pycurl.NOSIGNAL, 1)
@@ -167,9 +292,7 @@ class URLFile:
     if (not download_range) and response_code != 200:  # OK
       raise Exception(f"Error {response_code} {headers} ({self._url}): {repr(dats.getvalue())[:500]}")
 
-    ret = dats.getvalue()
-    self._pos += len(ret)
-    return ret
+    return dats.getvalue()
 
   def seek(self, pos):
     self._pos = pos
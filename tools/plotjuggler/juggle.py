@@ -58,7 +58,7 @@ def load_segment(segment_name):
     return []
 
   try:
-    return list(LogReader(segment_name))
+    return list(LogReader(segment_name, cache=True))
   except (AssertionError, ValueError) as e:
     print(f"Error parsing {segment_name}: {e}")
     return []
@@ -10,7 +10,7 @@ os.environ['FILEREADER_CACHE'] = '1'
 from common.basedir import BASEDIR
 from common.realtime import config_realtime_process, Ratekeeper, DT_CTRL
 from selfdrive.boardd.boardd import can_capnp_to_can_list
-from tools.plotjuggler.juggle import load_segment
+from tools.lib.logreader import LogReader
 from panda import Panda
 
 try:
@@ -22,6 +22,11 @@ except ImportError:
   panda_jungle_imported = False
 
 
+def load_can_msgs(fn):
+  # decompressed and indexed once in the log cache, only can messages are decoded
+  return [can_capnp_to_can_list(m.can) for m in LogReader(fn, cache=True, services=['can'])]
+
+
 def send_thread(s, flock):
   if "Jungle" in str(type(s)):
     if "FLASH" in os.environ:
@@ -97,8 +102,8 @@ if __name__ == "__main__":
   CAN_MSGS = []
   logs = [f"https://commadataci.blob.core.windows.net/openpilotci/{ROUTE}/{i}/rlog.bz2" for i in REPLAY_SEGS]
   with multiprocessing.Pool(24) as pool:
-    for lr in tqdm(pool.map(load_segment, logs)):
-      CAN_MSGS += [can_capnp_to_can_list(m.can) for m in lr if m.which() == 'can']
+    for can_msgs in tqdm(pool.map(load_can_msgs, logs)):
+      CAN_MSGS += can_msgs
 
   # set both to cycle ignition
   IGN_ON = int(os.getenv("ON", "0"))